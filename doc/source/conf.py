@@ -40,7 +40,9 @@ class Mock(MagicMock):
     def __getattr__(cls, name):
             return MagicMock()
 
-MOCK_MODULES = ['pydrobert.kaldi._internal', '_internal', 'numpy']
+MOCK_MODULES = [
+    'pydrobert.kaldi._internal', '_internal', 'numpy', 'torch',
+    'torch.utils', 'torch.utils.data']
 sys.modules.update((mod_name, Mock()) for mod_name in MOCK_MODULES)
 import pydrobert.kaldi as kaldi
 kaldi._internal = Mock()
@@ -21,12 +21,19 @@ from __future__ import print_function
 import logging
 import sys
 
+from collections import deque
 from itertools import chain
 from math import log10
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
 
 from pydrobert.kaldi.eval import util as kaldi_eval_util
 from pydrobert.kaldi.io import open as kaldi_open
 from pydrobert.kaldi.io.argparse import KaldiParser
+from pydrobert.kaldi.io.enums import TableType
+from pydrobert.kaldi.io.util import parse_kaldi_input_path
 from pydrobert.kaldi.logging import kaldi_logger_decorator
 from pydrobert.kaldi.logging import kaldi_vlog_level_cmd_decorator
 from pydrobert.kaldi.logging import register_logger_for_kaldi
@@ -51,11 +58,14 @@ def _compute_error_rate_parse_args(args, logger):
         'ref_rspecifier', type='kaldi_rspecifier',
         help='Rspecifier pointing to reference (gold standard) transcriptions')
     parser.add_argument(
-        'hyp_rspecifier', type='kaldi_wspecifier',
-        help='Rspecifier pointing to hypothesis transcriptions')
+        'hyp_rspecifiers', nargs='+', metavar='hyp_rspecifier',
+        help='Rspecifier(s) pointing to hypothesis transcriptions, each '
+             'scored against the reference. A single hypothesis rspecifier '
+             'may be followed by a path to print results to. Default is '
+             'stdout.')
     parser.add_argument(
-        'out_path', nargs='?', default=None,
-        help='Path to print results to. Default is stdout.')
+        '--out-path', default=None,
+        help='A path to print results to. Default is stdout.')
     parser.add_argument(
         '--print-tables', type='kaldi_bool', default=False,
         help='If set, will print breakdown of insertions, deletions, and subs '
@@ -80,104 +90,426 @@ def _compute_error_rate_parse_args(args, logger):
         help='Whether to report accuracy (1 - error_rate) instead of '
              'the error rate'
     )
+    parser.add_argument(
+        '--num-jobs', type=int, default=1,
+        help='The number of processes to score utterances with. If greater '
+             'than 1, both rspecifiers must be (sorted) scripts'
+    )
+    parser.add_argument(
+        '--confidence-interval', type='kaldi_bool', default=False,
+        help='If set, will print a bootstrap confidence interval of the '
+             'error rate (or accuracy)')
+    parser.add_argument(
+        '--paired-test', type='kaldi_bool', default=False,
+        help='If set, will print a paired bootstrap test of the difference '
+             'between the error rate of the first hypothesis table and that '
+             'of each of the others, on the utterances they share')
+    parser.add_argument(
+        '--confidence', type=float, default=.95,
+        help='The probability mass of the confidence interval')
+    parser.add_argument(
+        '--bootstrap-samples', type=int, default=1000,
+        help='How many times to resample utterances for the confidence '
+             'interval and paired test')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seeds the bootstrap resampling')
     options = parser.parse_args(args)
+    # the trailing out_path of "ref hyp out_path" is the only positional
+    # that may be a path. A mistyped rspecifier among many hypotheses
+    # would otherwise be overwritten
+    if len(options.hyp_rspecifiers) == 2 and parse_kaldi_input_path(
+            options.hyp_rspecifiers[-1])[0] == TableType.NotATable:
+        if options.out_path is not None:
+            parser.error('out_path was specified twice')
+        options.out_path = options.hyp_rspecifiers.pop()
+    for rspecifier in options.hyp_rspecifiers:
+        if parse_kaldi_input_path(rspecifier)[0] == TableType.NotATable:
+            parser.error("'{}' is not an rspecifier".format(rspecifier))
+    if not 0 < options.confidence < 1:
+        parser.error('--confidence must be between 0 and 1')
+    if options.bootstrap_samples < 1:
+        parser.error('--bootstrap-samples must be positive')
+    if options.paired_test and len(options.hyp_rspecifiers) < 2:
+        parser.error('--paired-test requires at least two hyp_rspecifiers')
     return options
 
 
-@kaldi_vlog_level_cmd_decorator
-@kaldi_logger_decorator
-def compute_error_rate(args=None):
-    '''Compute error rates between reference and hypothesis token vectors
+# how many utterances compute-error-rate scores in one batch
+_ERROR_RATE_CHUNK_SIZE = 1000
 
-    Two common error rates in speech are the word (WER) and phone (PER),
-    though the computation is the same. Given a reference and hypothesis
-    sequence, the error rate is
 
-    >>> error_rate = (substitutions + insertions + deletions) / (
-    ...     ref_tokens * 100)
+def _keep_utterances(options):
+    # whether per-utterance errors are needed for bootstrapping
+    return options.confidence_interval or options.paired_test
+
+
+def _score_error_rate_ids(keys, ref_ids, ref_offsets, hyps, options, vocab,
+                          return_tables, stats):
+    # scores hyps against refs already mapped to ids and flattened (see
+    # kaldi_eval_util._batch_token_ids), adding to stats
+    keep_utterances = _keep_utterances(options)
+    res = kaldi_eval_util._edit_distance_encoded(
+        ref_ids, ref_offsets, hyps, options.insertion_cost,
+        options.deletion_cost, options.substitution_cost, return_tables,
+        vocab, 1, keep_utterances)
+    ref_lens = np.diff(ref_offsets)
+    stats['token_count'] += int(ref_offsets[-1])
+    if return_tables:
+        dists = res[0]
+        _merge_error_rate_tables(stats, res[1:5], ())
+    else:
+        dists = res
+    stats['edit'] += int(dists.sum())
+    if keep_utterances:
+        stats['keys'].extend(keys)
+        if options.include_inserts_in_cost:
+            stats['errors'].append(dists)
+        else:
+            stats['errors'].append(dists - res[5])
+        stats['ref_lens'].append(ref_lens)
 
-    Where the number of substitutions (e.g. ``A B C -> A D C``),
-    deletions (e.g. ``A B C -> A C``), and insertions (e.g.
-    ``A B C -> A D B C``) are determined by Levenshtein distance.
-    '''
-    logger = logging.getLogger(sys.argv[0])
-    if not logger.handlers:
-        logger.addHandler(logging.StreamHandler())
-    register_logger_for_kaldi(sys.argv[0])
-    options = _compute_error_rate_parse_args(args, logger)
-    global_edit = 0
-    global_token_count = 0
-    global_sents = 0
-    global_processed = 0
-    inserts = dict()
-    deletes = dict()
-    subs = dict()
-    totals = dict()
+
+def _score_error_rate_chunk(keys, refs, hyps, options, vocab, return_tables,
+                            stats):
+    # scores and empties keys, refs, and hyps, adding to stats
+    if not refs:
+        return
+    ref_ids, ref_offsets = kaldi_eval_util._batch_token_ids(refs, vocab)
+    _score_error_rate_ids(
+        keys, ref_ids, ref_offsets, hyps, options, vocab, return_tables,
+        stats)
+    del keys[:], refs[:], hyps[:]
+
+
+def _error_rate_keys(ref_table, hyp_table, options, hyp_rspecifier, logger,
+                     counts):
+    # walks the sequential readers in lock-step, yielding the keys in both
+    # while the readers are on them. counts['sents'] and counts['processed']
+    # are updated along the way. If a missing utterance is an error, sets
+    # counts['failed'] and stops
 
     def _err_on_utt_id(utt_id, missing_rxspecifier):
         msg = "Utterance '{}' absent in '{}'".format(
             utt_id, missing_rxspecifier)
         if options.strict:
             logger.error(msg)
+            counts['failed'] = True
             return 1
         else:
             logger.warning(msg)
             return 0
-    return_tables = options.print_tables or not options.include_inserts_in_cost
-    with kaldi_open(options.ref_rspecifier, 'tv') as ref_table, \
-            kaldi_open(options.hyp_rspecifier, 'tv') as hyp_table:
-        while not ref_table.done() and not hyp_table.done():
-            global_sents += 1
-            if ref_table.key() > hyp_table.key():
-                if _err_on_utt_id(hyp_table.key(), options.ref_rspecifier):
-                    return 1
-                hyp_table.move()
-            elif hyp_table.key() > ref_table.key():
-                if _err_on_utt_id(ref_table.key(), options.hyp_rspecifier):
-                    return 1
-                ref_table.move()
-            else:
-                logger.debug('Processing {}: ref [{}] hyp [{}]'.format(
-                    ref_table.key(),
-                    ' '.join(ref_table.value()),
-                    ' '.join(hyp_table.value())))
-                global_token_count += len(ref_table.value())
-                res = kaldi_eval_util.edit_distance(
-                    ref_table.value(), hyp_table.value(),
-                    return_tables=return_tables,
-                    insertion_cost=options.insertion_cost,
-                    deletion_cost=options.deletion_cost,
-                    substitution_cost=options.substitution_cost,
-                )
-                if return_tables:
-                    global_edit += res[0]
-                    for global_dict, utt_dict in zip(
-                            (inserts, deletes, subs, totals), res[1:]):
-                        for token in ref_table.value() + hyp_table.value():
-                            global_dict.setdefault(token, 0)
-                        for token, count in utt_dict.items():
-                            global_dict[token] += count
-                else:
-                    global_edit += res
-            global_processed += 1
-            ref_table.move()
-            hyp_table.move()
-        while not ref_table.done():
-            if _err_on_utt_id(ref_table.key(), options.hyp_rspecifier):
-                return 1
-            global_sents += 1
-            ref_table.move()
-        while not hyp_table.done():
+    while not ref_table.done() and not hyp_table.done():
+        counts['sents'] += 1
+        if ref_table.key() > hyp_table.key():
             if _err_on_utt_id(hyp_table.key(), options.ref_rspecifier):
-                return 1
-            global_sents += 1
+                return
             hyp_table.move()
-    if options.out_path is None:
-        out_file = sys.stdout
-    else:
-        out_file = open(options.out_path, 'w')
+        elif hyp_table.key() > ref_table.key():
+            if _err_on_utt_id(ref_table.key(), hyp_rspecifier):
+                return
+            ref_table.move()
+        else:
+            yield ref_table.key()
+        counts['processed'] += 1
+        ref_table.move()
+        hyp_table.move()
+    while not ref_table.done():
+        if _err_on_utt_id(ref_table.key(), hyp_rspecifier):
+            return
+        counts['sents'] += 1
+        ref_table.move()
+    while not hyp_table.done():
+        if _err_on_utt_id(hyp_table.key(), options.ref_rspecifier):
+            return
+        counts['sents'] += 1
+        hyp_table.move()
+
+
+def _new_error_rate_stats():
+    return {
+        'edit': 0, 'token_count': 0, 'sents': 0, 'processed': 0,
+        'failed': False, 'tables': (dict(), dict(), dict(), dict()),
+        'vocab': dict(), 'keys': [], 'errors': [], 'ref_lens': [],
+    }
+
+
+def _merge_error_rate_tables(stats, chunk_dicts, chunk_tokens):
+    for global_dict, chunk_dict in zip(stats['tables'], chunk_dicts):
+        for token, count in chunk_dict.items():
+            global_dict[token] = global_dict.get(token, 0) + count
+    stats['vocab'].update((token, None) for token in chunk_tokens)
+
+
+def _error_rate_stats_serial(options, hyp_rspecifier, return_tables, logger):
+    stats = _new_error_rate_stats()
+    keys, refs, hyps = [], [], []
+    with kaldi_open(options.ref_rspecifier, 'tv') as ref_table, \
+            kaldi_open(hyp_rspecifier, 'tv') as hyp_table:
+        for key in _error_rate_keys(
+                ref_table, hyp_table, options, hyp_rspecifier, logger,
+                stats):
+            ref, hyp = ref_table.value(), hyp_table.value()
+            logger.debug('Processing {}: ref [{}] hyp [{}]'.format(
+                key, ' '.join(ref), ' '.join(hyp)))
+            keys.append(key)
+            refs.append(ref)
+            hyps.append(hyp)
+            if len(refs) == _ERROR_RATE_CHUNK_SIZE:
+                _score_error_rate_chunk(
+                    keys, refs, hyps, options, stats['vocab'],
+                    return_tables, stats)
+    _score_error_rate_chunk(
+        keys, refs, hyps, options, stats['vocab'], return_tables, stats)
+    return stats
+
+
+class _ReferenceKeys(object):
+    # walks the keys of a cached reference like a sequential reader
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.idx = 0
+
+    def done(self):
+        return self.idx == len(self.keys)
+
+    def key(self):
+        return self.keys[self.idx]
+
+    def move(self):
+        self.idx += 1
+
+
+# the random access readers of a compute-error-rate worker process
+_ERROR_RATE_WORKER = dict()
+
+
+def _init_error_rate_worker(options, return_tables, logger_name):
+    _ERROR_RATE_WORKER.update(
+        options=options,
+        return_tables=return_tables,
+        logger=logging.getLogger(logger_name),
+        ref_table=kaldi_open(options.ref_rspecifier, 'tv', mode='r+'),
+        hyp_tables=dict(),
+    )
+
+
+def _score_error_rate_keys(task):
+    # scores the utterances of keys of a hypothesis table in a worker
+    # process, returning their stats. The table is opened on first use
+    hyp_rspecifier, keys = task
+    worker = _ERROR_RATE_WORKER
+    hyp_table = worker['hyp_tables'].get(hyp_rspecifier)
+    if hyp_table is None:
+        hyp_table = worker['hyp_tables'][hyp_rspecifier] = kaldi_open(
+            hyp_rspecifier, 'tv', mode='r+')
+    refs = worker['ref_table'].get_many(keys)
+    hyps = hyp_table.get_many(keys)
+    for key, ref, hyp in zip(keys, refs, hyps):
+        worker['logger'].debug('Processing {}: ref [{}] hyp [{}]'.format(
+            key, ' '.join(ref), ' '.join(hyp)))
+    stats = _new_error_rate_stats()
+    _score_error_rate_chunk(
+        list(keys), refs, hyps, worker['options'], stats['vocab'],
+        worker['return_tables'], stats)
+    return stats
+
+
+def _error_rate_stats_parallel(options, return_tables, logger):
+    # the keys of the reference are read once and walked against those of
+    # each hypothesis table. The chunks of every table are then scored by
+    # the same pool of workers
+    with kaldi_open(options.ref_rspecifier, 'tv') as ref_table:
+        # script readers don't read values we don't ask for
+        ref_keys = list(ref_table.keys())
+    all_stats, tasks = [], []
+    for hyp_idx, hyp_rspecifier in enumerate(options.hyp_rspecifiers):
+        stats = _new_error_rate_stats()
+        all_stats.append(stats)
+        with kaldi_open(hyp_rspecifier, 'tv') as hyp_table:
+            keys = list(_error_rate_keys(
+                _ReferenceKeys(ref_keys), hyp_table, options, hyp_rspecifier,
+                logger, stats))
+        if stats['failed']:
+            return all_stats
+        tasks.extend(
+            (hyp_idx, keys[idx:idx + _ERROR_RATE_CHUNK_SIZE])
+            for idx in range(0, len(keys), _ERROR_RATE_CHUNK_SIZE))
+    pool = Pool(
+        options.num_jobs, initializer=_init_error_rate_worker,
+        initargs=(options, return_tables, logger.name))
+    try:
+        for (hyp_idx, _), chunk_stats in zip(tasks, pool.imap(
+                _score_error_rate_keys,
+                (
+                    (options.hyp_rspecifiers[hyp_idx], keys)
+                    for hyp_idx, keys in tasks
+                ))):
+            stats = all_stats[hyp_idx]
+            stats['edit'] += chunk_stats['edit']
+            stats['token_count'] += chunk_stats['token_count']
+            _merge_error_rate_tables(
+                stats, chunk_stats['tables'], chunk_stats['vocab'])
+            for name in ('keys', 'errors', 'ref_lens'):
+                stats[name].extend(chunk_stats[name])
+    except BaseException:
+        # don't wait on the remaining chunks
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+    return all_stats
+
+
+def _read_error_rate_hyp(options, hyp_rspecifier, ref_keys, logger):
+    # reads the hypotheses of keys in the cached reference, returning the
+    # stats of the walk, the reference indices, and the hypotheses
+    stats = _new_error_rate_stats()
+    ref_table = _ReferenceKeys(ref_keys)
+    ref_idxs, hyps = [], []
+    with kaldi_open(hyp_rspecifier, 'tv') as hyp_table:
+        for _ in _error_rate_keys(
+                ref_table, hyp_table, options, hyp_rspecifier, logger,
+                stats):
+            ref_idxs.append(ref_table.idx)
+            hyps.append(hyp_table.value())
+    return stats, ref_idxs, hyps
+
+
+def _error_rate_stats_shared_ref(options, return_tables, logger):
+    # the reference is read and mapped to ids once, then scored against each
+    # hypothesis table in turn. The next hypothesis table is read in the
+    # background while the last is scored
+    vocab = dict()
+    ref_keys, ref_ids = [], []
+    with kaldi_open(options.ref_rspecifier, 'tv') as ref_table:
+        for key, ref in ref_table.items():
+            ref_keys.append(key)
+            ref_ids.append(np.fromiter(
+                (vocab.setdefault(token, len(vocab)) for token in ref),
+                dtype=np.int32, count=len(ref)))
+    all_stats = []
+    pool = ThreadPool(1)
+    pending = deque()
+    try:
+        for hyp_rspecifier in options.hyp_rspecifiers:
+            pending.append(pool.apply_async(
+                _read_error_rate_hyp,
+                (options, hyp_rspecifier, ref_keys, logger)))
+            if len(pending) > 1:
+                all_stats.append(_score_error_rate_hyp(
+                    pending.popleft().get(), ref_keys, ref_ids, options,
+                    vocab, return_tables, logger))
+        while pending:
+            all_stats.append(_score_error_rate_hyp(
+                pending.popleft().get(), ref_keys, ref_ids, options, vocab,
+                return_tables, logger))
+    except BaseException:
+        # don't wait on reading the next table
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+    return all_stats
+
+
+def _score_error_rate_hyp(read, ref_keys, ref_ids, options, vocab,
+                          return_tables, logger):
+    stats, ref_idxs, hyps = read
+    if stats['failed']:
+        return stats
+    if logger.isEnabledFor(logging.DEBUG):
+        id_to_token = dict((idx, token) for token, idx in vocab.items())
+        for ref_idx, hyp in zip(ref_idxs, hyps):
+            logger.debug('Processing {}: ref [{}] hyp [{}]'.format(
+                ref_keys[ref_idx],
+                ' '.join(id_to_token[idx] for idx in ref_ids[ref_idx]),
+                ' '.join(hyp)))
+    seen_ids = set()
+    for start in range(0, len(ref_idxs), _ERROR_RATE_CHUNK_SIZE):
+        chunk_ref_idxs = ref_idxs[start:start + _ERROR_RATE_CHUNK_SIZE]
+        chunk_ref_ids = [ref_ids[idx] for idx in chunk_ref_idxs]
+        chunk_hyps = hyps[start:start + _ERROR_RATE_CHUNK_SIZE]
+        ref_offsets = np.zeros(len(chunk_ref_ids) + 1, dtype=np.int32)
+        np.cumsum([len(ids) for ids in chunk_ref_ids], out=ref_offsets[1:])
+        flat_ref_ids = np.concatenate(
+            chunk_ref_ids + [np.empty(0, dtype=np.int32)])
+        _score_error_rate_ids(
+            [ref_keys[idx] for idx in chunk_ref_idxs], flat_ref_ids,
+            ref_offsets, chunk_hyps, options, vocab, return_tables, stats)
+        if return_tables:
+            seen_ids.update(flat_ref_ids.tolist())
+            seen_ids.update(
+                vocab[token] for hyp in chunk_hyps for token in hyp)
+    if seen_ids:
+        stats['vocab'].update(
+            (token, None) for token, idx in vocab.items() if idx in seen_ids)
+    return stats
+
+
+def _utterance_errors(stats):
+    # the keys, errors, and reference lengths of the utterances in stats
+    return (
+        stats['keys'],
+        np.concatenate(stats['errors'] + [np.empty(0, dtype=np.int64)]),
+        np.concatenate(stats['ref_lens'] + [np.empty(0, dtype=np.int32)]),
+    )
+
+
+def _print_paired_test(stats_a, stats_b, options, out_file, logger,
+                       prefix=''):
+    keys_a, errors_a, ref_lens = _utterance_errors(stats_a)
+    keys_b, errors_b, _ = _utterance_errors(stats_b)
+    b_idxs = dict((key, idx) for idx, key in enumerate(keys_b))
+    shared = [idx for idx, key in enumerate(keys_a) if key in b_idxs]
+    if not ref_lens[shared].sum():
+        logger.warning(
+            '{}No reference tokens in shared utterances. Skipping paired '
+            'test'.format(prefix))
+        return
+    errors_b = errors_b[[b_idxs[keys_a[idx]] for idx in shared]]
+    difference, p_value = kaldi_eval_util.paired_bootstrap_test(
+        errors_a[shared], errors_b, ref_lens[shared],
+        num_samples=options.bootstrap_samples, rng=options.seed)
+    print(
+        '{}Compared {}. {} difference: {:+.2f}% (p = {:.4f})'.format(
+            prefix, len(shared),
+            'Accuracy' if options.report_accuracy else 'Error rate',
+            (-difference if options.report_accuracy else difference) * 100,
+            p_value),
+        file=out_file,
+    )
+
+
+def _print_confidence_interval(stats, options, out_file, logger, prefix):
+    _, errors, ref_lens = _utterance_errors(stats)
+    if not ref_lens.sum():
+        logger.warning(
+            '{}No reference tokens. Skipping confidence interval'.format(
+                prefix))
+        return
+    lower, upper = kaldi_eval_util.bootstrap_confidence_interval(
+        errors, ref_lens, confidence=options.confidence,
+        num_samples=options.bootstrap_samples, rng=options.seed)
+    if options.report_accuracy:
+        lower, upper = 1 - upper, 1 - lower
     print(
-        "Processed {}/{}.".format(global_processed, global_sents),
+        '{}{:.1f}% confidence interval: [{:.2f}%, {:.2f}%]'.format(
+            prefix, options.confidence * 100, lower * 100, upper * 100),
+        file=out_file,
+    )
+
+
+def _print_error_rate(stats, options, out_file, logger, prefix=''):
+    global_edit = stats['edit']
+    global_token_count = stats['token_count']
+    inserts, deletes, subs, totals = stats['tables']
+    print(
+        "{}Processed {}/{}.".format(
+            prefix, stats['processed'], stats['sents']),
         file=out_file, end=' '
     )
     if not options.include_inserts_in_cost:
@@ -194,6 +526,8 @@ def compute_error_rate(args=None):
                 global_edit / global_token_count * 100),
             file=out_file,
         )
+    if options.confidence_interval:
+        _print_confidence_interval(stats, options, out_file, logger, prefix)
     if options.print_tables:
         print(
             "Total insertions: {}, deletions: {}, substitutions: {}".format(
@@ -237,4 +571,91 @@ def compute_error_rate(args=None):
                 file=out_file
             )
             print(divider_str, file=out_file)
+
+
+@kaldi_vlog_level_cmd_decorator
+@kaldi_logger_decorator
+def compute_error_rate(args=None):
+    '''Compute error rates between reference and hypothesis token vectors
+
+    Two common error rates in speech are the word (WER) and phone (PER),
+    though the computation is the same. Given a reference and hypothesis
+    sequence, the error rate is
+
+    >>> error_rate = (substitutions + insertions + deletions) / (
+    ...     ref_tokens * 100)
+
+    Where the number of substitutions (e.g. ``A B C -> A D C``),
+    deletions (e.g. ``A B C -> A C``), and insertions (e.g.
+    ``A B C -> A D B C``) are determined by Levenshtein distance.
+
+    Any number of hypothesis tables may be scored against the same
+    reference. With more than one, the reference is read once and the
+    results of each hypothesis table are printed on lines prefixed by
+    its rspecifier. Results are then printed to ``--out-path``, if set.
+
+    With ``--num-jobs`` greater than 1, the keys of the utterances to
+    score are determined up front, then split into chunks scored by
+    separate processes. The reference keys are read once and the same
+    processes score every hypothesis table. The results are identical to
+    those of a single process.
+
+    ``--confidence-interval`` adds a bootstrap confidence interval of the
+    error rate: utterances are resampled with replacement many times and
+    the error rate of each resample is computed from per-utterance error
+    counts and reference lengths, which are stored once when scoring.
+    ``--paired-test`` compares the first hypothesis table against each of
+    the others by resampling the utterances they share, printing the
+    difference in error rates (first minus other) and its p-value. See
+    :func:`pydrobert.kaldi.eval.util.paired_bootstrap_test`.
+    '''
+    logger = logging.getLogger(sys.argv[0])
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    register_logger_for_kaldi(sys.argv[0])
+    options = _compute_error_rate_parse_args(args, logger)
+    if options.num_jobs > 1 and any(
+            parse_kaldi_input_path(rspecifier)[0] != TableType.ScriptTable
+            for rspecifier in
+            [options.ref_rspecifier] + options.hyp_rspecifiers):
+        logger.error('--num-jobs > 1 requires script rspecifiers')
+        return 1
+    return_tables = options.print_tables or not options.include_inserts_in_cost
+    if options.num_jobs > 1:
+        all_stats = _error_rate_stats_parallel(
+            options, return_tables, logger)
+    elif len(options.hyp_rspecifiers) == 1:
+        all_stats = [_error_rate_stats_serial(
+            options, options.hyp_rspecifiers[0], return_tables, logger)]
+    else:
+        all_stats = _error_rate_stats_shared_ref(
+            options, return_tables, logger)
+    if any(stats['failed'] for stats in all_stats):
+        return 1
+    for stats in all_stats:
+        if return_tables:
+            # every token seen has an entry in every table
+            for token in stats['vocab']:
+                for global_dict in stats['tables']:
+                    global_dict.setdefault(token, 0)
+    if options.out_path is None:
+        out_file = sys.stdout
+    else:
+        out_file = open(options.out_path, 'w')
+    try:
+        for hyp_rspecifier, stats in zip(options.hyp_rspecifiers, all_stats):
+            _print_error_rate(
+                stats, options, out_file, logger,
+                '' if len(all_stats) == 1 else "'{}': ".format(
+                    hyp_rspecifier))
+        if options.paired_test:
+            for hyp_rspecifier, stats in zip(
+                    options.hyp_rspecifiers[1:], all_stats[1:]):
+                _print_paired_test(
+                    all_stats[0], stats, options, out_file, logger,
+                    "'{}' vs. '{}': ".format(
+                        options.hyp_rspecifiers[0], hyp_rspecifier))
+    finally:
+        if options.out_path is not None:
+            out_file.close()
     return 0
@@ -20,15 +20,25 @@ from __future__ import print_function
 
 import numpy as np
 
+from pydrobert.kaldi import _internal as _i
+
 __author__ = "Sean Robertson"
 __email__ = "sdrobert@cs.toronto.edu"
 __license__ = "Apache 2.0"
 __copyright__ = "Copyright 2017 Sean Robertson"
 
 __all__ = [
-    'edit_distance'
+    'bootstrap_confidence_interval',
+    'bootstrap_error_rates',
+    'edit_distance',
+    'edit_distance_batch',
+    'edit_distance_many',
+    'paired_bootstrap_test',
 ]
 
+# how many utterances bootstrap_error_rates gathers at once
+_BOOTSTRAP_BLOCK_SIZE = 2 ** 22
+
 
 def edit_distance(
         ref, hyp, insertion_cost=1, deletion_cost=1, substitution_cost=1,
@@ -58,7 +68,217 @@ def edit_distance(
         insertion counts, a dict of deletion , a dict of substitution
         counts per ref token, and a dict of counts of ref tokens. Any
         tokens with count 0 are excluded from the dictionary.
+
+    Notes
+    -----
+    When the tokens are hashable and the costs are integers, tokens are
+    mapped to integer ids and the distance is computed natively.
+    Otherwise, a (much slower) python implementation is used. Both
+    backtrack in the same way, preferring insertions to deletions to
+    substitutions.
+    '''
+    args = (
+        ref, hyp, insertion_cost, deletion_cost, substitution_cost,
+        return_tables)
+    if any(int(cost) != cost for cost in args[2:5]):
+        return _edit_distance_python(*args)
+    vocab = dict()
+    try:
+        ref_ids = _batch_token_ids((ref,), vocab)[0]
+        hyp_ids = _batch_token_ids((hyp,), vocab)[0]
+    except TypeError:
+        # unhashable tokens
+        return _edit_distance_python(*args)
+    ret = _i.EditDistance(
+        ref_ids, hyp_ids, int(insertion_cost), int(deletion_cost),
+        int(substitution_cost), return_tables)
+    # the same type as the python implementation returns
+    if not return_tables:
+        return np.int_(ret)
+    dist, ref_ops, hyp_ops = ret
+    return (np.int_(dist),) + _edit_tables(
+        ref_ids, hyp_ids, ref_ops, hyp_ops, vocab)
+
+
+def edit_distance_batch(
+        refs, hyps, insertion_cost=1, deletion_cost=1, substitution_cost=1,
+        return_tables=False, vocab=None, num_threads=1):
+    '''Levenshtein (edit) distances between many pairs of token sequences
+
+    Parameters
+    ----------
+    refs : sequence
+        Sequence of tuples of tokens of reference texts
+    hyps : sequence
+        Sequence of tuples of tokens of hypothesis texts. As many as there
+        are `refs`
+    insertion_cost : int
+    deletion_cost : int
+    substitution_cost : int
+    return_tables : bool
+        See below
+    vocab : dict, optional
+        A mapping from tokens to consecutive integer ids, starting at
+        ``0``. Tokens not already in `vocab` are added to it. Passing the
+        same dictionary to many calls avoids rebuilding it
+    num_threads : int, optional
+        The number of threads to divide the pairs between
+
+    Returns
+    -------
+    np.ndarray or (np.ndarray, dict, dict, dict, dict)
+        Returns an array of the edit distance of each hypothesis from its
+        reference. If `return_tables` is `True`, this returns a tuple of
+        the distances and the insertion, deletion, substitution, and
+        reference token counts (see :func:`edit_distance`), summed over
+        all pairs.
+
+    Notes
+    -----
+    All pairs are aligned in a single native call, without holding the
+    GIL, and are backtracked the same way as in :func:`edit_distance`.
+    If any token is unhashable or any cost is not an integer, this falls
+    back to calling :func:`edit_distance` on each pair.
     '''
+    return edit_distance_many(
+        refs, (hyps,), insertion_cost, deletion_cost, substitution_cost,
+        return_tables, vocab, num_threads)[0]
+
+
+def edit_distance_many(
+        refs, hyps_list, insertion_cost=1, deletion_cost=1,
+        substitution_cost=1, return_tables=False, vocab=None, num_threads=1):
+    '''Edit distances of many hypothesis sets from the same references
+
+    Equivalent to calling :func:`edit_distance_batch` with `refs` and each
+    element of `hyps_list`, except `refs` are mapped to ids only once
+
+    Parameters
+    ----------
+    refs : sequence
+        Sequence of tuples of tokens of reference texts
+    hyps_list : sequence
+        Sequence of sequences of tuples of tokens of hypothesis texts. Each
+        has as many hypotheses as there are `refs`
+    insertion_cost : int
+    deletion_cost : int
+    substitution_cost : int
+    return_tables : bool
+    vocab : dict, optional
+    num_threads : int, optional
+
+    Returns
+    -------
+    list
+        The return value of :func:`edit_distance_batch` for each element
+        of `hyps_list`
+    '''
+    for hyps in hyps_list:
+        if len(refs) != len(hyps):
+            raise ValueError(
+                'Expected as many refs ({}) as hyps ({})'.format(
+                    len(refs), len(hyps)))
+    if vocab is None:
+        vocab = dict()
+    args = (
+        insertion_cost, deletion_cost, substitution_cost, return_tables)
+    native = all(int(cost) == cost for cost in args[:3])
+    if native:
+        try:
+            ref_ids, ref_offsets = _batch_token_ids(refs, vocab)
+        except TypeError:
+            # unhashable tokens
+            native = False
+    rets = []
+    for hyps in hyps_list:
+        ret = None
+        if native:
+            try:
+                ret = _edit_distance_encoded(
+                    ref_ids, ref_offsets, hyps, *args + (vocab, num_threads))
+            except TypeError:
+                pass
+        if ret is None:
+            ret = _edit_distance_batch_python(refs, hyps, *args)
+        rets.append(ret)
+    return rets
+
+
+def _edit_distance_encoded(
+        ref_ids, ref_offsets, hyps, insertion_cost, deletion_cost,
+        substitution_cost, return_tables, vocab, num_threads,
+        return_inserts=False):
+    # edit_distance_batch where refs have already been mapped to ids with
+    # _batch_token_ids. Raises a TypeError if hyps have unhashable tokens.
+    # If return_tables and return_inserts, the number of insertions per
+    # pair is appended to the returned tuple
+    hyp_ids, hyp_offsets = _batch_token_ids(hyps, vocab)
+    ret = _i.EditDistanceBatch(
+        ref_ids, ref_offsets, hyp_ids, hyp_offsets, int(insertion_cost),
+        int(deletion_cost), int(substitution_cost), return_tables,
+        num_threads)
+    if not return_tables:
+        return ret
+    dists, ref_ops, hyp_ops = ret
+    ret = (dists,) + _edit_tables(ref_ids, hyp_ids, ref_ops, hyp_ops, vocab)
+    if return_inserts:
+        inserted = np.zeros(len(hyp_ops) + 1, dtype=np.int64)
+        np.cumsum(hyp_ops == 1, out=inserted[1:])
+        ret += (inserted[hyp_offsets[1:]] - inserted[hyp_offsets[:-1]],)
+    return ret
+
+
+def _batch_token_ids(seqs, vocab):
+    # flattens seqs into ids, with seqs[i] spanning
+    # ids[offsets[i]:offsets[i + 1]]
+    offsets = np.zeros(len(seqs) + 1, dtype=np.int32)
+    np.cumsum([len(seq) for seq in seqs], out=offsets[1:])
+    ids = np.fromiter(
+        (vocab.setdefault(token, len(vocab)) for seq in seqs for token in seq),
+        dtype=np.int32, count=offsets[-1])
+    return ids, offsets
+
+
+def _edit_distance_batch_python(
+        refs, hyps, insertion_cost, deletion_cost, substitution_cost,
+        return_tables):
+    rets = [
+        edit_distance(
+            ref, hyp, insertion_cost, deletion_cost, substitution_cost,
+            return_tables)
+        for ref, hyp in zip(refs, hyps)
+    ]
+    if not return_tables:
+        return np.array(rets, dtype=np.int64)
+    tables = (dict(), dict(), dict(), dict())
+    for ret in rets:
+        for table, utt_table in zip(tables, ret[1:]):
+            for token, count in utt_table.items():
+                table[token] = table.get(token, 0) + count
+    return (np.array([ret[0] for ret in rets], dtype=np.int64),) + tables
+
+
+def _edit_tables(ref_ids, hyp_ids, ref_ops, hyp_ops, vocab):
+    # counts insertions, deletions, substitutions, and totals per token from
+    # the alignment ops returned by _internal.EditDistance
+    num_ids = len(vocab)
+    tokens = [None] * num_ids
+    for token, idx in vocab.items():
+        tokens[idx] = token
+    tables = []
+    for ids in (
+            hyp_ids[hyp_ops == 1], ref_ids[ref_ops == 1],
+            ref_ids[ref_ops == 2], ref_ids):
+        counts = np.bincount(ids, minlength=num_ids)
+        tables.append(dict(
+            (tokens[idx], int(counts[idx]))
+            for idx in np.flatnonzero(counts)))
+    return tuple(tables)
+
+
+def _edit_distance_python(
+        ref, hyp, insertion_cost, deletion_cost, substitution_cost,
+        return_tables):
     # we keep track of the whole dumb matrix in case we need to
     # backtrack (for `return_tables`). Should be okay for WER/PER, since
     # the number of tokens per vector will be on the order of tens
@@ -109,3 +329,151 @@ def edit_distance(
             ref_idx -= 1
             subs[ref[ref_idx]] = subs.get(ref[ref_idx], 0) + 1
     return distances[-1, -1], inserts, deletes, subs, totals
+
+
+def bootstrap_error_rates(errors, ref_lens, num_samples=1000, rng=None):
+    '''Error rates of bootstrap resamples of utterances
+
+    Each resample draws as many utterances as there are, with
+    replacement, and computes the error rate (total errors over total
+    reference tokens) of the draw. Every system in `errors` shares the
+    same draws, so their rates may be compared pairwise.
+
+    Parameters
+    ----------
+    errors : array-like
+        Per-utterance error counts of one system, of shape
+        ``(num_utts,)``, or of many, of shape ``(num_systems, num_utts)``
+    ref_lens : array-like
+        Per-utterance reference lengths, of shape ``(num_utts,)``
+    num_samples : int, optional
+        The number of resamples
+    rng : int or numpy.random.RandomState, optional
+        Either a ``RandomState`` object or a seed to create a
+        ``RandomState`` object. Draws the resamples
+
+    Returns
+    -------
+    np.ndarray
+        The error rate of each resample, of shape ``(num_samples,)`` for
+        one system or ``(num_samples, num_systems)`` for many. A resample
+        which only drew zero-length references has no error rate and is
+        ``nan``
+    '''
+    errors = np.asarray(errors, dtype=np.float64)
+    ref_lens = np.asarray(ref_lens, dtype=np.float64)
+    if errors.ndim not in (1, 2) or ref_lens.ndim != 1 or \
+            errors.shape[-1] != ref_lens.shape[0] or not ref_lens.shape[0]:
+        raise ValueError(
+            'Expected errors of shape (num_utts,) or (num_systems, '
+            'num_utts) and ref_lens of shape (num_utts,), num_utts > 0. '
+            'Got {} and {}'.format(errors.shape, ref_lens.shape))
+    if not isinstance(rng, np.random.RandomState):
+        rng = np.random.RandomState(rng)
+    num_utts = ref_lens.shape[0]
+    system_errors = np.atleast_2d(errors)
+    rates = np.empty((num_samples, system_errors.shape[0]))
+    # blocks of resamples are drawn and summed at once, bounding memory
+    block_size = max(1, _BOOTSTRAP_BLOCK_SIZE // num_utts)
+    for start in range(0, num_samples, block_size):
+        stop = min(start + block_size, num_samples)
+        draws = rng.randint(num_utts, size=(stop - start, num_utts))
+        ref_totals = ref_lens[draws].sum(-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates[start:stop] = (
+                system_errors[:, draws].sum(-1) / ref_totals).T
+        rates[start:stop][ref_totals == 0] = np.nan
+    return rates if errors.ndim == 2 else rates[:, 0]
+
+
+def _defined_error_rates(errors, ref_lens, num_samples, rng):
+    # bootstrap_error_rates, excluding the resamples without an error rate
+    rates = bootstrap_error_rates(errors, ref_lens, num_samples, rng)
+    rates = rates[~np.isnan(rates.reshape(num_samples, -1)).any(1)]
+    if not len(rates):
+        raise ValueError(
+            'Every resample drew only zero-length references')
+    return rates
+
+
+def bootstrap_confidence_interval(
+        errors, ref_lens, confidence=.95, num_samples=1000, rng=None):
+    '''Bootstrap confidence interval of an error rate
+
+    Parameters
+    ----------
+    errors : array-like
+        Per-utterance error counts, of shape ``(num_utts,)``
+    ref_lens : array-like
+        Per-utterance reference lengths, of shape ``(num_utts,)``
+    confidence : float, optional
+        The probability mass of the interval
+    num_samples : int, optional
+    rng : int or numpy.random.RandomState, optional
+
+    Returns
+    -------
+    (float, float)
+        The lower and upper percentiles of the resampled error rates
+        (see :func:`bootstrap_error_rates`) bounding `confidence` of them.
+        Resamples which only drew zero-length references are excluded
+
+    Raises
+    ------
+    ValueError
+        If every resample only drew zero-length references
+    '''
+    if not 0 < confidence < 1:
+        raise ValueError(
+            'Expected confidence between 0 and 1, got {}'.format(confidence))
+    rates = _defined_error_rates(errors, ref_lens, num_samples, rng)
+    lower, upper = np.percentile(
+        rates, (50 * (1 - confidence), 50 * (1 + confidence)))
+    return float(lower), float(upper)
+
+
+def paired_bootstrap_test(
+        errors_a, errors_b, ref_lens, num_samples=1000, rng=None):
+    '''Paired bootstrap test of the difference between two error rates
+
+    Systems A and B are scored on the same utterances, which are resampled
+    together (see :func:`bootstrap_error_rates`).
+
+    Parameters
+    ----------
+    errors_a : array-like
+        Per-utterance error counts of system A, of shape ``(num_utts,)``
+    errors_b : array-like
+        Per-utterance error counts of system B, of shape ``(num_utts,)``
+    ref_lens : array-like
+        Per-utterance reference lengths, of shape ``(num_utts,)``
+    num_samples : int, optional
+    rng : int or numpy.random.RandomState, optional
+
+    Returns
+    -------
+    (float, float)
+        The difference between the error rates of A and B (A minus B) and
+        the two-sided p-value of the null hypothesis that they are equal:
+        twice the smaller fraction of resamples where the difference is
+        at most or at least zero, capped at 1. Resamples which only drew
+        zero-length references are excluded
+
+    Raises
+    ------
+    ValueError
+        If every resample only drew zero-length references
+    '''
+    errors_a = np.asarray(errors_a)
+    errors_b = np.asarray(errors_b)
+    if errors_a.shape != errors_b.shape:
+        raise ValueError(
+            'Expected errors of the same shape, got {} and {}'.format(
+                errors_a.shape, errors_b.shape))
+    rates = _defined_error_rates(
+        np.stack([errors_a, errors_b]), ref_lens, num_samples, rng)
+    difference = (errors_a.sum() - errors_b.sum()) / np.sum(ref_lens)
+    differences = rates[:, 0] - rates[:, 1]
+    p_value = 2 * min(
+        np.mean(differences <= 0), np.mean(differences >= 0))
+    return float(difference), float(min(p_value, 1.))
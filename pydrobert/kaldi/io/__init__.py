@@ -170,7 +170,9 @@ class KaldiIOBase(object, with_metaclass(abc.ABCMeta)):
 
 def open(
         path, kaldi_dtype=None, mode='r', error_on_str=True,
-        utt2spk='', value_style='b', header=True, cache=False):
+        utt2spk='', value_style='b', header=True, cache=False,
+        zero_copy=False, memory_map=False, cache_size=None,
+        cache_policy='lru', shared_cache=None, metadata_only=False):
     """Factory function for initializing and opening kaldi streams
 
     This function provides a general interface for opening kaldi
@@ -203,4 +205,7 @@ def open(
     else:
         return open_table_stream(
             path, kaldi_dtype, mode=mode, error_on_str=error_on_str,
-            utt2spk=utt2spk, value_style=value_style, cache=cache)
+            utt2spk=utt2spk, value_style=value_style, cache=cache,
+            zero_copy=zero_copy, memory_map=memory_map,
+            cache_size=cache_size, cache_policy=cache_policy,
+            shared_cache=shared_cache, metadata_only=metadata_only)
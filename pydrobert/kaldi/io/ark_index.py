@@ -0,0 +1,262 @@
+# Copyright 2018 Sean Robertson
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Byte-offset indices of Kaldi archives
+
+Opening an archive (``'ark:'``) for random access forces Kaldi to scan
+the archive, holding on to whatever it has read along the way. An index
+records where each entry of an archive on disk lives, so that a random
+access reader can seek straight to it. Indices are stored in a sidecar
+file next to the archive (the archive's path with ``ARK_INDEX_SUFFIX``
+appended) and are built once with ``build_ark_index`` or the
+``build-ark-index`` command. ``pydrobert.kaldi.io.open`` picks up the
+index of an archive opened with ``mode='r+'`` automatically.
+
+An index is tied to the size and modification time of its archive when
+it was built. If either changes, the index is considered stale and
+ignored.
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import warnings
+
+from collections import namedtuple
+from collections import OrderedDict
+
+from builtins import str as text
+
+from pydrobert.kaldi import _internal as _i
+from pydrobert.kaldi.io.enums import KaldiDataType
+from pydrobert.kaldi.io.enums import RxfilenameType
+from pydrobert.kaldi.io.enums import TableType
+
+__author__ = "Sean Robertson"
+__email__ = "sdrobert@cs.toronto.edu"
+__license__ = "Apache 2.0"
+__copyright__ = "Copyright 2018 Sean Robertson"
+
+__all__ = [
+    'ARK_INDEX_SUFFIX',
+    'ArkIndexEntry',
+    'ark_index_path',
+    'build_ark_index',
+    'find_ark_index',
+    'load_ark_index',
+]
+
+ARK_INDEX_SUFFIX = '.idx'
+'''The suffix appended to an archive's path to get its index's path'''
+
+_ARK_INDEX_MAGIC = 'pydrobert-kaldi-ark-index'
+_ARK_INDEX_VERSION = 1
+
+ArkIndexEntry = namedtuple(
+    'ArkIndexEntry', ['file', 'offset', 'size', 'kaldi_dtype', 'shape'])
+ArkIndexEntry.__doc__ = '''Where an entry lives in an archive
+
+Attributes
+----------
+file : str
+    The path to the archive
+offset : int
+    The byte offset of the value in the archive, just past its key.
+    ``'{file}:{offset}'`` is an rxfilename for the value, as found in
+    Kaldi script files
+size : int
+    The number of bytes the value spans in the archive
+kaldi_dtype : pydrobert.kaldi.io.enums.KaldiDataType
+    The type of the value
+shape : tuple
+    The shape the value would have as a numpy array. Scalars and tokens
+    have an empty shape
+'''
+
+
+def ark_index_path(rxfilename):
+    '''The path to the index of an archive located at `rxfilename`'''
+    return rxfilename + ARK_INDEX_SUFFIX
+
+
+def _archive_rxfilename(path):
+    from pydrobert.kaldi.io.util import parse_kaldi_input_path
+    table_type, rxfilename, rx_type, _ = parse_kaldi_input_path(path)
+    if table_type == TableType.NotATable:
+        return _archive_rxfilename('ark:' + path)
+    elif table_type != TableType.ArchiveTable:
+        raise ValueError('"{}" is not an archive'.format(path))
+    if rx_type != RxfilenameType.FileInput:
+        raise ValueError(
+            'Only archives stored in files on disk can be indexed, '
+            'got "{}"'.format(path))
+    return rxfilename
+
+
+def build_ark_index(path, kaldi_dtype, index_path=None):
+    '''Scan an archive and write its index to disk
+
+    Parameters
+    ----------
+    path : str
+        Either an rspecifier of an archive (e.g. ``'ark:foo.ark'``) or
+        the path of the archive file. The archive must be a file on disk
+    kaldi_dtype : pydrobert.kaldi.io.enums.KaldiDataType
+        The type of data stored in the archive
+    index_path : str, optional
+        Where to write the index. Defaults to ``ark_index_path(file)``,
+        which is where ``pydrobert.kaldi.io.open`` looks for it
+
+    Returns
+    -------
+    collections.OrderedDict
+        The index, mapping keys to ``ArkIndexEntry`` tuples in the order
+        they appear in the archive. Should a key appear multiple times,
+        the first entry is kept
+
+    Raises
+    ------
+    ValueError
+        If `path` is not an archive on disk
+    IOError
+        If the archive could not be read or the index could not be
+        written
+    '''
+    from pydrobert.kaldi.io.table_streams import _KaldiSequentialSimpleReader
+    kaldi_dtype = KaldiDataType(kaldi_dtype)
+    rxfilename = _archive_rxfilename(path)
+    if index_path is None:
+        index_path = ark_index_path(rxfilename)
+    if kaldi_dtype == KaldiDataType.WaveMatrix:
+        cls = _i.SequentialWaveReader
+    else:
+        cls = _KaldiSequentialSimpleReader._dtype_to_cls[kaldi_dtype.value]
+    # the archive could change while it's being scanned, so stat it first.
+    # A change will make the index stale instead of wrong
+    stat = os.stat(rxfilename)
+    try:
+        scanned = cls.IndexArchive(rxfilename)
+    except RuntimeError:
+        raise IOError('Unable to index archive "{}"'.format(rxfilename))
+    index = OrderedDict()
+    for key, offset, size, shape in scanned:
+        if key not in index:
+            index[key] = ArkIndexEntry(
+                rxfilename, offset, size, kaldi_dtype, shape)
+    with open(index_path, 'w') as index_file:
+        index_file.write('{} {} {} {} {!r}\n'.format(
+            _ARK_INDEX_MAGIC, _ARK_INDEX_VERSION, kaldi_dtype.value,
+            stat.st_size, stat.st_mtime))
+        for key, entry in index.items():
+            index_file.write(' '.join(
+                [text(key), text(entry.offset), text(entry.size)] +
+                [text(dim) for dim in entry.shape]
+            ) + '\n')
+    return index
+
+
+def load_ark_index(path, index_path=None):
+    '''Load the index of an archive
+
+    Parameters
+    ----------
+    path : str
+        Either an rspecifier of an archive (e.g. ``'ark:foo.ark'``) or
+        the path of the archive file
+    index_path : str, optional
+        Where to read the index from. Defaults to
+        ``ark_index_path(file)``
+
+    Returns
+    -------
+    collections.OrderedDict
+        The index, mapping keys to ``ArkIndexEntry`` tuples
+
+    Raises
+    ------
+    ValueError
+        If `path` is not an archive on disk
+    IOError
+        If the index could not be read, is malformed, or is stale
+    '''
+    return _read_ark_index(path, index_path)[1]
+
+
+def _read_ark_index(path, index_path=None):
+    # load_ark_index, also returning the data type the index was built for
+    rxfilename = _archive_rxfilename(path)
+    if index_path is None:
+        index_path = ark_index_path(rxfilename)
+    with open(index_path) as index_file:
+        header = index_file.readline().split()
+        if len(header) != 5 or header[0] != _ARK_INDEX_MAGIC:
+            raise IOError('"{}" is not an archive index'.format(index_path))
+        if int(header[1]) != _ARK_INDEX_VERSION:
+            raise IOError(
+                'Unsupported archive index version {}'.format(header[1]))
+        kaldi_dtype = KaldiDataType(header[2])
+        stat = os.stat(rxfilename)
+        if stat.st_size != int(header[3]) or \
+                stat.st_mtime != float(header[4]):
+            raise IOError(
+                'Index "{}" is stale: "{}" has changed since it was built'
+                ''.format(index_path, rxfilename))
+        index = OrderedDict()
+        for line_no, line in enumerate(index_file):
+            fields = line.split()
+            if len(fields) < 3:
+                raise IOError(
+                    'Malformed line {} in archive index "{}"'.format(
+                        line_no + 2, index_path))
+            index[fields[0]] = ArkIndexEntry(
+                rxfilename, int(fields[1]), int(fields[2]), kaldi_dtype,
+                tuple(int(dim) for dim in fields[3:]))
+    return kaldi_dtype, index
+
+
+def find_ark_index(path, kaldi_dtype):
+    '''Load the index of an archive, if it has a usable one
+
+    Parameters
+    ----------
+    path : str
+        An rspecifier
+    kaldi_dtype : pydrobert.kaldi.io.enums.KaldiDataType
+        The type of data the table is expected to hold
+
+    Returns
+    -------
+    collections.OrderedDict or None
+        The index, if `path` is an archive on disk with an up-to-date
+        index in the default location built for `kaldi_dtype`.
+        Otherwise ``None``. Stale or malformed indices are ignored with
+        a warning
+    '''
+    kaldi_dtype = KaldiDataType(kaldi_dtype)
+    try:
+        rxfilename = _archive_rxfilename(path)
+    except ValueError:
+        return None
+    if not os.path.isfile(ark_index_path(rxfilename)):
+        return None
+    try:
+        index_dtype, index = _read_ark_index(path)
+    except (IOError, ValueError) as error:
+        warnings.warn('Ignoring archive index: {}'.format(error))
+        return None
+    if index_dtype != kaldi_dtype:
+        return None
+    return index
@@ -21,12 +21,19 @@ from __future__ import print_function
 import logging
 import sys
 import os
+import tempfile
+
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import pydrobert.kaldi.io.enums as enums
 
 from pydrobert.kaldi.io import open as kaldi_open
+from pydrobert.kaldi.io.ark_index import ARK_INDEX_SUFFIX
+from pydrobert.kaldi.io.ark_index import build_ark_index as _build_ark_index
 from pydrobert.kaldi.io.argparse import KaldiParser
+from pydrobert.kaldi.io.util import parse_kaldi_output_path
 from pydrobert.kaldi.logging import kaldi_logger_decorator
 from pydrobert.kaldi.logging import kaldi_vlog_level_cmd_decorator
 from pydrobert.kaldi.logging import register_logger_for_kaldi
@@ -38,6 +45,7 @@ __license__ = "Apache 2.0"
 __copyright__ = "Copyright 2018 Sean Robertson"
 
 __all__ = [
+    'build_ark_index',
     'write_pickle_to_table',
     'write_table_to_pickle',
     'write_table_to_torch_dir',
@@ -407,10 +415,44 @@ def _write_table_to_torch_dir_parse_args(args, logger):
         '--file-suffix', default='.pt',
         help='The file suffix indicating a torch data file'
     )
+    parser.add_argument(
+        '--num-workers', type=int, default=0,
+        help='The number of threads converting and saving tensors while the '
+        'table is read. If 0, tensors are saved by the reading thread'
+    )
+    parser.add_argument(
+        '--skip-existing', action='store_true', default=False,
+        help='Skip entries whose files already exist, e.g. to resume an '
+        'interrupted conversion. Entries are not read from scripts when '
+        'skipped'
+    )
     options = parser.parse_args(args)
     return options
 
 
+def _save_tensor(value, path, out_type):
+    import torch
+    value = np.asarray(value)
+    if not value.flags.writeable:
+        value = value.copy()
+    value = torch.from_numpy(value).type(out_type)
+    # files are renamed into place once complete, so an interrupted
+    # conversion never leaves behind partial files for --skip-existing
+    # to trust
+    fd, tmp_path = tempfile.mkstemp(
+        prefix='.', suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            torch.save(value, tmp_file)
+        os.rename(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
 @kaldi_vlog_level_cmd_decorator
 @kaldi_logger_decorator
 def write_table_to_torch_dir(args=None):
@@ -487,15 +529,41 @@ def write_table_to_torch_dir(args=None):
         out_type = torch.long
     try:
         os.makedirs(options.dir)
-    except FileExistsError:
-        pass
-    with kaldi_open(options.rspecifier, options.in_type) as table:
-        for key, value in table.items():
-            value = torch.tensor(value).type(out_type)
-            torch.save(
-                value, os.path.join(
+    except OSError:
+        if not os.path.isdir(options.dir):
+            raise
+    pool = ThreadPool(options.num_workers) if options.num_workers else None
+    pending = deque()
+    num_skipped = 0
+    try:
+        with kaldi_open(options.rspecifier, options.in_type) as table:
+            while not table.done():
+                key = table.key()
+                path = os.path.join(
                     options.dir,
-                    options.file_prefix + key + options.file_suffix))
+                    options.file_prefix + key + options.file_suffix)
+                if options.skip_existing and os.path.isfile(path):
+                    num_skipped += 1
+                    table.move()
+                    continue
+                value = table.value()
+                table.move()
+                if pool is None:
+                    _save_tensor(value, path, out_type)
+                    continue
+                pending.append(
+                    pool.apply_async(_save_tensor, (value, path, out_type)))
+                # bound the number of values held in memory at once
+                if len(pending) > 2 * options.num_workers:
+                    pending.popleft().get()
+        while pending:
+            pending.popleft().get()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if num_skipped:
+        logger.info('Skipped {} existing files'.format(num_skipped))
     return 0
 
 
@@ -520,10 +588,31 @@ def _write_torch_dir_to_table_parse_args(args, logger):
         '--file-suffix', default='.pt',
         help='The file suffix indicating a torch data file'
     )
+    parser.add_argument(
+        '--num-workers', type=int, default=0,
+        help='The number of threads loading and converting files ahead of '
+        'the writer. Entries are still written in sorted order. If 0, files '
+        'are loaded by the writing thread'
+    )
+    parser.add_argument(
+        '--scp', default=None,
+        help='If set, a script file indexing the archive is also written to '
+        'this path, making the table readable with random access right '
+        'away. The wspecifier must then be an archive on disk'
+    )
     options = parser.parse_args(args)
     return options
 
 
+def _load_tensor(path, torch_type, is_bool):
+    import torch
+    val = torch.load(path, map_location='cpu')
+    val = val.type(torch_type).numpy()
+    if is_bool:
+        val = bool(val)  # make sure val is a scalar!
+    return val
+
+
 @kaldi_vlog_level_cmd_decorator
 @kaldi_logger_decorator
 def write_torch_dir_to_table(args=None):
@@ -552,6 +641,19 @@ def write_torch_dir_to_table(args=None):
     if not os.path.isdir(options.dir):
         print("'{}' is not a directory".format(options.dir), file=sys.stderr)
         return 1
+    wspecifier = options.wspecifier
+    if options.scp is not None:
+        table_type, wxfilename, wx_type, _ = parse_kaldi_output_path(
+            wspecifier)
+        if table_type != enums.TableType.ArchiveTable or \
+                wx_type != enums.WxfilenameType.FileOutput:
+            print(
+                "--scp requires an archive on disk, got '{}'".format(
+                    wspecifier),
+                file=sys.stderr)
+            return 1
+        wspecifier = '{},scp:{},{}'.format(
+            wspecifier.split(':', 1)[0], wxfilename, options.scp)
     import torch
     is_bool = False
     if options.out_type in {
@@ -596,13 +698,88 @@ def write_torch_dir_to_table(args=None):
         if x.startswith(options.file_prefix) and
         x.endswith(options.file_suffix)
     )
-    with kaldi_open(options.wspecifier, options.out_type, mode='w') as table:
-        for utt_id in utt_ids:
-            val = torch.load(os.path.join(
-                options.dir,
-                options.file_prefix + utt_id + options.file_suffix))
-            val = val.cpu().type(torch_type).numpy()
-            if is_bool:
-                val = bool(val)  # make sure val is a scalar!
-            table.write(utt_id, val)
+    paths = [
+        os.path.join(
+            options.dir, options.file_prefix + utt_id + options.file_suffix)
+        for utt_id in utt_ids
+    ]
+    if options.num_workers:
+        pool = ThreadPool(options.num_workers)
+    else:
+        pool = None
+    # loads are started in sorted order and consumed in the same order.
+    # Those that finish early wait in the queue for their turn, which is
+    # bounded so as to limit the number of values in memory
+    pending = deque()
+    try:
+        with kaldi_open(wspecifier, options.out_type, mode='w') as table:
+            for utt_id, path in zip(utt_ids, paths):
+                if pool is None:
+                    table.write(
+                        utt_id, _load_tensor(path, torch_type, is_bool))
+                    continue
+                pending.append((utt_id, pool.apply_async(
+                    _load_tensor, (path, torch_type, is_bool))))
+                if len(pending) > 2 * options.num_workers:
+                    utt_id, val = pending.popleft()
+                    table.write(utt_id, val.get())
+            while pending:
+                utt_id, val = pending.popleft()
+                table.write(utt_id, val.get())
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return 0
+
+
+def _build_ark_index_parse_args(args, logger):
+    parser = KaldiParser(
+        description=build_ark_index.__doc__,
+        add_verbose=True, logger=logger,
+    )
+    parser.add_argument(
+        'rspecifier', type='kaldi_rspecifier',
+        help='The archive to index. Must be a file on disk')
+    parser.add_argument(
+        'index_out', nargs='?', default=None,
+        help='Where to write the index. Defaults to the path of the archive '
+        'with "{}" appended, which is where random access readers look for '
+        'it'.format(ARK_INDEX_SUFFIX)
+    )
+    parser.add_argument(
+        '-i', '--in-type', type='kaldi_dtype',
+        default=enums.KaldiDataType.BaseMatrix,
+        help='The type of table to index'
+    )
+    options = parser.parse_args(args)
+    return options
+
+
+@kaldi_vlog_level_cmd_decorator
+@kaldi_logger_decorator
+def build_ark_index(args=None):
+    '''Build a byte-offset index of a Kaldi archive
+
+    Random access into an archive normally requires Kaldi to scan the
+    archive. When an up-to-date index sits next to the archive, random
+    access readers seek directly to each entry instead. The index records
+    the offset, size, and shape of each entry, and is invalidated by any
+    change to the size or modification time of the archive.
+    '''
+    logger = logging.getLogger(sys.argv[0])
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    register_logger_for_kaldi(logger)
+    try:
+        options = _build_ark_index_parse_args(args, logger)
+    except SystemExit as ex:
+        return ex.code
+    try:
+        index = _build_ark_index(
+            options.rspecifier, options.in_type, options.index_out)
+    except (IOError, ValueError) as error:
+        logger.error(str(error), exc_info=True)
+        return 1
+    logger.info('Indexed {} entries'.format(len(index)))
     return 0
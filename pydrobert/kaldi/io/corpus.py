@@ -18,6 +18,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+
 from abc import abstractmethod
 from builtins import str as text
 try:
@@ -27,23 +35,168 @@ except ImportError:
     from collections import Iterable
     from collections import Sized
 from itertools import cycle
+from traceback import format_exc
 from warnings import warn
 
 import numpy as np
 
+from six import reraise
+from six.moves import queue
+
 from pydrobert.kaldi.io import open as io_open
+from pydrobert.kaldi.io.enums import KaldiDataType
 from pydrobert.kaldi.io.enums import RxfilenameType
+from pydrobert.kaldi.io.enums import TableType
+from pydrobert.kaldi.io.shared_cache import _default_root as _default_shm_root
+from pydrobert.kaldi.io.table_streams import _has_metadata
+from pydrobert.kaldi.io.table_streams import _MemoryMappedArchive
+from pydrobert.kaldi.io.table_streams import _value_nbytes
 from pydrobert.kaldi.io.util import parse_kaldi_input_path
 
 __all__ = [
     'batch_data',
+    'BucketedData',
+    'BufferedShuffleData',
     'Data',
+    'ParallelData',
     'ShuffledData',
     'SequentialData',
 ]
 
 
-def _handle_sub_batch(sub_batch, axis, pad_mode, pad_kwargs):
+def _key_shapes(table_spec):
+    '''Generate (key, shape) pairs of a table, decoding as little as we can'''
+    rspecifier, kaldi_dtype = table_spec[:2]
+    kwargs = dict(table_spec[2]) if len(table_spec) > 2 else dict()
+    kaldi_dtype = KaldiDataType(kaldi_dtype)
+    if _has_metadata(kaldi_dtype):
+        kwargs['metadata_only'] = True
+        with io_open(rspecifier, kaldi_dtype, **kwargs) as reader:
+            for key, metadata in reader.items():
+                yield key, metadata.shape
+    else:
+        with io_open(rspecifier, kaldi_dtype, **kwargs) as reader:
+            for key, value in reader.items():
+                yield key, np.array(value, copy=False).shape
+
+
+def _table_specifiers(tables):
+    '''Expand table arguments into (rspecifier, kaldi_dtype, kwargs)'''
+    table_specifiers = []
+    for table_spec in tables:
+        if isinstance(table_spec, str) or isinstance(table_spec, text):
+            table_spec = (table_spec, 'bm', dict())
+        elif len(table_spec) == 2:
+            table_spec = tuple(table_spec) + (dict(),)
+        elif len(table_spec) != 3:
+            raise ValueError('Invalid table spec {}'.format(table_spec))
+        table_specifiers.append(table_spec)
+    return tuple(table_specifiers)
+
+
+def _axis_length_pairs(axis_lengths):
+    '''Expand an axis_lengths argument into (sub_batch_idx, axis) pairs'''
+    if axis_lengths is None:
+        return tuple()
+    elif isinstance(axis_lengths, int):
+        return ((0, axis_lengths),)
+    axis_lengths = tuple(axis_lengths)  # in case generator
+    if len(axis_lengths) == 2 and \
+            isinstance(axis_lengths[0], int) and \
+            isinstance(axis_lengths[1], int):
+        return (axis_lengths,)
+    return tuple(tuple(pair) for pair in axis_lengths)
+
+
+def _length_buckets(keys, key_lengths, num_buckets=10, bucket_boundaries=None):
+    '''Split keys into nonempty buckets of increasing length'''
+    sorted_keys = sorted(keys, key=lambda key: key_lengths[key])
+    if bucket_boundaries is None:
+        buckets = np.array_split(
+            np.arange(len(sorted_keys)), max(1, num_buckets))
+        buckets = (
+            [sorted_keys[idx] for idx in bucket] for bucket in buckets)
+    else:
+        sorted_lengths = [key_lengths[key] for key in sorted_keys]
+        splits = np.searchsorted(
+            sorted_lengths, bucket_boundaries, side='left')
+        splits = [0] + list(splits) + [len(sorted_keys)]
+        buckets = (
+            sorted_keys[start:end]
+            for start, end in zip(splits[:-1], splits[1:]))
+    return tuple(tuple(bucket) for bucket in buckets if bucket)
+
+
+def _bucket_batch_sizes(buckets, key_lengths, batch_size, max_frames):
+    '''The number of samples in full batches of each bucket'''
+    bucket_batch_sizes = []
+    for bucket in buckets:
+        bucket_batch_size = len(bucket)
+        if batch_size:
+            bucket_batch_size = min(bucket_batch_size, batch_size)
+        if max_frames:
+            max_length = max(1, key_lengths[bucket[-1]])
+            bucket_batch_size = min(
+                bucket_batch_size, max(1, max_frames // max_length))
+        bucket_batch_sizes.append(bucket_batch_size)
+    return tuple(bucket_batch_sizes)
+
+
+def _num_bucketed_batches(buckets, bucket_batch_sizes, world_size=1):
+    return sum(
+        int(np.ceil((len(bucket) // world_size) / bucket_batch_size))
+        for bucket, bucket_batch_size in zip(buckets, bucket_batch_sizes)
+    )
+
+
+def _bucketed_batches(buckets, bucket_batch_sizes, rng, rank=0, world_size=1):
+    '''Shuffle buckets into batches, then shuffle the order of batches'''
+    batches = []
+    for bucket, bucket_batch_size in zip(buckets, bucket_batch_sizes):
+        bucket = list(bucket)
+        rng.shuffle(bucket)
+        if world_size > 1:
+            # buckets are sharded separately, so that each shard gets the
+            # same number of batches
+            bucket = bucket[
+                rank:world_size * (len(bucket) // world_size):world_size]
+        batches.extend(
+            bucket[start:start + bucket_batch_size]
+            for start in range(0, len(bucket), bucket_batch_size)
+        )
+    batch_order = np.arange(len(batches))
+    rng.shuffle(batch_order)
+    return [batches[idx] for idx in batch_order]
+
+
+class _BufferRing(object):
+    '''Cycles through preallocated buffers that batches are stacked into'''
+
+    def __init__(self, size):
+        self.buffers = [None] * size
+        self.idx = 0
+
+    def empty(self, shape, dtype):
+        count = int(np.prod(shape))
+        buf = self.buffers[self.idx]
+        if buf is None or buf.dtype != dtype or buf.size < count:
+            buf = self.buffers[self.idx] = np.empty(count, dtype=dtype)
+        self.idx = (self.idx + 1) % len(self.buffers)
+        return buf[:count].reshape(shape)
+
+
+def _pads_in_place(sub_batch, pad_mode, pad_kwargs):
+    # whether we can pad without numpy.pad
+    if pad_mode == 'constant':
+        return set(pad_kwargs) <= {'constant_values'} and \
+            np.ndim(pad_kwargs.get('constant_values', 0)) == 0
+    elif pad_mode == 'edge':
+        # numpy.pad raises when edge-padding an empty axis. Let it
+        return not pad_kwargs and all(sample.size for sample in sub_batch)
+    return False
+
+
+def _handle_sub_batch(sub_batch, axis, pad_mode, pad_kwargs, ring=None):
     assert len(sub_batch)
     try:
         first_dtype = sub_batch[0].dtype
@@ -58,13 +211,16 @@ def _handle_sub_batch(sub_batch, axis, pad_mode, pad_kwargs):
             return sub_batch
         if sample.shape != first_shape:
             if pad_mode:
-                max_shape = (
+                max_shape = tuple(
                     max(x, y) for x, y in zip(sample.shape, max_shape))
                 mismatched_shapes = True
             else:
                 return sub_batch
-    if mismatched_shapes:
-        max_shape = tuple(max_shape)
+    if not mismatched_shapes and ring is None:
+        return np.stack(sub_batch, axis=axis)
+    if mismatched_shapes and (
+            any(sample.ndim != len(max_shape) for sample in sub_batch) or
+            not _pads_in_place(sub_batch, pad_mode, pad_kwargs)):
         for samp_idx in range(len(sub_batch)):
             sample = sub_batch[samp_idx]
             if sample.shape != max_shape:
@@ -77,13 +233,37 @@ def _handle_sub_batch(sub_batch, axis, pad_mode, pad_kwargs):
                     **pad_kwargs
                 )
                 sub_batch[samp_idx] = sample
-    ret = np.stack(sub_batch, axis=axis)
-    return ret
+        if ring is None:
+            return np.stack(sub_batch, axis=axis)
+    out_shape = list(max_shape)
+    out_shape.insert(
+        axis if axis >= 0 else axis + len(max_shape) + 1, len(sub_batch))
+    if ring is None:
+        out = np.empty(out_shape, dtype=first_dtype)
+    else:
+        out = ring.empty(out_shape, first_dtype)
+    # copy each sample into its slice of the output, then fill the
+    # remainder of the slice one axis at a time. For edge padding, the
+    # values along an axis are copied from a row that earlier axes
+    # have already filled
+    constant_value = pad_kwargs.get('constant_values', 0)
+    for sample, dest in zip(sub_batch, np.moveaxis(out, axis, 0)):
+        dest[tuple(slice(0, x) for x in sample.shape)] = sample
+        for pad_axis, (x, y) in enumerate(zip(sample.shape, max_shape)):
+            if x == y:
+                continue
+            prefix = (slice(None),) * pad_axis
+            if pad_mode == 'constant':
+                dest[prefix + (slice(x, None),)] = constant_value
+            else:
+                dest[prefix + (slice(x, None),)] = \
+                    dest[prefix + (slice(x - 1, x),)]
+    return out
 
 
 def batch_data(
         input_iter, subsamples=True, batch_size=None, axis=0,
-        cast_to_array=None, pad_mode=None, **pad_kwargs):
+        cast_to_array=None, pad_mode=None, num_buffers=0, **pad_kwargs):
     '''Generate batched data from an input generator
 
     Takes some fixed number of samples from `input_iter`, encapsulates
@@ -139,7 +319,17 @@ def batch_data(
         If set, inputs within a batch will be padded on the end to
         match the largest shapes in the batch. How the inputs are
         padded matches the argument to ``numpy.pad``. If not set, will
-        raise a ``ValueError`` if they don't all have the same shape
+        raise a ``ValueError`` if they don't all have the same shape.
+        Samples are copied directly into the batch, with
+        ``'constant'`` (scalar `constant_values` only) and ``'edge'``
+        padding filled in place. Other modes pad samples with
+        ``numpy.pad`` first
+    num_buffers : int, optional
+        If positive, (sub-)batches which are stacked into numpy arrays
+        are written into a ring of `num_buffers` buffers allocated once
+        and reused, rather than into new arrays. A yielded (sub-)batch
+        is therefore overwritten `num_buffers` batches later, so copy it
+        if it must live longer than that
     pad_kwargs : Keyword arguments, optional
         Additional keyword arguments are passed along to ``numpy.pad``
         if padding.
@@ -191,6 +381,14 @@ def batch_data(
             else:
                 yield sample
         return
+    rings = dict()
+
+    def ring(sub_batch_idx):
+        if num_buffers <= 0:
+            return None
+        if sub_batch_idx not in rings:
+            rings[sub_batch_idx] = _BufferRing(num_buffers)
+        return rings[sub_batch_idx]
     cur_batch = []
     cur_batch_size = 0
     for sample in input_iter:
@@ -219,22 +417,28 @@ def batch_data(
             if subsamples:
                 yield tuple(
                     _handle_sub_batch(
-                        sub_batch, sub_axis, pad_mode, pad_kwargs)
-                    for sub_batch, sub_axis in zip(cur_batch, cycle(axis))
+                        sub_batch, sub_axis, pad_mode, pad_kwargs,
+                        ring(sub_batch_idx))
+                    for sub_batch_idx, (sub_batch, sub_axis) in enumerate(
+                        zip(cur_batch, cycle(axis)))
                 )
             else:
-                yield _handle_sub_batch(cur_batch, axis, pad_mode, pad_kwargs)
+                yield _handle_sub_batch(
+                    cur_batch, axis, pad_mode, pad_kwargs, ring(0))
             cur_batch_size = 0
             cur_batch = []
     if cur_batch_size:
         if subsamples:
             yield tuple(
                 _handle_sub_batch(
-                    sub_batch, sub_axis, pad_mode, pad_kwargs)
-                for sub_batch, sub_axis in zip(cur_batch, cycle(axis))
+                    sub_batch, sub_axis, pad_mode, pad_kwargs,
+                    ring(sub_batch_idx))
+                for sub_batch_idx, (sub_batch, sub_axis) in enumerate(
+                    zip(cur_batch, cycle(axis)))
             )
         else:
-            yield _handle_sub_batch(cur_batch, axis, pad_mode, pad_kwargs)
+            yield _handle_sub_batch(
+                cur_batch, axis, pad_mode, pad_kwargs, ring(0))
 
 
 class Data(Iterable, Sized):
@@ -307,6 +511,15 @@ class Data(Iterable, Sized):
     The length of this object is the number of batches it serves per
     epoch.
 
+    Iteration can be checkpointed and resumed, e.g. should a training job
+    be preempted partway through an epoch. ``state_dict()`` records how
+    many samples of the current epoch have been yielded by
+    ``batch_generator()`` (and iterators), as well as the state of the
+    ``rng`` the data are shuffled with, if any. Passing that state to
+    ``load_state_dict()`` of an identically-configured instance makes
+    the next epoch pick up where the old one left off, serving the same
+    remaining samples in the same order.
+
     '''
 
     _DATA_PARAMS_DOC = '''
@@ -346,6 +559,16 @@ class Data(Iterable, Sized):
         If ``True`` and some provided table does not have some key, that
         key will simply be ignored. Otherwise, a missing key raises a
         ValueError. Default to ``False``
+    rank : int, optional
+        If `world_size` is greater than one, which shard of the data to
+        serve, between ``0`` and ``world_size - 1``. Defaults to ``0``
+    world_size : int, optional
+        The number of shards to split the data into every epoch, e.g.
+        one per process in distributed training. Shards are disjoint and
+        of equal size; up to ``world_size - 1`` samples are dropped each
+        epoch to make it so. All ranks must be initialized with the same
+        tables and arguments (including the seed of any ``rng``) save
+        `rank`. Defaults to ``1``
     '''
 
     _DATA_ATTRIBUTES_DOC = '''
@@ -388,22 +611,18 @@ class Data(Iterable, Sized):
         The number of sub-batches per batch. If > 1, batches are
         yielded as tuples of sub-batches. This number accounts for
         key, table, and axis-length sub-batches
+    rank : int
+        The shard of the data served
+    world_size : int
+        The number of shards the data are split into. `num_samples` and
+        `num_batches` count those of this shard
     '''
 
     __doc__ += _DATA_PARAMS_DOC + '\n' + _DATA_ATTRIBUTES_DOC
 
     def __init__(self, table, *additional_tables, **kwargs):
-        table_specifiers = [table]
-        table_specifiers += additional_tables
-        for table_idx, table_spec in enumerate(table_specifiers):
-            if isinstance(table_spec, str) or isinstance(table_spec, text):
-                table_spec = (table_spec, 'bm', dict())
-            elif len(table_spec) == 2:
-                table_spec += (dict(),)
-            elif len(table_spec) != 3:
-                raise ValueError('Invalid table spec {}'.format(table_spec))
-            table_specifiers[table_idx] = table_spec
-        self.table_specifiers = tuple(table_specifiers)
+        table_specifiers = _table_specifiers((table,) + additional_tables)
+        self.table_specifiers = table_specifiers
         self.add_key = bool(kwargs.pop('add_key', False))
         axis_lengths = kwargs.pop('axis_lengths', None)
         batch_axis = kwargs.pop('batch_axis', 0)
@@ -411,23 +630,18 @@ class Data(Iterable, Sized):
         self.batch_pad_mode = kwargs.pop('batch_pad_mode', None)
         self.batch_size = kwargs.pop('batch_size', None)
         self.ignore_missing = bool(kwargs.pop('ignore_missing', False))
+        self.rank = kwargs.pop('rank', 0)
+        self.world_size = kwargs.pop('world_size', 1)
+        if self.world_size < 1 or not (0 <= self.rank < self.world_size):
+            raise ValueError(
+                'Expected 0 <= rank < world_size, got rank={} and '
+                'world_size={}'.format(self.rank, self.world_size))
         self.batch_kwargs = kwargs
         invalid_kwargs = {'axis', 'cast_to_array', 'pad_mode', 'subsamples'}
         invalid_kwargs &= set(kwargs.keys())
         if invalid_kwargs:
             raise TypeError('Invalid argument {}'.format(invalid_kwargs.pop()))
-        if axis_lengths is None:
-            self.axis_lengths = tuple()
-        elif isinstance(axis_lengths, int):
-            self.axis_lengths = ((0, axis_lengths),)
-        else:
-            axis_lengths = tuple(axis_lengths)  # in case generator
-            if len(axis_lengths) == 2 and \
-                    isinstance(axis_lengths[0], int) and \
-                    isinstance(axis_lengths[1], int):
-                self.axis_lengths = (axis_lengths,)
-            else:
-                self.axis_lengths = tuple(tuple(pair) for pair in axis_lengths)
+        self.axis_lengths = _axis_length_pairs(axis_lengths)
         self.num_sub = len(table_specifiers) + int(self.add_key)
         self.num_sub += len(self.axis_lengths)
         for attribute_name, variable in (
@@ -447,6 +661,10 @@ class Data(Iterable, Sized):
                 setattr(self, attribute_name, variable)
             except TypeError:
                 setattr(self, attribute_name, (variable,) * self.num_sub)
+        self._epoch_position = None
+        self._epoch_rng_state = None
+        self._resume_position = None
+        self._sample_position = None
 
     @property
     @abstractmethod
@@ -523,22 +741,97 @@ class Data(Iterable, Sized):
         worth of data evenly, the last batch of every epoch will be
         smaller
         '''
-        subsamples = self.num_sub != 1
         while True:
-            for batch in batch_data(
-                    self.sample_generator_for_epoch(),
-                    subsamples=subsamples,
-                    batch_size=self.batch_size,
-                    axis=self.batch_axis if subsamples else self.batch_axis[0],
-                    pad_mode=self.batch_pad_mode,
-                    cast_to_array=(
-                        self.batch_cast_to_array if subsamples else
-                        self.batch_cast_to_array[0]),
-                    **self.batch_kwargs):
+            position, self._resume_position = self._resume_position, None
+            rng = getattr(self, 'rng', None)
+            if rng is not None:
+                self._epoch_rng_state = rng.get_state()
+            self._epoch_position = position or {'samples': 0}
+            for batch, self._epoch_position in self._epoch_batches(position):
                 yield batch
+            self._epoch_position = None
             if not repeat:
                 break
 
+    def state_dict(self):
+        '''Get the state of iteration, for resuming it later
+
+        Returns
+        -------
+        dict
+            The entry ``'position'`` is ``None`` between epochs. Mid-epoch,
+            it describes how far along the epoch ``batch_generator()`` is.
+            If the data have an ``rng``, the entry ``'rng'`` stores its
+            state as of the start of the current epoch (or its current
+            state between epochs)
+        '''
+        state = {'position': self._epoch_position}
+        if self._epoch_position is not None:
+            state['position'] = dict(self._epoch_position)
+        rng = getattr(self, 'rng', None)
+        if rng is not None:
+            if self._epoch_position is None:
+                state['rng'] = rng.get_state()
+            else:
+                state['rng'] = self._epoch_rng_state
+        return state
+
+    def load_state_dict(self, state):
+        '''Restore the state of iteration returned by ``state_dict()``
+
+        The next epoch, be it from a new iterator or the next pass of a
+        repeating ``batch_generator()``, resumes from where the epoch of
+        `state` left off. Samples already served are skipped without
+        being read whenever the data and tables allow it
+
+        Parameters
+        ----------
+        state : dict
+        '''
+        rng = getattr(self, 'rng', None)
+        if rng is not None and state.get('rng') is not None:
+            rng.set_state(state['rng'])
+        self._epoch_position = None
+        self._resume_position = state.get('position')
+        if self._resume_position is not None:
+            self._resume_position = dict(self._resume_position)
+
+    def _resumed_samples(self, position):
+        '''Samples of an epoch, past the position of a previous one'''
+        skip = position['samples'] if position else 0
+        for samp_idx, sample in enumerate(self.sample_generator_for_epoch()):
+            # without knowing how the samples came about, the only way
+            # to get past the first samples is to read them
+            if samp_idx >= skip:
+                self._sample_position = {'samples': samp_idx + 1}
+                yield sample
+
+    def _epoch_batches(self, position):
+        '''Generate (batch, position) pairs of an epoch
+
+        Position describes where the epoch is just after the batch. The
+        epoch resumes from position, if set
+        '''
+        # batch_data only asks for as many samples as it needs, so the
+        # position of the last sample is that of the batch
+        for batch in self._batch_samples(
+                self._resumed_samples(position), self.batch_size):
+            yield batch, self._sample_position
+
+    def _batch_samples(self, samples, batch_size):
+        '''Pass samples to batch_data with this object's settings'''
+        subsamples = self.num_sub != 1
+        return batch_data(
+            samples,
+            subsamples=subsamples,
+            batch_size=batch_size,
+            axis=self.batch_axis if subsamples else self.batch_axis[0],
+            pad_mode=self.batch_pad_mode,
+            cast_to_array=(
+                self.batch_cast_to_array if subsamples else
+                self.batch_cast_to_array[0]),
+            **self.batch_kwargs)
+
     def __iter__(self):
         for batch in self.batch_generator():
             yield batch
@@ -556,6 +849,11 @@ class ShuffledData(Data):
     -----
         For efficiency, it is highly recommended to use scripts
         to access tables rather than archives.
+
+        When the data are split amongst worker processes, passing
+        ``{'shared_cache': name}`` as a table's open kwargs lets workers
+        on the same node share one decoded copy of that table's arrays
+        (see ``pydrobert.kaldi.io.shared_cache``).
     '''
 
     __doc__ += Data._DATA_PARAMS_DOC + '''
@@ -600,10 +898,6 @@ class ShuffledData(Data):
                 self.key_list = tuple(reader.keys())
         else:
             self.key_list = tuple(key_list)
-        if self.ignore_missing:
-            self._num_samples = None
-        else:
-            self._num_samples = len(self.key_list)
         if isinstance(rng, np.random.RandomState):
             self.rng = rng
         else:
@@ -612,64 +906,341 @@ class ShuffledData(Data):
             io_open(rspecifier, kdtype, mode='r+', **o_kwargs)
             for rspecifier, kdtype, o_kwargs in self.table_specifiers
         )
+        if self.ignore_missing and self.world_size > 1:
+            # shards can only be of equal size if they're drawn from keys
+            # every table has
+            self.key_list = self._present_keys()
+        if self.ignore_missing and self.world_size == 1:
+            self._num_samples = None
+        else:
+            self._num_samples = len(self.key_list) // self.world_size
+
+    def _present_keys(self):
+        '''The keys of key_list present in all tables, as a tuple'''
+        # checking for a key in an archive makes kaldi read it up to
+        # that key. When possible, collect the archive's keys with a
+        # cheaper metadata pass instead. Open kwargs (e.g. utt2spk) may
+        # change what keys the handle has, so then we ask the handle
+        table_keys = []
+        for spec, handle in zip(self.table_specifiers, self.table_handles):
+            table_type = parse_kaldi_input_path(spec[0])[0]
+            if table_type == TableType.ArchiveTable and not spec[2] and \
+                    _has_metadata(KaldiDataType(spec[1])):
+                table_keys.append(set(key for key, _ in _key_shapes(spec)))
+            else:
+                table_keys.append(handle)
+        return tuple(
+            key for key in self.key_list
+            if all(key in keys for keys in table_keys)
+        )
 
     @property
     def num_samples(self):
         if self._num_samples is None:
-            self._num_samples = 0
-            for key in self.key_list:
-                missing = False
-                for handle in self.table_handles:
-                    if key not in handle:
-                        missing = True
-                        break
-                if not missing:
-                    self._num_samples += 1
+            self._num_samples = len(self._present_keys())
         return self._num_samples
 
-    def sample_generator_for_epoch(self):
-        shuffled_keys = np.array(self.key_list)
-        self.rng.shuffle(shuffled_keys)
-        num_samples = 0
-        for key in shuffled_keys:
+    def _samples_for_keys(self, keys):
+        '''Generate the samples of keys, skipping missing ones if allowed'''
+        key_values = tuple(
+            handle.get_many(keys, ignore_missing=True)
+            for handle in self.table_handles
+        )
+        for samp_idx, key in enumerate(keys):
             samp_tup = []
             missing = False
-            for spec, handle in zip(self.table_specifiers, self.table_handles):
-                if key not in handle:
+            for spec, values in zip(self.table_specifiers, key_values):
+                value = values[samp_idx]
+                if value is None:
                     if self.ignore_missing:
                         missing = True
                         break
                     else:
                         raise IOError(
                             'Table {} missing key {}'.format(spec[0], key))
-                samp_tup.append(handle[key])
+                samp_tup.append(value)
             if missing:
                 continue
-            num_samples += 1
             for sub_batch_idx, axis_idx in self.axis_lengths:
                 samp_tup.append(
                     np.array(
-                        samp_tup[sub_batch_idx], copy=False).shape[axis_idx])
+                        samp_tup[sub_batch_idx],
+                        copy=False).shape[axis_idx])
             if self.add_key:
                 samp_tup.insert(0, key)
             if self.num_sub != 1:
                 yield tuple(samp_tup)
             else:
                 yield samp_tup[0]
+
+    def __getstate__(self):
+        # readers cannot be pickled. They are reopened on unpickling
+        state = self.__dict__.copy()
+        del state['table_handles']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.table_handles = tuple(
+            io_open(rspecifier, kdtype, mode='r+', **o_kwargs)
+            for rspecifier, kdtype, o_kwargs in self.table_specifiers
+        )
+
+    def batch_keys_for_epoch(self):
+        '''Shuffle and group keys into batches for an epoch
+
+        Returns
+        -------
+        list
+            A list of sequences of keys, one per batch (or per sample if
+            `batch_size` is not set), in the order they should be served
+        '''
+        shuffled_keys = np.array(self.key_list)
+        self.rng.shuffle(shuffled_keys)
+        if self.world_size > 1:
+            shuffled_keys = shuffled_keys[
+                self.rank:self.world_size * self._num_samples:
+                self.world_size]
+        chunk_size = self.batch_size or 1
+        return [
+            shuffled_keys[chunk_start:chunk_start + chunk_size]
+            for chunk_start in range(0, len(shuffled_keys), chunk_size)
+        ]
+
+    def batch_for_keys(self, keys):
+        '''Read and batch the samples of keys
+
+        Parameters
+        ----------
+        keys : sequence
+            A sequence of keys, as in an element of the list returned by
+            ``batch_keys_for_epoch()``
+
+        Returns
+        -------
+        object
+            The batch. If `batch_size` is not set, `keys` should contain
+            one key and the sample is returned. ``None`` if every key is
+            missing and `ignore_missing` is set
+        '''
+        samples = list(self._samples_for_keys(keys))
+        if not samples:
+            return None
+        return next(self._batch_samples(
+            samples, len(samples) if self.batch_size else None))
+
+    def _skip_keys(self, batch_keys, skip):
+        '''Drop the keys of the first skip samples from batch_keys'''
+        keys = [key for chunk in batch_keys for key in chunk]
+        if self.ignore_missing and self.world_size == 1:
+            # only keys present in every table count as samples
+            present = set(self._present_keys())
+            start = 0
+            while skip and start < len(keys):
+                if keys[start] in present:
+                    skip -= 1
+                start += 1
+        else:
+            start = skip
+        keys = keys[start:]
+        chunk_size = self.batch_size or 1
+        return [
+            keys[chunk_start:chunk_start + chunk_size]
+            for chunk_start in range(0, len(keys), chunk_size)
+        ]
+
+    def _resumed_samples(self, position):
+        num_samples = position['samples'] if position else 0
+        # the permutation is drawn as usual, then the keys already served
+        # are dropped without being read
+        batch_keys = self.batch_keys_for_epoch()
+        if num_samples:
+            batch_keys = self._skip_keys(batch_keys, num_samples)
+        # values are retrieved a batch's worth of keys at a time
+        for chunk in batch_keys:
+            for sample in self._samples_for_keys(chunk):
+                num_samples += 1
+                self._sample_position = {'samples': num_samples}
+                yield sample
         if self._num_samples is None:
             self._num_samples = num_samples
         elif self._num_samples != num_samples:
             raise IOError('Different number of samples from last time!')
 
+    def sample_generator_for_epoch(self):
+        return self._resumed_samples(None)
+
     sample_generator_for_epoch.__doc__ = Data.num_samples.__doc__
 
 
+class BucketedData(ShuffledData):
+    '''Provides iterators over shuffled data, batched by length
+
+    Keys are sorted by length and split into buckets. Every new iterator
+    requested shuffles the keys within each bucket, groups them into
+    batches drawn from a single bucket, then shuffles the order of the
+    batches across buckets. Since samples in a batch have similar
+    lengths, little padding is needed to stack them. Appropriate for
+    training sequence models.
+
+    The size of a bucket's batches is limited by `batch_size`, by
+    `max_frames`, or both. `max_frames` bounds the number of frames in
+    a batch after padding: a bucket whose longest sample has length
+    ``L`` gets batches of at most ``max(1, max_frames // L)`` samples.
+    The number of batches per epoch is therefore fixed, though the last
+    batch of each bucket may be smaller than the rest.
+
+    Lengths can be provided via `key_lengths`. Otherwise, they are the
+    length of axis `length_axis` of the values in the first table, which
+    requires reading the table once on initialization.
+
+    Notes
+    -----
+        Batches are yielded as-is, so `batch_pad_mode` should be set if
+        samples of the same bucket can differ in length.
+    '''
+
+    __doc__ += Data._DATA_PARAMS_DOC + '''
+    key_list : sequence, optional
+        A master list of keys. No other keys will be queried. If not
+        specified, the keys of `key_lengths` are used or, failing that,
+        the key list will be inferred by passing through the first table
+        once
+    rng : int or numpy.random.RandomState, optional
+        Either a ``RandomState`` object or a seed to create a
+        ``RandomState`` object. It will be used to shuffle keys and
+        batches
+    key_lengths : dict or sequence, optional
+        A map (or sequence of pairs) from keys to lengths
+    length_axis : int, optional
+        If `key_lengths` is not specified, the axis of the first table's
+        values whose length is used. Defaults to ``0``
+    num_buckets : int, optional
+        The number of buckets to split keys into. Buckets are chosen to
+        contain (nearly) the same number of keys. Defaults to ``10``
+    bucket_boundaries : sequence, optional
+        If set, overrides `num_buckets`. An increasing sequence of
+        lengths such that a key of length ``l`` is put in bucket ``i``
+        when ``bucket_boundaries[i - 1] <= l < bucket_boundaries[i]``
+    max_frames : int, optional
+        The maximum number of (padded) frames in a batch. At least one
+        of `batch_size` and `max_frames` must be set
+
+    '''
+
+    __doc__ += '\n' + Data._DATA_ATTRIBUTES_DOC + '''
+    key_list : tuple
+        The master list of keys
+    rng : numpy.random.RandomState
+        Used to shuffle keys and batches every epoch
+    table_holders : tuple
+        A tuple of table readers opened in random access mode
+    key_lengths : dict
+        The length of each key in `key_list`
+    buckets : tuple
+        A tuple of tuples of keys, one per nonempty bucket, in order of
+        increasing length
+    bucket_batch_sizes : tuple
+        The number of samples in full batches of the respective bucket
+    max_frames : int or None
+
+    '''
+
+    def __init__(self, table, *additional_tables, **kwargs):
+        key_lengths = kwargs.pop('key_lengths', None)
+        length_axis = kwargs.pop('length_axis', 0)
+        num_buckets = kwargs.pop('num_buckets', 10)
+        bucket_boundaries = kwargs.pop('bucket_boundaries', None)
+        self.max_frames = kwargs.pop('max_frames', None)
+        if key_lengths is not None:
+            key_lengths = dict(key_lengths)
+            if kwargs.get('key_list', None) is None:
+                kwargs['key_list'] = sorted(key_lengths)
+        super(BucketedData, self).__init__(
+            table, *additional_tables, **kwargs)
+        if not self.batch_size and not self.max_frames:
+            raise ValueError(
+                'At least one of batch_size or max_frames must be set')
+        if self.ignore_missing and self.world_size == 1:
+            self.key_list = self._present_keys()
+        if key_lengths is None:
+            key_lengths = dict(
+                (key, shape[length_axis])
+                for key, shape in _key_shapes(self.table_specifiers[0])
+            )
+        try:
+            self.key_lengths = dict(
+                (key, key_lengths[key]) for key in self.key_list)
+        except KeyError as error:
+            raise ValueError('No length for key {}'.format(error.args[0]))
+        self.buckets = _length_buckets(
+            self.key_list, self.key_lengths, num_buckets, bucket_boundaries)
+        self.bucket_batch_sizes = _bucket_batch_sizes(
+            self.buckets, self.key_lengths, self.batch_size, self.max_frames)
+        self._num_samples = sum(
+            len(bucket) // self.world_size for bucket in self.buckets)
+
+    @property
+    def num_batches(self):
+        return _num_bucketed_batches(
+            self.buckets, self.bucket_batch_sizes, self.world_size)
+
+    num_batches.__doc__ = Data.num_batches.__doc__
+
+    def batch_keys_for_epoch(self):
+        '''Shuffle and group keys into batches for an epoch
+
+        Returns
+        -------
+        list
+            A list of lists of keys, one per batch, in the order they
+            should be served
+        '''
+        return _bucketed_batches(
+            self.buckets, self.bucket_batch_sizes, self.rng, self.rank,
+            self.world_size)
+
+    def batch_for_keys(self, keys):
+        samples = list(self._samples_for_keys(keys))
+        if not samples:
+            return None
+        return next(self._batch_samples(samples, len(samples)))
+
+    batch_for_keys.__doc__ = ShuffledData.batch_for_keys.__doc__
+
+    def sample_generator_for_epoch(self):
+        for batch_keys in self.batch_keys_for_epoch():
+            for sample in self._samples_for_keys(batch_keys):
+                yield sample
+
+    sample_generator_for_epoch.__doc__ = \
+        Data.sample_generator_for_epoch.__doc__
+
+    def _epoch_batches(self, position):
+        num_samples = position['samples'] if position else 0
+        skip = num_samples
+        for batch_keys in self.batch_keys_for_epoch():
+            # keys are always present, so batches hold every one of theirs
+            if skip >= len(batch_keys):
+                skip -= len(batch_keys)
+                continue
+            batch = self.batch_for_keys(batch_keys)
+            num_samples += len(batch_keys)
+            if batch is not None:
+                yield batch, {'samples': num_samples}
+
+
 class SequentialData(Data):
     '''Provides iterators to read data sequentially
 
     Tables are always assumed to be sorted so reading can proceed in
     lock-step.
 
+    If `prefetch` is set, reading and batching are performed by a
+    background thread, which stays up to `prefetch` batches ahead of the
+    consumer. Kaldi releases the GIL while reading, so decoding the next
+    batch overlaps with whatever is done with the current one.
+
     Warning
     -------
         Each time an iterator is requested, new sequential readers are
@@ -677,12 +1248,32 @@ class SequentialData(Data):
 
     '''
 
-    __doc__ += Data._DATA_PARAMS_DOC + '\n' + Data._DATA_ATTRIBUTES_DOC
+    __doc__ += Data._DATA_PARAMS_DOC + '''
+    prefetch : int, optional
+        The number of batches to read ahead in a background thread. If
+        ``0`` (the default), batches are read on demand by the caller
+
+    '''
+
+    __doc__ += '\n' + Data._DATA_ATTRIBUTES_DOC + '''
+    prefetch : int
+        The number of batches read ahead in a background thread
+
+    '''
 
     def __init__(self, table, *additional_tables, **kwargs):
+        self.prefetch = kwargs.pop('prefetch', 0)
         super(SequentialData, self).__init__(
             table, *additional_tables, **kwargs)
         self._num_samples = None
+        self._check_sorted()
+        if self.ignore_missing and len(self.table_specifiers) > 1:
+            self._sample_generator_for_epoch = self._ignore_epoch
+        else:
+            self._sample_generator_for_epoch = self._no_ignore_epoch
+
+    def _check_sorted(self):
+        '''Warn if some table is not flagged as sorted'''
         sorteds = tuple(
             parse_kaldi_input_path(spec[0])[3]['sorted']
             for spec in self.table_specifiers
@@ -698,18 +1289,24 @@ class SequentialData(Data):
                 'check that this table is sorted, then add the sorted '
                 'flag to this rspecifier ("{}")'.format(
                     uns_rspec, sor_rspec))
-        if self.ignore_missing and len(self.table_specifiers) > 1:
-            self._sample_generator_for_epoch = self._ignore_epoch
-        else:
-            self._sample_generator_for_epoch = self._no_ignore_epoch
 
-    def _ignore_epoch(self):
-        '''Epoch of samples w/ ignore_missing'''
-        iters = tuple(
-            io_open(spec[0], spec[1], **spec[2]).items()
-            for spec in self.table_specifiers
-        )
-        num_samples = 0
+    def _open_iters(self, past_key=None):
+        '''Open an items iterator per table, starting after past_key'''
+        iters = []
+        for rspecifier, kaldi_dtype, open_kwargs in self.table_specifiers:
+            if past_key is not None:
+                rspecifier = _seek_past_key(rspecifier, kaldi_dtype, past_key)
+            reader = io_open(rspecifier, kaldi_dtype, **open_kwargs)
+            if past_key is not None:
+                # keys are available without reading their values, at
+                # least for scripts
+                while not reader.done() and reader.key() <= past_key:
+                    reader.move()
+            iters.append(reader.items())
+        return tuple(iters)
+
+    def _ignore_epoch(self, iters, num_samples=0):
+        '''Epoch of (key, sample) pairs w/ ignore_missing'''
         num_tabs = len(iters)
         try:
             while True:
@@ -744,9 +1341,9 @@ class SequentialData(Data):
                 if self.add_key:
                     samp_tup.insert(0, key)
                 if self.num_sub != 1:
-                    yield tuple(samp_tup)
+                    yield key, tuple(samp_tup)
                 else:
-                    yield samp_tup[0]
+                    yield key, samp_tup[0]
         except StopIteration:
             pass
         # don't care if one iterator ends first - rest will be missing
@@ -758,13 +1355,8 @@ class SequentialData(Data):
                 'Different number of samples from last time! (is a '
                 'table from stdin?)')
 
-    def _no_ignore_epoch(self):
-        '''Epoch of samples w/o ignore_missing'''
-        iters = tuple(
-            io_open(spec[0], spec[1], **spec[2]).items()
-            for spec in self.table_specifiers
-        )
-        num_samples = 0
+    def _no_ignore_epoch(self, iters, num_samples=0):
+        '''Epoch of (key, sample) pairs w/o ignore_missing'''
         for kv_pairs in zip(*iters):
             samp_tup = []
             past_key = None
@@ -791,9 +1383,9 @@ class SequentialData(Data):
             if self.add_key:
                 samp_tup.insert(0, key)
             if self.num_sub != 1:
-                yield tuple(samp_tup)
+                yield key, tuple(samp_tup)
             else:
-                yield samp_tup[0]
+                yield key, samp_tup[0]
         # make sure all iterators ended at the same time
         for tab_idx, it in enumerate(iters):
             try:
@@ -815,20 +1407,532 @@ class SequentialData(Data):
 
     @property
     def num_samples(self):
+        # _num_samples counts the samples of every shard
         if self._num_samples is None:
-            # gets set after you run through an epoch
-            assert (
-                sum(1 for _ in self.sample_generator_for_epoch()) ==
-                self._num_samples)
-        return self._num_samples
+            # count keys rather than running through an epoch. Numeric
+            # tables are only read for metadata
+            if self.ignore_missing and len(self.table_specifiers) > 1:
+                keys = None
+                for spec in self.table_specifiers:
+                    spec_keys = set(key for key, _ in _key_shapes(spec))
+                    keys = spec_keys if keys is None else keys & spec_keys
+                self._num_samples = len(keys)
+            else:
+                self._num_samples = sum(
+                    1 for _ in _key_shapes(self.table_specifiers[0]))
+        return self._num_samples // self.world_size
+
+    def _resumed_samples(self, position):
+        # the position of a sequential epoch also records how far along
+        # the (unsharded) tables it is, and the last key served
+        position = position or dict()
+        num_samples = position.get('samples', 0)
+        samp_idx = position.get('stream', 0)
+        if self.world_size > 1:
+            end = self.num_samples * self.world_size
+        key_samples = self._sample_generator_for_epoch(
+            self._open_iters(position.get('key')), samp_idx)
+        for key, sample in key_samples:
+            samp_idx += 1
+            # keep going past the end so that the epoch is checked
+            if self.world_size > 1 and (
+                    samp_idx > end or
+                    (samp_idx - 1) % self.world_size != self.rank):
+                continue
+            num_samples += 1
+            self._sample_position = {
+                'samples': num_samples, 'stream': samp_idx, 'key': key}
+            yield sample
+
+    def sample_generator_for_epoch(self):
+        # subclasses may resume differently, but still read through here
+        return SequentialData._resumed_samples(self, None)
+
+    def _epoch_batches(self, position):
+        generator = super(SequentialData, self)._epoch_batches(position)
+        if self.prefetch:
+            generator = _prefetch(generator, self.prefetch)
+        return generator
+
+    sample_generator_for_epoch.__doc__ = \
+        Data.sample_generator_for_epoch.__doc__
+
+
+class BufferedShuffleData(SequentialData):
+    '''Provides iterators over data shuffled through a buffer
+
+    Tables are read sequentially, as in ``SequentialData``, into a buffer
+    of samples. Once the buffer is full, every new sample read replaces a
+    sample drawn at random from the buffer, which is yielded. When the
+    tables are exhausted, the remainder of the buffer is yielded in
+    random order. Unlike ``ShuffledData``, tables need not support random
+    access, so data may be shuffled from pipes (e.g.
+    ``'ark:compute-fbank-feats ... |'``) or huge archives at sequential
+    read speeds. The larger the buffer, the more thorough the shuffle.
+
+    The buffer is bounded by the number of samples it holds
+    (`buffer_size`), the approximate number of bytes its samples occupy
+    (`buffer_bytes`), or both.
+
+    Warning
+    -------
+        Each time an iterator is requested, new sequential readers are
+        opened, and ``len()`` requires a pass through the first table.
+        Be careful with stdin!
+
+    '''
+
+    __doc__ += Data._DATA_PARAMS_DOC + '''
+    prefetch : int, optional
+        The number of batches to read ahead in a background thread. If
+        ``0`` (the default), batches are read on demand by the caller
+    buffer_size : int, optional
+        The maximum number of samples held in the buffer. Defaults to
+        ``1000`` unless `buffer_bytes` is set
+    buffer_bytes : int, optional
+        The maximum (approximate) number of bytes the samples in the
+        buffer may occupy
+    rng : int or numpy.random.RandomState, optional
+        Either a ``RandomState`` object or a seed to create a
+        ``RandomState`` object. It will be used to draw samples from the
+        buffer
+
+    '''
+
+    __doc__ += '\n' + Data._DATA_ATTRIBUTES_DOC + '''
+    prefetch : int
+        The number of batches read ahead in a background thread
+    buffer_size : int or None
+    buffer_bytes : int or None
+    rng : numpy.random.RandomState
+        Used to draw samples from the buffer
+
+    '''
+
+    def __init__(self, table, *additional_tables, **kwargs):
+        self.buffer_size = kwargs.pop('buffer_size', None)
+        self.buffer_bytes = kwargs.pop('buffer_bytes', None)
+        rng = kwargs.pop('rng', None)
+        if self.buffer_size is None and self.buffer_bytes is None:
+            self.buffer_size = 1000
+        super(BufferedShuffleData, self).__init__(
+            table, *additional_tables, **kwargs)
+        if isinstance(rng, np.random.RandomState):
+            self.rng = rng
+        else:
+            self.rng = np.random.RandomState(rng)
+
+    def _check_sorted(self):
+        # a lone table is never merged, so its order doesn't matter
+        if len(self.table_specifiers) > 1:
+            super(BufferedShuffleData, self)._check_sorted()
+
+    def _buffer_full(self, buffer, buffer_bytes):
+        return (
+            (self.buffer_size is not None and
+                len(buffer) > self.buffer_size) or
+            (self.buffer_bytes is not None and
+                buffer_bytes > self.buffer_bytes)
+        )
+
+    def _resumed_samples(self, position):
+        # what's in the buffer depends on every sample read so far, so
+        # the epoch is replayed from its start
+        return Data._resumed_samples(self, position)
 
     def sample_generator_for_epoch(self):
-        return self._sample_generator_for_epoch()
+        buffer = []
+        sample_bytes = []
+        buffer_bytes = 0
+        for sample in super(
+                BufferedShuffleData, self).sample_generator_for_epoch():
+            buffer.append(sample)
+            if self.buffer_bytes is not None:
+                sample_bytes.append(_value_nbytes(sample))
+                buffer_bytes += sample_bytes[-1]
+            while buffer and self._buffer_full(buffer, buffer_bytes):
+                # swap the drawn sample to the end, where it's cheap to pop
+                idx = self.rng.randint(len(buffer))
+                buffer[idx], buffer[-1] = buffer[-1], buffer[idx]
+                if self.buffer_bytes is not None:
+                    sample_bytes[idx], sample_bytes[-1] = \
+                        sample_bytes[-1], sample_bytes[idx]
+                    buffer_bytes -= sample_bytes.pop()
+                yield buffer.pop()
+        order = np.arange(len(buffer))
+        self.rng.shuffle(order)
+        for idx in order:
+            yield buffer[idx]
 
     sample_generator_for_epoch.__doc__ = \
         Data.sample_generator_for_epoch.__doc__
 
 
+def _seek_past_key(rspecifier, kaldi_dtype, key):
+    '''An rspecifier of a sorted archive starting after key, if possible'''
+    kaldi_dtype = KaldiDataType(kaldi_dtype)
+    table_type, rxfilename, rx_type, _ = parse_kaldi_input_path(rspecifier)
+    if table_type != TableType.ArchiveTable or \
+            rx_type != RxfilenameType.FileInput or \
+            not _has_metadata(kaldi_dtype):
+        return rspecifier
+    # entries are found by their headers alone
+    archive = _MemoryMappedArchive(rxfilename, kaldi_dtype)
+    try:
+        offset = 0
+        entry = archive.next_entry(offset)
+        while entry is not None and entry[0] <= key:
+            offset = entry[2]
+            entry = archive.next_entry(offset)
+    finally:
+        archive.close()
+    if not offset:
+        return rspecifier
+    return '{}:{}:{}'.format(rspecifier.split(':', 1)[0], rxfilename, offset)
+
+
+def _prefetch(generator, depth):
+    '''Run a generator in a background thread, queueing up to depth items'''
+    items = queue.Queue(depth)
+    stop = threading.Event()
+
+    def _put(item):
+        # give up if the consumer has stopped listening
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run():
+        try:
+            for item in generator:
+                if not _put((True, item)):
+                    return
+            _put((True, _prefetch))  # doubles as the end marker
+        except Exception:
+            _put((False, sys.exc_info()))
+        finally:
+            generator.close()
+
+    thread = threading.Thread(target=_run)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            success, item = items.get()
+            if not success:
+                reraise(*item)
+            elif item is _prefetch:
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class _SharedArray(object):
+    '''An array a worker saved to shared memory for the parent to load'''
+
+    __slots__ = ('path',)
+
+    def __init__(self, path):
+        self.path = path
+
+
+def _to_shared(value, directory):
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=directory)
+        with os.fdopen(fd, 'wb') as file_obj:
+            np.save(file_obj, value, allow_pickle=False)
+        return _SharedArray(path)
+    elif isinstance(value, tuple):
+        return tuple(_to_shared(sub_value, directory) for sub_value in value)
+    return value
+
+
+def _from_shared(value):
+    if isinstance(value, _SharedArray):
+        # copy-on-write, so the batch may be modified in place
+        array = np.load(
+            value.path, mmap_mode='c', allow_pickle=False).view(np.ndarray)
+        # the mapping outlives the file
+        os.remove(value.path)
+        return array
+    elif isinstance(value, tuple):
+        return tuple(_from_shared(sub_value) for sub_value in value)
+    return value
+
+
+def _parallel_data_worker(pickled_data, key_queue, batch_queue, directory):
+    try:
+        # reopens the tables
+        data = pickle.loads(pickled_data)
+    except Exception:
+        batch_queue.put((False, format_exc()))
+        return
+    while True:
+        keys = key_queue.get()
+        if keys is None:
+            break
+        try:
+            batch = data.batch_for_keys(keys)
+            batch_queue.put((True, _to_shared(batch, directory)))
+        except Exception:
+            batch_queue.put((False, format_exc()))
+
+
+# how long ParallelData waits on a batch before checking its worker is alive
+_WORKER_POLL_INTERVAL = .1
+# how long ParallelData.close() waits for a worker before terminating it
+_WORKER_JOIN_TIMEOUT = 5.
+
+
+class ParallelData(Iterable, Sized):
+    '''Prefetches batches of data in worker processes
+
+    Wraps a ``ShuffledData`` (or subclass) instance. The wrapped instance
+    decides on the batches of keys of an epoch, which are handed out to
+    `num_workers` worker processes in turn. Each worker opens its own
+    readers, reads and batches the values of its keys, and passes the
+    batches back through shared memory. Batches are yielded in the same
+    order as ``data.batch_generator()`` would have, so iteration remains
+    deterministic for a seeded ``rng``.
+
+    Workers are started when first iterated over and persist across
+    epochs until ``close()`` is called. An epoch cut short (e.g. by
+    breaking out of a loop over batches) terminates the workers, which
+    are restarted when next iterated over. If a worker fails to open its
+    tables or dies, an ``IOError`` is raised.
+
+    Like ``Data``, iteration can be checkpointed with ``state_dict()``
+    and resumed with ``load_state_dict()``. Batches already served are
+    not read again.
+
+    Parameters
+    ----------
+    data : ShuffledData
+        The data to serve. Must be picklable (``ShuffledData`` reopens its
+        tables when unpickled)
+    num_workers : int, optional
+        The number of worker processes. If ``0``, batches are read by the
+        calling process, exactly as ``data`` would have
+    prefetch : int, optional
+        The number of finished batches each worker may queue up ahead of
+        the consumer
+    shm_root : str, optional
+        The directory batches are passed through. Defaults to ``/dev/shm``
+        if it exists, or the temporary directory otherwise
+
+    Attributes
+    ----------
+    data : ShuffledData
+    num_workers : int
+    prefetch : int
+
+    Notes
+    -----
+        Unlike ``ShuffledData``, which fills batches with samples across
+        missing keys when `ignore_missing` is set, batches are formed
+        from the keys in ``data.batch_keys_for_epoch()`` alone and may be
+        smaller than `batch_size` if some are missing.
+    '''
+
+    def __init__(self, data, num_workers=2, prefetch=2, shm_root=None):
+        if not isinstance(data, ShuffledData):
+            raise TypeError(
+                'ParallelData can only wrap ShuffledData and its '
+                'subclasses')
+        self.data = data
+        self.num_workers = num_workers
+        self.prefetch = max(1, prefetch)
+        self._shm_root = shm_root
+        self._directory = None
+        self._workers = []
+        self._key_queues = []
+        self._batch_queues = []
+        self._epoch_position = None
+        self._epoch_rng_state = None
+        self._resume_position = None
+
+    @property
+    def num_samples(self):
+        '''int : the number of samples yielded per epoch'''
+        return self.data.num_samples
+
+    @property
+    def num_batches(self):
+        '''int : the number of batches yielded per epoch'''
+        return self.data.num_batches
+
+    def __len__(self):
+        return self.num_batches
+
+    def _start(self):
+        if self._workers:
+            return
+        self._directory = tempfile.mkdtemp(
+            prefix='pydrobert-kaldi-parallel-',
+            dir=self._shm_root or _default_shm_root())
+        pickled_data = pickle.dumps(self.data, pickle.HIGHEST_PROTOCOL)
+        for _ in range(self.num_workers):
+            key_queue = multiprocessing.Queue()
+            batch_queue = multiprocessing.Queue(self.prefetch)
+            worker = multiprocessing.Process(
+                target=_parallel_data_worker,
+                args=(pickled_data, key_queue, batch_queue, self._directory))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+            self._key_queues.append(key_queue)
+            self._batch_queues.append(batch_queue)
+
+    def _stop(self, terminate):
+        # stops workers. Unless terminate, they may first finish their
+        # current batch
+        if not terminate:
+            for key_queue in self._key_queues:
+                key_queue.put(None)
+        for worker in self._workers:
+            if not terminate:
+                worker.join(_WORKER_JOIN_TIMEOUT)
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        self._workers = []
+        self._key_queues = []
+        self._batch_queues = []
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def close(self):
+        '''Stop the worker processes
+
+        They will be restarted if iterated over again
+        '''
+        self._stop(False)
+
+    def _get_batch(self, batch_idx):
+        worker_idx = batch_idx % self.num_workers
+        batch_queue = self._batch_queues[worker_idx]
+        worker = self._workers[worker_idx]
+        while True:
+            try:
+                return batch_queue.get(timeout=_WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                if worker.is_alive():
+                    continue
+            # a worker flushes what it's put before exiting
+            try:
+                return batch_queue.get(False)
+            except queue.Empty:
+                raise IOError(
+                    'Worker exited unexpectedly with code {}'.format(
+                        worker.exitcode))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self.close()
+
+    def batch_generator(self, repeat=False):
+        '''A generator which yields batches of data
+
+        Parameters
+        ----------
+        repeat : bool
+            Whether to stop generating after one epoch (False) or keep
+            restart and continue generating indefinitely
+
+        Yields
+        ------
+        A batch if ``self.data.num_sub == 1``, otherwise a tuple of
+        sub-batches
+        '''
+        if not self.num_workers:
+            for batch in self.data.batch_generator(repeat=repeat):
+                yield batch
+            return
+        self._start()
+        while True:
+            position, self._resume_position = self._resume_position, None
+            self._epoch_rng_state = self.data.rng.get_state()
+            self._epoch_position = position or {'batches': 0}
+            num_skipped = self._epoch_position['batches']
+            batch_keys = self.data.batch_keys_for_epoch()[num_skipped:]
+            for batch_idx, keys in enumerate(batch_keys):
+                self._key_queues[batch_idx % self.num_workers].put(keys)
+            num_received = 0
+            try:
+                for batch_idx in range(len(batch_keys)):
+                    success, batch = self._get_batch(batch_idx)
+                    num_received += 1
+                    if not success:
+                        raise IOError(
+                            'Worker failed to read batch:\n' + batch)
+                    batch = _from_shared(batch)
+                    self._epoch_position = {
+                        'batches': num_skipped + num_received}
+                    if batch is not None:
+                        yield batch
+            finally:
+                if num_received < len(batch_keys):
+                    # workers are still busy with the rest of the epoch.
+                    # Stop them so the next epoch starts fresh
+                    self._stop(True)
+            self._epoch_position = None
+            if not repeat:
+                break
+
+    def state_dict(self):
+        '''Get the state of iteration, for resuming it later
+
+        Returns
+        -------
+        dict
+            As in ``Data.state_dict()``, except the position counts the
+            batches served. If `num_workers` is ``0``, the state of
+            `data` is returned
+        '''
+        if not self.num_workers:
+            return self.data.state_dict()
+        state = {'position': self._epoch_position}
+        if self._epoch_position is None:
+            state['rng'] = self.data.rng.get_state()
+        else:
+            state['position'] = dict(self._epoch_position)
+            state['rng'] = self._epoch_rng_state
+        return state
+
+    def load_state_dict(self, state):
+        '''Restore the state of iteration returned by ``state_dict()``
+
+        `state` must come from a ``ParallelData`` wrapping the same data
+        with `num_workers` either zero or nonzero, like this one
+
+        Parameters
+        ----------
+        state : dict
+        '''
+        if not self.num_workers:
+            self.data.load_state_dict(state)
+            return
+        if state.get('rng') is not None:
+            self.data.rng.set_state(state['rng'])
+        self._epoch_position = None
+        self._resume_position = state.get('position')
+        if self._resume_position is not None:
+            self._resume_position = dict(self._resume_position)
+
+    def __iter__(self):
+        for batch in self.batch_generator():
+            yield batch
+
+
 try:
     SequentialData.num_samples.__doc__ = Data.num_samples.__doc__
     ShuffledData.num_samples.__doc__ = Data.num_samples.__doc__
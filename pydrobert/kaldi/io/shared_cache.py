@@ -0,0 +1,189 @@
+# Copyright 2018 Sean Robertson
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Caches of decoded table values shared between processes
+
+The ``cache`` option of random access readers keeps values in the memory
+of the reading process. When data are read by a pool of worker processes,
+as when a ``pydrobert.kaldi.io.corpus.ShuffledData`` is split amongst
+data loader workers, each worker would decode and cache its own copy. A
+``SharedValueCache`` instead stores decoded numpy arrays in shared
+memory (``/dev/shm`` when available), where any process on the node can
+attach to it by name. Each value is decoded once and mapped read-only
+into every process that asks for it.
+
+Entries outlive the processes that wrote them, so call
+``SharedValueCache.unlink`` once they are no longer needed.
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import shutil
+import tempfile
+import warnings
+
+import numpy as np
+
+__author__ = "Sean Robertson"
+__email__ = "sdrobert@cs.toronto.edu"
+__license__ = "Apache 2.0"
+__copyright__ = "Copyright 2018 Sean Robertson"
+
+__all__ = [
+    'SharedValueCache',
+]
+
+_SHARED_CACHE_PREFIX = 'pydrobert-kaldi-cache-'
+
+
+def _default_root():
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+class SharedValueCache(object):
+    '''A cache of numpy arrays that processes can attach to by name
+
+    Values are stored in a directory of ``.npy`` files, one per table
+    and key. Entries are written to a temporary file and renamed into
+    place, so concurrent readers never see partial entries and
+    concurrent writers of the same entry are harmless.
+
+    Parameters
+    ----------
+    name : str
+        Identifies the cache. Processes constructing a
+        ``SharedValueCache`` with the same `name` and `root` share
+        entries
+    root : str, optional
+        The directory under which the cache is stored. Defaults to
+        ``/dev/shm`` if it exists, or the temporary directory otherwise
+
+    Attributes
+    ----------
+    name : str
+    path : str
+        The directory storing the entries
+    hits : int
+        The number of entries this process found in the cache
+    misses : int
+        The number of entries this process looked for but did not find
+    '''
+
+    def __init__(self, name, root=None):
+        if root is None:
+            root = _default_root()
+        self.name = name
+        self.path = os.path.join(root, _SHARED_CACHE_PREFIX + name)
+        self.hits = 0
+        self.misses = 0
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            if not os.path.isdir(self.path):
+                raise
+
+    def _entry_path(self, table, key):
+        digest = hashlib.sha1(
+            u'{}\0{}'.format(table, key).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + '.npy')
+
+    def get(self, table, key):
+        '''Retrieve a read-only array from the cache
+
+        Parameters
+        ----------
+        table : str
+            Identifies the table `key` belongs to
+        key : str
+
+        Returns
+        -------
+        np.ndarray
+
+        Raises
+        ------
+        KeyError
+            If the entry is not in the cache
+        '''
+        path = self._entry_path(table, key)
+        try:
+            value = np.load(path, mmap_mode='r', allow_pickle=False)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            raise KeyError(key)
+        self.hits += 1
+        return value.view(np.ndarray)
+
+    def __contains__(self, item):
+        table, key = item
+        return os.path.isfile(self._entry_path(table, key))
+
+    def put(self, table, key, value):
+        '''Store a value in the cache
+
+        Only numeric numpy arrays can be stored. Anything else is
+        ignored, as are failures to write the entry (e.g. when shared
+        memory is full), which are reported as a warning
+
+        Parameters
+        ----------
+        table : str
+        key : str
+        value : object
+
+        Returns
+        -------
+        bool
+            Whether `value` was stored
+        '''
+        if not isinstance(value, np.ndarray) or value.dtype.hasobject:
+            return False
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                np.save(tmp_file, value, allow_pickle=False)
+            os.rename(tmp_path, self._entry_path(table, key))
+        except (IOError, OSError) as error:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            warnings.warn(
+                'Could not store "{}" in shared cache "{}": {}'.format(
+                    key, self.name, error))
+            return False
+        return True
+
+    def clear(self):
+        '''Remove all entries from the cache'''
+        for file_name in os.listdir(self.path):
+            try:
+                os.remove(os.path.join(self.path, file_name))
+            except OSError:
+                pass
+
+    def unlink(self):
+        '''Remove the cache and all its entries from shared memory
+
+        Processes still holding values retrieved from the cache can
+        continue to use them. The cache may be recreated by constructing
+        it again
+        '''
+        shutil.rmtree(self.path, ignore_errors=True)
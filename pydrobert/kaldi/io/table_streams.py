@@ -19,6 +19,16 @@ from __future__ import division
 from __future__ import print_function
 
 import abc
+import mmap
+import os
+import re
+import struct
+import threading
+
+from collections import namedtuple
+from collections import OrderedDict
+from functools import partial
+from io import open as io_open
 
 try:
     from collections.abc import Container
@@ -27,12 +37,20 @@ except ImportError:
     from collections import Container
     from collections import Iterator
 
+import numpy as np
+
 from builtins import str as text
 from future.utils import implements_iterator
 
 from pydrobert.kaldi import _internal as _i
 from pydrobert.kaldi.io import KaldiIOBase
+from pydrobert.kaldi.io.ark_index import find_ark_index
+from pydrobert.kaldi.io.duck_streams import KaldiInput
 from pydrobert.kaldi.io.enums import KaldiDataType
+from pydrobert.kaldi.io.enums import RxfilenameType
+from pydrobert.kaldi.io.enums import TableType
+from pydrobert.kaldi.io.enums import WxfilenameType
+from pydrobert.kaldi.io.shared_cache import SharedValueCache
 
 __author__ = "Sean Robertson"
 __email__ = "sdrobert@cs.toronto.edu"
@@ -40,33 +58,67 @@ __license__ = "Apache 2.0"
 __copyright__ = "Copyright 2017 Sean Robertson"
 
 __all__ = [
+    'KaldiValueMetadata',
     'KaldiTable',
     'KaldiSequentialReader',
     'KaldiRandomAccessReader',
     'KaldiWriter',
+    'ShardedKaldiWriter',
 ]
 
+KaldiValueMetadata = namedtuple(
+    'KaldiValueMetadata', ['shape', 'dtype', 'compressed'])
+KaldiValueMetadata.__doc__ = '''What a matrix or vector would look like
+
+Returned by sequential readers opened with ``metadata_only=True``
+
+Attributes
+----------
+shape : tuple
+    The shape of the value as a numpy array
+dtype : numpy.dtype
+    The precision the value is stored with. Compressed matrices are
+    stored with single precision. Values read in text form or decoded
+    by Kaldi report the precision they are read as
+compressed : bool or None
+    Whether the value is stored as a compressed matrix. ``None`` if the
+    value had to be decoded by Kaldi to determine its shape
+'''
+
 
 def open_table_stream(
         path, kaldi_dtype, mode='r', error_on_str=True,
-        utt2spk='', value_style='b', cache=False):
+        utt2spk='', value_style='b', cache=False, zero_copy=False,
+        memory_map=False, cache_size=None, cache_policy='lru',
+        shared_cache=None, metadata_only=False):
     '''Factory function to open a kaldi table
 
     This function finds the correct ``KaldiTable`` according to the args
     `kaldi_dtype` and `mode`. Specific combinations allow for optional
     parameters outlined by the table below
 
-    +----------+---------------+-----------------------+
-    | mode     | `kaldi_dtype` | additional kwargs     |
-    +==========+===============+=======================+
-    | ``'r'``  | ``'wm'``      | ``value_style='b'``   |
-    +----------+---------------+-----------------------+
-    | ``'r+'`` | *             | ``utt2spk=''``        |
-    +----------+---------------+-----------------------+
-    | ``'r+'`` | ``'wm'``      | ``value_style='b'``   |
-    +----------+---------------+-----------------------+
-    | ``'w'``  | ``'tv'``      | ``error_on_str=True`` |
-    +----------+---------------+-----------------------+
+    +----------+---------------+-------------------------+
+    | mode     | `kaldi_dtype` | additional kwargs       |
+    +==========+===============+=========================+
+    | ``'r'``  | ``'wm'``      | ``value_style='b'``     |
+    +----------+---------------+-------------------------+
+    | ``'r'``  | ``'*m'``,     | ``zero_copy=False``,    |
+    |          | ``'*v'``      | ``metadata_only=False`` |
+    +----------+---------------+-------------------------+
+    | ``'r'``, | ``'bm'``,     | ``memory_map=False``    |
+    | ``'r+'`` | ``'dm'``,     |                         |
+    |          | ``'fm'``      |                         |
+    +----------+---------------+-------------------------+
+    | ``'r+'`` | *             | ``utt2spk=''``,         |
+    |          |               | ``cache=False``,        |
+    |          |               | ``cache_size=None``,    |
+    |          |               | ``cache_policy='lru'``, |
+    |          |               | ``shared_cache=None``   |
+    +----------+---------------+-------------------------+
+    | ``'r+'`` | ``'wm'``      | ``value_style='b'``     |
+    +----------+---------------+-------------------------+
+    | ``'w'``  | ``'tv'``      | ``error_on_str=True``   |
+    +----------+---------------+-------------------------+
 
     Parameters
     ----------
@@ -83,7 +135,11 @@ def open_table_stream(
         Specifies the type of access to be performed: read sequential,
         read random, or write. They are implemented by subclasses of
         ``KaldiSequentialReader``, ``KaldiRandomAccessReader``, or
-        ``KaldiWriter``, resp.
+        ``KaldiWriter``, resp. When reading randomly from an archive on
+        disk that has an up-to-date index for `kaldi_dtype` (see
+        ``pydrobert.kaldi.io.ark_index``), values are read by seeking to
+        their offsets rather than by scanning the archive. The index is
+        not used when `utt2spk` is set
     error_on_str : bool, optional
         Token vectors (``'tv'``) accept sequences of whitespace-free
         ASCII/UTF strings. A `str` is also a sequence of characters,
@@ -104,10 +160,58 @@ def open_table_stream(
         a tuple of that information. If `value_style` is only one
         character, the result will not be contained in a tuple.
     cache : bool, optional
-        Whether to cache all values in a dict as they are retrieved.
-        Only applicable to random access readers. This can be very
-        expensive for large tables and redundant if reading from an
-        archive directly (as opposed to a script).
+        Whether to cache values in a dict as they are retrieved. Only
+        applicable to random access readers. Without a `cache_size`,
+        every value is kept, which can be very expensive for large
+        tables and redundant if reading from an archive directly (as
+        opposed to a script). The reader's ``cache_hits``,
+        ``cache_misses``, ``cache_evictions``, and ``cache_nbytes``
+        attributes report on the cache's effectiveness
+    cache_size : int, optional
+        If set, the approximate number of bytes the cached values may
+        occupy. Implies `cache`. Values are evicted according to
+        `cache_policy` to stay within budget. Array buffers are counted
+        exactly, other values approximately
+    cache_policy : {'lru', 'lfu'}, optional
+        Which values to evict first when `cache_size` is exceeded: the
+        least recently used (``'lru'``) or the least frequently used
+        (``'lfu'``). Setting a policy other than ``'lru'`` without
+        caching is an error
+    shared_cache : str or SharedValueCache, optional
+        If set, numeric arrays read by a random access reader are stored
+        in, and first looked up in, a cache in shared memory (see
+        ``pydrobert.kaldi.io.shared_cache``). A ``str`` names the
+        ``SharedValueCache`` to attach to. Processes reading the same
+        table through the same cache decode each value only once. Values
+        from the shared cache are read-only. May be combined with
+        `cache`, which then caches locally in front of the shared cache
+    zero_copy : bool, optional
+        Only applicable to sequential readers of numeric matrices and
+        vectors (``'bm'``, ``'dm'``, ``'fm'``, ``'bv'``, ``'dv'``,
+        ``'fv'``). If ``True``, the value Kaldi reads is handed over to
+        numpy directly instead of being copied into a new buffer. The
+        returned array owns the Kaldi allocation, so it remains valid
+        after the reader moves on or closes. Matrices need not be
+        C-contiguous, since Kaldi may pad its rows.
+    memory_map : bool, optional
+        Only applicable to readers of floating-point matrices (``'bm'``,
+        ``'dm'``, ``'fm'``) from an archive stored in a file on disk.
+        If ``True``, the archive is memory-mapped and binary,
+        uncompressed matrices of the table's precision are returned as
+        read-only views into the mapping. No copy or deserialization
+        takes place, and processes reading the same archive share pages.
+        Any other entries (compressed, text, or of the other precision)
+        are read through Kaldi as usual. Ignored for other tables, or
+        when `utt2spk` is set
+    metadata_only : bool, optional
+        Only applicable to sequential readers of numeric matrices and
+        vectors (``'bm'``, ``'dm'``, ``'fm'``, ``'bv'``, ``'dv'``,
+        ``'fv'``). If ``True``, the reader yields a
+        ``KaldiValueMetadata`` tuple describing each value (its shape,
+        precision, and whether it is compressed) in place of the value.
+        For archives, and scripts referencing values in files on disk,
+        only the headers of values are read, skipping their data. Other
+        tables (e.g. those read from pipes) must be decoded in full.
 
     Returns
     -------
@@ -118,21 +222,56 @@ def open_table_stream(
     ------
     IOError
         On failure to open
+    ValueError
+        If `cache_policy` is set without caching
     '''
     kaldi_dtype = KaldiDataType(kaldi_dtype)
+    cache = cache or cache_size is not None
+    if cache_policy != 'lru' and not cache:
+        raise ValueError(
+            'cache_policy is only applicable with cache or cache_size')
+    mapped_rxfilename = None
+    if memory_map and mode in ('r', 'r+') and not utt2spk:
+        mapped_rxfilename = _memory_mappable_rxfilename(path, kaldi_dtype)
     if mode == 'r':
-        if kaldi_dtype.value == 'wm':
+        if metadata_only:
+            if not _has_metadata(kaldi_dtype):
+                raise ValueError(
+                    'metadata_only is only available for numeric matrices '
+                    'and vectors, not "{}"'.format(kaldi_dtype.value))
+            table = _KaldiSequentialMetadataReader(path, kaldi_dtype)
+        elif mapped_rxfilename is not None:
+            table = _KaldiSequentialMemoryMappedReader(
+                path, kaldi_dtype, mapped_rxfilename)
+        elif kaldi_dtype.value == 'wm':
             table = _KaldiSequentialWaveReader(
                 path, kaldi_dtype, value_style=value_style)
         else:
-            table = _KaldiSequentialSimpleReader(path, kaldi_dtype)
+            table = _KaldiSequentialSimpleReader(
+                path, kaldi_dtype, zero_copy=zero_copy)
     elif mode == 'r+':
+        wrappers = []
+        wrapper_kwargs = dict()
+        if shared_cache is not None:
+            wrappers.append(_random_access_reader_share)
+            wrapper_kwargs['shared_cache'] = shared_cache
         if cache:
-            wrapper_func = _random_access_reader_memoize
-        else:
-            def wrapper_func(cls):
-                return cls
-        if kaldi_dtype.value == 'wm':
+            wrappers.append(_random_access_reader_memoize)
+            wrapper_kwargs['cache_size'] = cache_size
+            wrapper_kwargs['cache_policy'] = cache_policy
+
+        def wrapper_func(cls):
+            for wrapper in wrappers:
+                cls = wrapper(cls)
+            return partial(cls, **wrapper_kwargs)
+        ark_index = None if utt2spk else find_ark_index(path, kaldi_dtype)
+        if mapped_rxfilename is not None:
+            table = wrapper_func(_KaldiRandomAccessMemoryMappedReader)(
+                path, kaldi_dtype, mapped_rxfilename, ark_index=ark_index)
+        elif ark_index is not None:
+            table = wrapper_func(_KaldiIndexedRandomAccessReader)(
+                path, kaldi_dtype, ark_index, value_style=value_style)
+        elif kaldi_dtype.value == 'wm':
             table = wrapper_func(_KaldiRandomAccessWaveReader)(
                 path, kaldi_dtype, utt2spk=utt2spk,
                 value_style=value_style
@@ -177,6 +316,13 @@ class KaldiTable(KaldiIOBase):
     ------
     IOError
         If unable to open table
+
+    Notes
+    -----
+    Tables release the GIL while Kaldi opens, reads, writes, or closes
+    them, so different tables can be used from different python threads
+    at the same time. A single table is not thread-safe: it should not
+    be shared between threads without a lock.
     """
 
     def __init__(self, path, kaldi_dtype):
@@ -358,6 +504,65 @@ class KaldiRandomAccessReader(KaldiTable, Container):
         except KeyError:
             return default
 
+    def get_many(self, keys, ignore_missing=False, stack=False,
+                 fill_value=0):
+        """Retrieve the values of many keys at once
+
+        Batched retrieval amortizes the per-key overhead of square
+        bracket access. Where the underlying table supports it, values
+        are read in a single pass over the table, visiting keys in sorted
+        order.
+
+        Parameters
+        ----------
+        keys : sequence
+            The keys to look up
+        ignore_missing : bool, optional
+            If ``True``, the value of any key not in the table will be
+            ``None``. If ``False``, a missing key raises a ``KeyError``
+        stack : bool, optional
+            If ``True``, values are right-padded with `fill_value` to the
+            maximum length along each axis and stacked into a single
+            array whose first axis indexes `keys`. Values must all be
+            arrays of the same number of dimensions. Cannot be combined
+            with `ignore_missing`
+        fill_value : scalar, optional
+            The value to pad with when `stack` is ``True``
+
+        Returns
+        -------
+        list or numpy.ndarray
+            A list of values in the same order as `keys`, or a single
+            array if `stack` is ``True``
+
+        Raises
+        ------
+        IOError
+            If closed
+        KeyError
+            If a key is missing and `ignore_missing` is ``False``
+        ValueError
+            If `stack` is ``True`` and the values cannot be stacked
+        """
+        if self.closed:
+            raise IOError('I/O operation on closed file.')
+        if stack and ignore_missing:
+            raise ValueError('Cannot stack when ignoring missing keys')
+        keys = list(keys)
+        values = self._get_many(keys)
+        if not ignore_missing:
+            for key, value in zip(keys, values):
+                if value is None:
+                    raise KeyError(key)
+        if stack:
+            values = _stack_values(values, fill_value)
+        return values
+
+    def _get_many(self, keys):
+        # subclasses may override this with a more efficient batched read.
+        # Missing values should be None
+        return [self[key] if key in self else None for key in keys]
+
     def readable(self):
         return True
 
@@ -369,13 +574,188 @@ class KaldiRandomAccessReader(KaldiTable, Container):
     writable.__doc__ = KaldiTable.writable.__doc__
 
 
+def _stack_values(values, fill_value):
+    if not len(values):
+        raise ValueError('Cannot stack an empty list of values')
+    if any(not isinstance(value, np.ndarray) for value in values):
+        raise ValueError('Only arrays can be stacked')
+    ndim = values[0].ndim
+    dtype = values[0].dtype
+    if any(value.ndim != ndim or value.dtype != dtype for value in values):
+        raise ValueError(
+            'Values must share the same number of dimensions and data type '
+            'to be stacked')
+    max_shape = tuple(np.max([value.shape for value in values], axis=0))
+    batch = np.full((len(values),) + max_shape, fill_value, dtype=dtype)
+    for batch_elem, value in zip(batch, values):
+        batch_elem[tuple(slice(0, dim) for dim in value.shape)] = value
+    return batch
+
+
+def _value_nbytes(value):
+    # approximate. Array buffers dominate the tables we'd want to cache
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    elif isinstance(value, (tuple, list)):
+        return sum(_value_nbytes(elem) for elem in value)
+    elif isinstance(value, (text, bytes)):
+        return len(value)
+    else:
+        return 8
+
+
+class _LRUValueCache(object):
+    '''Caches values, evicting the least recently used past max_bytes'''
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.values = OrderedDict()
+        self._sizes = dict()
+
+    def get(self, key):
+        try:
+            value = self.values[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self._touch(key)
+        return value
+
+    def put(self, key, value):
+        nbytes = _value_nbytes(value)
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return
+        if key in self.values:
+            self._discard(key)
+        # evict before inserting so that the new value can't be the victim
+        while self.max_bytes is not None and \
+                self.nbytes + nbytes > self.max_bytes:
+            self._discard(self._victim())
+            self.evictions += 1
+        self.values[key] = value
+        self._sizes[key] = nbytes
+        self.nbytes += nbytes
+        self._add(key)
+
+    def _add(self, key):
+        pass
+
+    def _touch(self, key):
+        self.values[key] = self.values.pop(key)
+
+    def _victim(self):
+        return next(iter(self.values))
+
+    def _discard(self, key):
+        del self.values[key]
+        self.nbytes -= self._sizes.pop(key, 0)
+
+
+class _LFUValueCache(_LRUValueCache):
+    '''Caches values, evicting the least frequently used past max_bytes
+
+    Ties are broken by evicting the least recently used
+    '''
+
+    def __init__(self, max_bytes=None):
+        super(_LFUValueCache, self).__init__(max_bytes)
+        self._counts = dict()
+        self._count_keys = dict()  # count -> OrderedDict of keys
+
+    def _add(self, key):
+        self._counts[key] = 1
+        self._count_keys.setdefault(1, OrderedDict())[key] = None
+
+    def _touch(self, key):
+        count = self._remove_count(key)
+        self._counts[key] = count + 1
+        self._count_keys.setdefault(count + 1, OrderedDict())[key] = None
+
+    def _victim(self):
+        if not self._counts:
+            return next(iter(self.values))
+        return next(iter(self._count_keys[min(self._count_keys)]))
+
+    def _discard(self, key):
+        super(_LFUValueCache, self)._discard(key)
+        self._remove_count(key)
+
+    def _remove_count(self, key):
+        count = self._counts.pop(key, 0)
+        if count:
+            keys = self._count_keys[count]
+            del keys[key]
+            if not keys:
+                del self._count_keys[count]
+        return count
+
+
+_CACHE_POLICIES = {
+    'lru': _LRUValueCache,
+    'lfu': _LFUValueCache,
+}
+
+
+def _get_many_through_cache(keys, get, put, read_many):
+    # looks up keys with get(key), which raises a KeyError on a miss. The
+    # distinct missed keys are read together with read_many(keys), and
+    # those present are stored with put(key, value)
+    values = [None] * len(keys)
+    uncached = dict()
+    for idx, key in enumerate(keys):
+        try:
+            values[idx] = get(key)
+        except KeyError:
+            uncached.setdefault(key, []).append(idx)
+    if uncached:
+        uncached_keys = list(uncached)
+        for key, value in zip(uncached_keys, read_many(uncached_keys)):
+            if value is not None:
+                put(key, value)
+            for idx in uncached[key]:
+                values[idx] = value
+    return values
+
+
 def _random_access_reader_memoize(cls):
     '''A class decorator for KaldiRandomAccessReader that caches items'''
 
     class _Wrapper(cls):
-        def __init__(self, path, kaldi_dtype, utt2spk=''):
-            self.cache_dict = dict()
-            super(_Wrapper, self).__init__(path, kaldi_dtype, utt2spk=utt2spk)
+        def __init__(self, *args, **kwargs):
+            cache_size = kwargs.pop('cache_size', None)
+            cache_policy = kwargs.pop('cache_policy', 'lru')
+            if cache_policy not in _CACHE_POLICIES:
+                raise ValueError(
+                    'cache_policy must be one of {}'.format(
+                        ', '.join(sorted(_CACHE_POLICIES))))
+            self._cache = _CACHE_POLICIES[cache_policy](cache_size)
+            self.cache_dict = self._cache.values
+            super(_Wrapper, self).__init__(*args, **kwargs)
+
+        @property
+        def cache_hits(self):
+            '''int : The number of values retrieved from the cache'''
+            return self._cache.hits
+
+        @property
+        def cache_misses(self):
+            '''int : The number of values that had to be read'''
+            return self._cache.misses
+
+        @property
+        def cache_evictions(self):
+            '''int : The number of values evicted to respect cache_size'''
+            return self._cache.evictions
+
+        @property
+        def cache_nbytes(self):
+            '''int : The approximate size of the cached values, in bytes'''
+            return self._cache.nbytes
 
         def __contains__(self, key):
             return (
@@ -385,11 +765,74 @@ def _random_access_reader_memoize(cls):
 
         def __getitem__(self, key):
             try:
-                return self.cache_dict[key]
+                return self._cache.get(key)
+            except KeyError:
+                value = super(_Wrapper, self).__getitem__(key)
+                self._cache.put(key, value)
+                return value
+
+        def _get_many(self, keys):
+            return _get_many_through_cache(
+                keys, self._cache.get, self._cache.put,
+                super(_Wrapper, self)._get_many)
+    _Wrapper.__doc__ = cls.__doc__
+    return _Wrapper
+
+
+def _shared_table_id(path, kaldi_dtype, utt2spk):
+    # identifies a table in a shared cache. Tables in files are identified
+    # by their absolute path, size, and modification time so that the same
+    # table opened from another directory shares entries while a rewritten
+    # one does not. Only the script itself is checked, not the files it
+    # refers to
+    from pydrobert.kaldi.io.util import parse_kaldi_input_path
+    table_type, rxfilename, rx_type, _ = parse_kaldi_input_path(path)
+    if rx_type == RxfilenameType.FileInput and os.path.isfile(rxfilename):
+        stat = os.stat(rxfilename)
+        location = u'{} {} {} {!r}'.format(
+            table_type.value, os.path.abspath(rxfilename), stat.st_size,
+            stat.st_mtime)
+    else:
+        location = path
+    if utt2spk and os.path.isfile(utt2spk):
+        utt2spk = os.path.abspath(utt2spk)
+    return u'\0'.join(
+        (location, KaldiDataType(kaldi_dtype).value, utt2spk))
+
+
+def _random_access_reader_share(cls):
+    '''A class decorator for KaldiRandomAccessReader that shares items'''
+
+    class _Wrapper(cls):
+        def __init__(self, path, kaldi_dtype, *args, **kwargs):
+            shared_cache = kwargs.pop('shared_cache')
+            if not isinstance(shared_cache, SharedValueCache):
+                shared_cache = SharedValueCache(shared_cache)
+            self.shared_cache = shared_cache
+            self._shared_table = _shared_table_id(
+                path, kaldi_dtype, kwargs.get('utt2spk', ''))
+            super(_Wrapper, self).__init__(
+                path, kaldi_dtype, *args, **kwargs)
+
+        def __contains__(self, key):
+            return (
+                (self._shared_table, key) in self.shared_cache or
+                super(_Wrapper, self).__contains__(key)
+            )
+
+        def __getitem__(self, key):
+            try:
+                return self.shared_cache.get(self._shared_table, key)
             except KeyError:
                 value = super(_Wrapper, self).__getitem__(key)
-                self.cache_dict[key] = value
+                self.shared_cache.put(self._shared_table, key, value)
                 return value
+
+        def _get_many(self, keys):
+            return _get_many_through_cache(
+                keys, partial(self.shared_cache.get, self._shared_table),
+                partial(self.shared_cache.put, self._shared_table),
+                super(_Wrapper, self)._get_many)
     _Wrapper.__doc__ = cls.__doc__
     return _Wrapper
 
@@ -424,6 +867,47 @@ class KaldiWriter(KaldiTable):
         """
         pass
 
+    def write_many(self, keys, values):
+        """Write key value pairs in order
+
+        Equivalent to calling :func:`write` on each pair, though
+        subclasses may do so more quickly.
+
+        Parameters
+        ----------
+        keys : sequence
+        values : sequence
+            As many values as there are `keys`
+        """
+        if self.closed:
+            raise IOError('I/O operation on a closed file')
+        if len(keys) != len(values):
+            raise ValueError(
+                'Expected {} values, got {}'.format(len(keys), len(values)))
+        for key, value in zip(keys, values):
+            self.write(key, value)
+
+    def write_padded(self, keys, batch, lengths):
+        """Write the rows of a padded batch, excluding padding
+
+        Writes ``batch[i, :lengths[i]]`` to ``keys[i]`` for each ``i``,
+        in order.
+
+        Parameters
+        ----------
+        keys : sequence
+        batch : array-like
+            A padded batch whose first axis is the batch axis and second
+            axis is the padded axis
+        lengths : sequence
+            The unpadded length of each element of `batch`
+        """
+        if self.closed:
+            raise IOError('I/O operation on a closed file')
+        batch, lengths = _check_padded(keys, batch, lengths)
+        for key, value, length in zip(keys, batch, lengths):
+            self.write(key, value[:length])
+
     def readable(self):
         return False
 
@@ -435,6 +919,24 @@ class KaldiWriter(KaldiTable):
     writable.__doc__ = KaldiTable.writable.__doc__
 
 
+def _check_padded(keys, batch, lengths):
+    batch = np.asarray(batch)
+    lengths = np.asarray(lengths)
+    if batch.ndim < 2 or lengths.ndim != 1:
+        raise ValueError(
+            'Expected batch with at least 2 axes and lengths with 1, got '
+            '{} and {}'.format(batch.ndim, lengths.ndim))
+    if not (len(keys) == batch.shape[0] == lengths.shape[0]):
+        raise ValueError(
+            'Expected as many keys ({}) and lengths ({}) as batch elements '
+            '({})'.format(len(keys), lengths.shape[0], batch.shape[0]))
+    if lengths.size and (
+            lengths.min() < 0 or lengths.max() > batch.shape[1]):
+        raise ValueError(
+            'Expected lengths between 0 and {}'.format(batch.shape[1]))
+    return batch, lengths
+
+
 class _KaldiSequentialSimpleReader(KaldiSequentialReader):
     __doc__ = KaldiSequentialReader.__doc__
 
@@ -463,9 +965,14 @@ class _KaldiSequentialSimpleReader(KaldiSequentialReader):
         'B': _i.SequentialBoolReader,
     }
 
-    def __init__(self, path, kaldi_dtype):
+    def __init__(self, path, kaldi_dtype, zero_copy=False):
         super(_KaldiSequentialSimpleReader, self).__init__(path, kaldi_dtype)
         kaldi_dtype = KaldiDataType(kaldi_dtype)
+        # the value is swapped out of kaldi's holder, so we hold onto it
+        # until the next move in case value() is called again
+        self._zero_copy = zero_copy and (
+            kaldi_dtype.is_matrix or kaldi_dtype.is_num_vector)
+        self._taken_value = None
         instance = self._dtype_to_cls[kaldi_dtype.value]()
         if self.background:
             opened = instance.OpenThreaded(path)
@@ -496,6 +1003,10 @@ class _KaldiSequentialSimpleReader(KaldiSequentialReader):
             raise IOError('I/O operation on closed file.')
         elif self.done():
             return None
+        elif self._zero_copy:
+            if self._taken_value is None:
+                self._taken_value = self._internal.TakeValue()
+            return self._taken_value
         else:
             return self._internal.Value()
 
@@ -506,21 +1017,15 @@ class _KaldiSequentialSimpleReader(KaldiSequentialReader):
             raise IOError('I/O operation on closed file.')
         elif self.done():
             return False
-        elif self.background:
-            self._internal.NextThreaded()
-            return True
-        else:
-            self._internal.Next()
-            return True
+        self._taken_value = None
+        self._internal.Next()
+        return True
 
     move.__doc__ = KaldiSequentialReader.move.__doc__
 
     def close(self):
         if not self.closed:
-            if self.background:
-                self._internal.CloseThreaded()
-            else:
-                self._internal.Close()
+            self._internal.Close()
         self.closed = True
 
     close.__doc__ = KaldiSequentialReader.close.__doc__
@@ -562,6 +1067,7 @@ class _KaldiRandomAccessSimpleReader(KaldiRandomAccessReader):
         if not instance.Open(path, utt2spk):
             raise IOError('Unable to open for random access read')
         self._internal = instance
+        self._batched = kaldi_dtype.is_matrix or kaldi_dtype.is_num_vector
         self.binary &= self._internal.IsBinary()
 
     def __contains__(self, key):
@@ -576,6 +1082,11 @@ class _KaldiRandomAccessSimpleReader(KaldiRandomAccessReader):
             raise KeyError(key)
         return self._internal.Value(key)
 
+    def _get_many(self, keys):
+        if self._batched:
+            return self._internal.ValueMany(keys)
+        return super(_KaldiRandomAccessSimpleReader, self)._get_many(keys)
+
     def close(self):
         if not self.closed:
             self._internal.Close()
@@ -627,6 +1138,38 @@ class _KaldiSimpleWriter(KaldiWriter):
 
     write.__doc__ = KaldiWriter.write.__doc__
 
+    def write_many(self, keys, values):
+        if self.closed:
+            raise IOError('I/O operation on a closed file')
+        if len(keys) != len(values):
+            raise ValueError(
+                'Expected {} values, got {}'.format(len(keys), len(values)))
+        write = self._internal.Write
+        for key, value in zip(keys, values):
+            write(key, value)
+
+    write_many.__doc__ = KaldiWriter.write_many.__doc__
+
+    def write_padded(self, keys, batch, lengths):
+        kaldi_dtype = self.kaldi_dtype
+        if kaldi_dtype.value == 'wm' or not (
+                kaldi_dtype.is_matrix or kaldi_dtype.is_num_vector):
+            return super(_KaldiSimpleWriter, self).write_padded(
+                keys, batch, lengths)
+        if self.closed:
+            raise IOError('I/O operation on a closed file')
+        batch, lengths = _check_padded(keys, batch, lengths)
+        if batch.ndim != (3 if kaldi_dtype.is_matrix else 2):
+            raise ValueError(
+                'Expected a batch of {} axes for "{}", got {}'.format(
+                    3 if kaldi_dtype.is_matrix else 2, kaldi_dtype.value,
+                    batch.ndim))
+        # rows are serialized straight from the batch's buffer
+        self._internal.WritePadded(
+            list(keys), batch, lengths.astype(np.int32))
+
+    write_padded.__doc__ = KaldiWriter.write_padded.__doc__
+
     def close(self):
         if not self.closed:
             self._internal.Close()
@@ -698,9 +1241,6 @@ class _KaldiSequentialWaveReader(KaldiSequentialReader):
             raise IOError('I/O operation on closed file.')
         elif self.done():
             return False
-        elif self.background:
-            self._internal.NextThreaded()
-            return True
         else:
             self._internal.Next()
             return True
@@ -709,10 +1249,7 @@ class _KaldiSequentialWaveReader(KaldiSequentialReader):
 
     def close(self):
         if not self.closed:
-            if self.background:
-                self._internal.CloseThreaded()
-            else:
-                self._internal.Close()
+            self._internal.Close()
         self.closed = True
 
     close.__doc__ = KaldiSequentialReader.close.__doc__
@@ -768,6 +1305,437 @@ class _KaldiRandomAccessWaveReader(KaldiRandomAccessReader):
     close.__doc__ = KaldiRandomAccessReader.close.__doc__
 
 
+class _KaldiOffsetRandomAccessReader(KaldiRandomAccessReader):
+    # a random access reader over archives whose entries' byte offsets are
+    # known, letting get_many read them front-to-back
+
+    @abc.abstractmethod
+    def _offset(self, key):
+        pass
+
+    def _get_many(self, keys):
+        values = [None] * len(keys)
+        present = [idx for idx, key in enumerate(keys) if key in self]
+        present.sort(key=lambda idx: self._offset(keys[idx]))
+        for idx in present:
+            values[idx] = self[keys[idx]]
+        return values
+
+
+class _KaldiIndexedRandomAccessReader(_KaldiOffsetRandomAccessReader):
+    __doc__ = KaldiRandomAccessReader.__doc__
+
+    def __init__(self, path, kaldi_dtype, ark_index, value_style='b'):
+        super(_KaldiIndexedRandomAccessReader, self).__init__(
+            path, kaldi_dtype)
+        kaldi_dtype = KaldiDataType(kaldi_dtype)
+        if kaldi_dtype.value == 'wm':
+            if any(char not in 'bsd' for char in value_style):
+                raise ValueError(
+                    'value_style must be a combination of "b", "s", and "d"')
+            self.binary = True
+        else:
+            self.binary &= _KaldiSequentialSimpleReader._dtype_to_cls[
+                kaldi_dtype.value].IsBinary()
+        self._kaldi_dtype = kaldi_dtype
+        self._value_style = value_style
+        self._ark_index = ark_index
+
+    def __contains__(self, key):
+        if self.closed:
+            raise IOError('I/O operation on closed file.')
+        return key in self._ark_index
+
+    def __getitem__(self, key):
+        if self.closed:
+            raise IOError('I/O operation on a closed file')
+        entry = self._ark_index[key]
+        # kaldi seeks to the offset on open, just as it would for an entry
+        # of a script file. Basic holders check for the binary header
+        # themselves
+        with KaldiInput(
+                '{}:{}'.format(entry.file, entry.offset),
+                header=not self._kaldi_dtype.is_basic) as inp:
+            return inp.read(self._kaldi_dtype, value_style=self._value_style)
+
+    def _offset(self, key):
+        return self._ark_index[key].offset
+
+    def close(self):
+        self.closed = True
+
+    close.__doc__ = KaldiRandomAccessReader.close.__doc__
+
+
+def _memory_mappable_rxfilename(path, kaldi_dtype):
+    from pydrobert.kaldi.io.util import parse_kaldi_input_path
+    if not (kaldi_dtype.is_matrix and kaldi_dtype.is_floating_point) or \
+            kaldi_dtype.value == 'wm':
+        return None
+    table_type, rxfilename, rx_type, _ = parse_kaldi_input_path(path)
+    if table_type != TableType.ArchiveTable or \
+            rx_type != RxfilenameType.FileInput:
+        return None
+    return rxfilename
+
+
+# leading whitespace, the key, then the character separating it from the
+# value. Kaldi consumes a space or tab, but not a newline
+_ARK_KEY_PATTERN = re.compile(br'\s*(\S+)(?:[ \t]|(?=\n))')
+_ARK_TRAILING_PATTERN = re.compile(br'\s*$')
+
+
+class _MemoryMappedArchive(object):
+    '''Locates the matrices or vectors of an archive in a memory map
+
+    Also serves files containing a single value, as referenced by script
+    files, with the value starting at offset 0
+    '''
+
+    def __init__(self, rxfilename, kaldi_dtype):
+        self.rxfilename = rxfilename
+        self.kaldi_dtype = kaldi_dtype
+        if kaldi_dtype.is_double:
+            self._token, self._np_dtype = b'D', np.dtype('<f8')
+        else:
+            self._token, self._np_dtype = b'F', np.dtype('<f4')
+        self._token += b'M' if kaldi_dtype.is_matrix else b'V'
+        with open(rxfilename, 'rb') as file_obj:
+            try:
+                self._buf = mmap.mmap(
+                    file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self._buf = b''  # empty files cannot be mapped
+
+    def _read_int32(self, pos):
+        # kaldi prefixes binary integers with their size
+        if self._buf[pos:pos + 1] != b'\x04':
+            raise IOError(
+                'Malformed value at byte {} of {}'.format(
+                    pos, self.rxfilename))
+        return struct.unpack_from('<i', self._buf, pos + 1)[0]
+
+    def _text_shape(self, start, end):
+        rows = [
+            row.split()
+            for row in self._buf[start:end].splitlines()
+        ]
+        rows = [row for row in rows if row]
+        if self.kaldi_dtype.is_matrix:
+            return len(rows), len(rows[0]) if rows else 0
+        return sum(len(row) for row in rows),
+
+    def _parse(self, start):
+        # returns the end of the value starting at start, as well as its
+        # token (None if text), shape, and the offset of its data (None
+        # if compressed or text)
+        buf = self._buf
+        if buf[start:start + 2] != b'\0B':
+            # a text matrix or vector, which has no brackets within
+            open_bracket = buf.find(b'[', start)
+            end = buf.find(b']', start)
+            if open_bracket < 0 or end < open_bracket:
+                raise IOError(
+                    'Malformed text value at byte {} of {}'.format(
+                        start, self.rxfilename))
+            return end + 1, (
+                None, self._text_shape(open_bracket + 1, end), None)
+        token_end = buf.find(b' ', start + 2)
+        token = buf[start + 2:token_end]
+        if token in (b'FM', b'DM'):
+            rows = self._read_int32(token_end + 1)
+            cols = self._read_int32(token_end + 6)
+            data_start = token_end + 11
+            itemsize = 8 if token == b'DM' else 4
+            end = data_start + rows * cols * itemsize
+            return end, (token, (rows, cols), data_start)
+        elif token in (b'FV', b'DV'):
+            dim = self._read_int32(token_end + 1)
+            data_start = token_end + 6
+            itemsize = 8 if token == b'DV' else 4
+            end = data_start + dim * itemsize
+            return end, (token, (dim,), data_start)
+        elif token in (b'CM', b'CM2', b'CM3'):
+            # min value and range (floats), then rows and cols (int32s)
+            rows, cols = struct.unpack_from('<ii', buf, token_end + 9)
+            end = token_end + 17
+            if cols:
+                if token == b'CM':
+                    end += 8 * cols + rows * cols
+                elif token == b'CM2':
+                    end += 2 * rows * cols
+                else:
+                    end += rows * cols
+            return end, (token, (rows, cols), None)
+        raise IOError(
+            'Unexpected token {!r} at byte {} of {}'.format(
+                token, start, self.rxfilename))
+
+    def next_entry(self, pos):
+        '''The (key, start, end) of the first entry at or after pos'''
+        match = _ARK_KEY_PATTERN.match(self._buf, pos)
+        if match is None:
+            if _ARK_TRAILING_PATTERN.match(self._buf, pos) is None:
+                raise IOError(
+                    'Invalid archive format at byte {} of {}'.format(
+                        pos, self.rxfilename))
+            return None
+        start = match.end()
+        end, _ = self._parse(start)
+        if end > len(self._buf):
+            raise IOError(
+                'Archive {} ended unexpectedly'.format(self.rxfilename))
+        return match.group(1).decode('utf-8'), start, end
+
+    def value(self, start):
+        '''The value starting at start'''
+        _, (token, shape, data_start) = self._parse(start)
+        if token != self._token:
+            with KaldiInput('{}:{}'.format(self.rxfilename, start)) as inp:
+                return inp.read(self.kaldi_dtype)
+        return np.frombuffer(
+            self._buf, dtype=self._np_dtype, count=int(np.prod(shape)),
+            offset=data_start,
+        ).reshape(shape)
+
+    def metadata(self, start):
+        '''The KaldiValueMetadata of the value starting at start'''
+        end, (token, shape, _) = self._parse(start)
+        if end > len(self._buf):
+            raise IOError(
+                'Value at byte {} of {} ended unexpectedly'.format(
+                    start, self.rxfilename))
+        if token is None:
+            dtype = np.dtype(self._np_dtype.type)
+        elif token.startswith(b'D'):
+            dtype = np.dtype(np.float64)
+        else:
+            # compressed matrices decompress to single precision
+            dtype = np.dtype(np.float32)
+        compressed = token is not None and token.startswith(b'CM')
+        return KaldiValueMetadata(shape, dtype, compressed)
+
+    def close(self):
+        try:
+            self._buf.close()
+        except AttributeError:
+            pass
+        except BufferError:
+            pass  # views are still alive. They keep the mapping open
+
+
+class _KaldiSequentialMemoryMappedReader(KaldiSequentialReader):
+    __doc__ = KaldiSequentialReader.__doc__
+
+    def __init__(self, path, kaldi_dtype, rxfilename):
+        super(_KaldiSequentialMemoryMappedReader, self).__init__(
+            path, kaldi_dtype)
+        self._archive = _MemoryMappedArchive(
+            rxfilename, KaldiDataType(kaldi_dtype))
+        self._entry = self._archive.next_entry(0)
+
+    def done(self):
+        return self.closed or self._entry is None
+
+    done.__doc__ = KaldiSequentialReader.done.__doc__
+
+    def key(self):
+        if self.closed:
+            raise IOError('I/O operation on closed file.')
+        elif self.done():
+            return None
+        else:
+            return self._entry[0]
+
+    key.__doc__ = KaldiSequentialReader.key.__doc__
+
+    def value(self):
+        if self.closed:
+            raise IOError('I/O operation on closed file.')
+        elif self.done():
+            return None
+        else:
+            return self._archive.value(self._entry[1])
+
+    value.__doc__ = KaldiSequentialReader.value.__doc__
+
+    def move(self):
+        if self.closed:
+            raise IOError('I/O operation on closed file.')
+        elif self.done():
+            return False
+        else:
+            self._entry = self._archive.next_entry(self._entry[2])
+            return True
+
+    move.__doc__ = KaldiSequentialReader.move.__doc__
+
+    def close(self):
+        if not self.closed:
+            self._archive.close()
+        self.closed = True
+
+    close.__doc__ = KaldiSequentialReader.close.__doc__
+
+
+class _KaldiRandomAccessMemoryMappedReader(_KaldiOffsetRandomAccessReader):
+    __doc__ = KaldiRandomAccessReader.__doc__
+
+    def __init__(self, path, kaldi_dtype, rxfilename, ark_index=None):
+        super(_KaldiRandomAccessMemoryMappedReader, self).__init__(
+            path, kaldi_dtype)
+        self._archive = _MemoryMappedArchive(
+            rxfilename, KaldiDataType(kaldi_dtype))
+        if ark_index is None:
+            # only the headers are parsed, so this is much cheaper than
+            # reading the archive
+            self._starts = dict()
+            entry = self._archive.next_entry(0)
+            while entry is not None:
+                self._starts.setdefault(entry[0], entry[1])
+                entry = self._archive.next_entry(entry[2])
+        else:
+            self._starts = dict(
+                (key, entry.offset) for key, entry in ark_index.items())
+
+    def __contains__(self, key):
+        if self.closed:
+            raise IOError('I/O operation on closed file.')
+        return key in self._starts
+
+    def __getitem__(self, key):
+        if self.closed:
+            raise IOError('I/O operation on a closed file')
+        return self._archive.value(self._starts[key])
+
+    def _offset(self, key):
+        return self._starts[key]
+
+    def close(self):
+        if not self.closed:
+            self._archive.close()
+        self.closed = True
+
+    close.__doc__ = KaldiRandomAccessReader.close.__doc__
+
+
+def _has_metadata(kaldi_dtype):
+    return kaldi_dtype.is_num_vector or (
+        kaldi_dtype.is_matrix and kaldi_dtype.value != 'wm')
+
+
+# the rxfilename of a value in a script file, at an optional byte offset
+_SCRIPT_OFFSET_PATTERN = re.compile(r'^(.*):(\d+)$')
+
+
+def _script_entry_location(rxfilename):
+    match = _SCRIPT_OFFSET_PATTERN.match(rxfilename)
+    if match is not None and os.path.isfile(match.group(1)):
+        return match.group(1), int(match.group(2))
+    elif os.path.isfile(rxfilename):
+        return rxfilename, 0
+    return None
+
+
+def _metadata_entries(path, kaldi_dtype):
+    '''Generate (key, KaldiValueMetadata) pairs of a table'''
+    from pydrobert.kaldi.io.util import parse_kaldi_input_path
+    table_type, rxfilename, rx_type, _ = parse_kaldi_input_path(path)
+    if rx_type == RxfilenameType.FileInput and \
+            table_type == TableType.ArchiveTable:
+        archive = _MemoryMappedArchive(rxfilename, kaldi_dtype)
+        try:
+            entry = archive.next_entry(0)
+            while entry is not None:
+                yield entry[0], archive.metadata(entry[1])
+                entry = archive.next_entry(entry[2])
+        finally:
+            archive.close()
+        return
+    if rx_type == RxfilenameType.FileInput and \
+            table_type == TableType.ScriptTable:
+        with io_open(rxfilename, encoding='utf-8') as script_file:
+            entries = [line.split(None, 1) for line in script_file]
+        entries = [
+            (entry[0], _script_entry_location(entry[1].strip()))
+            for entry in entries if entry
+        ]
+        # pipes, ranges, and the like are handled by kaldi below
+        if all(location is not None for _, location in entries):
+            archive = None
+            try:
+                for key, (file_name, offset) in entries:
+                    if archive is None or archive.rxfilename != file_name:
+                        if archive is not None:
+                            archive.close()
+                        archive = _MemoryMappedArchive(
+                            file_name, kaldi_dtype)
+                    yield key, archive.metadata(offset)
+            finally:
+                if archive is not None:
+                    archive.close()
+            return
+    reader = _KaldiSequentialSimpleReader(path, kaldi_dtype)
+    try:
+        for key, value in reader.items():
+            yield key, KaldiValueMetadata(value.shape, value.dtype, None)
+    finally:
+        reader.close()
+
+
+class _KaldiSequentialMetadataReader(KaldiSequentialReader):
+    __doc__ = KaldiSequentialReader.__doc__
+
+    def __init__(self, path, kaldi_dtype):
+        super(_KaldiSequentialMetadataReader, self).__init__(
+            path, kaldi_dtype)
+        self._entries = _metadata_entries(path, KaldiDataType(kaldi_dtype))
+        self._entry = next(self._entries, None)
+
+    def done(self):
+        return self.closed or self._entry is None
+
+    done.__doc__ = KaldiSequentialReader.done.__doc__
+
+    def key(self):
+        if self.closed:
+            raise IOError('I/O operation on closed file.')
+        elif self.done():
+            return None
+        else:
+            return self._entry[0]
+
+    key.__doc__ = KaldiSequentialReader.key.__doc__
+
+    def value(self):
+        if self.closed:
+            raise IOError('I/O operation on closed file.')
+        elif self.done():
+            return None
+        else:
+            return self._entry[1]
+
+    value.__doc__ = KaldiSequentialReader.value.__doc__
+
+    def move(self):
+        if self.closed:
+            raise IOError('I/O operation on closed file.')
+        elif self.done():
+            return False
+        else:
+            self._entry = next(self._entries, None)
+            return True
+
+    move.__doc__ = KaldiSequentialReader.move.__doc__
+
+    def close(self):
+        if not self.closed:
+            self._entries.close()
+        self.closed = True
+
+    close.__doc__ = KaldiSequentialReader.close.__doc__
+
+
 class _KaldiTokenWriter(KaldiWriter):
     __doc__ = KaldiWriter.__doc__
 
@@ -836,3 +1804,163 @@ class _KaldiTokenVectorWriter(KaldiWriter):
         self.closed = True
 
     close.__doc__ = KaldiWriter.close.__doc__
+
+
+class _WriterShard(object):
+    '''The archive a thread of a ShardedKaldiWriter is writing to'''
+
+    __slots__ = ('table', 'script_path', 'num_entries', 'num_bytes')
+
+    def __init__(self, table, script_path):
+        self.table = table
+        self.script_path = script_path
+        self.num_entries = 0
+        self.num_bytes = 0
+
+
+class ShardedKaldiWriter(KaldiWriter):
+    """Write a table to a series of archives indexed by a single script
+
+    Entries are written to an archive (a shard) until it holds
+    `max_entries` entries or about `max_bytes` bytes, whereupon the
+    next entry starts a new shard. Each shard's script entries are
+    appended to the script when the shard is finished, so the script
+    indexes every shard once the writer is closed.
+
+    `path` is a wspecifier of the form ``'ark,scp:<archive>,<script>'``
+    (options like ``'t'`` may be added before the colon) with both files
+    on disk. Shard ``i`` is written to ``<archive>.format(i)`` if
+    ``<archive>`` contains a ``'{}'`` field, or otherwise to
+    ``<archive>`` with ``'.i'`` inserted before its extension (e.g.
+    ``feats.3.ark``).
+
+    Unlike other tables, a ``ShardedKaldiWriter`` may be shared between
+    python threads. Each thread writes to its own shard, so Kaldi
+    serializes entries in parallel. Separate processes may also write to
+    the same script by setting `rank` and `world_size`, giving each
+    process a disjoint set of shards to write.
+
+    Parameters
+    ----------
+    path : str
+        A wspecifier of an archive and a script
+    kaldi_dtype : pydrobert.kaldi.io.enums.KaldiDataType
+        The data type to write
+    max_entries : int, optional
+        The maximum number of entries per shard
+    max_bytes : int, optional
+        The (approximate) maximum size of a shard. Measured by the size
+        of the values as numpy arrays
+    rank : int, optional
+        Which process this is, between ``0`` and ``world_size - 1``. This
+        process writes the shards ``rank``, ``rank + world_size``,
+        ``rank + 2 * world_size``, and so on
+    world_size : int, optional
+        The number of processes writing to the same script. When greater
+        than one, the script is appended to rather than truncated, so it
+        should be removed before the processes start writing
+    open_kwargs : Keyword arguments, optional
+        Additional keyword arguments used to open each shard (e.g.
+        `error_on_str`)
+
+    Attributes
+    ----------
+    max_entries : int or None
+    max_bytes : int or None
+    rank : int
+    world_size : int
+    shard_paths : list
+        The archives written to so far, in the order they were started
+    """
+
+    def __init__(
+            self, path, kaldi_dtype, max_entries=None, max_bytes=None,
+            rank=0, world_size=1, **open_kwargs):
+        super(ShardedKaldiWriter, self).__init__(path, kaldi_dtype)
+        if self._table_type != TableType.BothTables or any(
+                xtype != WxfilenameType.FileOutput for xtype in self._xtypes):
+            raise ValueError(
+                'Expected a wspecifier of the form "ark,scp:<archive>,'
+                '<script>" writing to files on disk, got "{}"'.format(path))
+        if world_size < 1 or not (0 <= rank < world_size):
+            raise ValueError(
+                'Expected 0 <= rank < world_size, got rank={} and '
+                'world_size={}'.format(rank, world_size))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.rank = rank
+        self.world_size = world_size
+        self.shard_paths = []
+        self._options = path.split(':', 1)[0]
+        self._archive_path, self._script_path = self._xfilenames
+        self._open_kwargs = open_kwargs
+        self._lock = threading.Lock()
+        # each thread's current shard. Not keyed by thread id, since ids
+        # are reused once threads exit
+        self._local = threading.local()
+        self._shards = []
+        self._num_started = 0
+        if world_size == 1:
+            io_open(self._script_path, 'wb').close()
+
+    def _shard_path(self, shard_idx):
+        if '{' in self._archive_path:
+            return self._archive_path.format(shard_idx)
+        root, ext = os.path.splitext(self._archive_path)
+        return '{}.{}{}'.format(root, shard_idx, ext)
+
+    def _thread_shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is not None:
+            return shard
+        with self._lock:
+            shard_idx = self._num_started * self.world_size + self.rank
+            self._num_started += 1
+            archive_path = self._shard_path(shard_idx)
+            self.shard_paths.append(archive_path)
+        script_path = '{}.{}.tmp'.format(self._script_path, shard_idx)
+        table = open_table_stream(
+            '{}:{},{}'.format(self._options, archive_path, script_path),
+            self.kaldi_dtype, mode='w', **self._open_kwargs)
+        shard = _WriterShard(table, script_path)
+        with self._lock:
+            self._shards.append(shard)
+        self._local.shard = shard
+        return shard
+
+    def _finish_shard(self, shard):
+        shard.table.close()
+        with io_open(shard.script_path, 'rb') as script_file:
+            entries = script_file.read()
+        with self._lock:
+            self._shards.remove(shard)
+            # a single write, so that appends from other processes don't
+            # interleave with it
+            with io_open(self._script_path, 'ab') as script_file:
+                script_file.write(entries)
+        os.remove(shard.script_path)
+
+    def write(self, key, value):
+        if self.closed:
+            raise IOError('I/O operation on a closed file')
+        shard = self._thread_shard()
+        shard.table.write(key, value)
+        shard.num_entries += 1
+        if self.max_bytes is not None:
+            shard.num_bytes += _value_nbytes(value)
+        if (self.max_entries is not None and
+                shard.num_entries >= self.max_entries) or \
+                (self.max_bytes is not None and
+                    shard.num_bytes >= self.max_bytes):
+            self._local.shard = None
+            self._finish_shard(shard)
+
+    write.__doc__ = KaldiWriter.write.__doc__
+
+    def close(self):
+        if not self.closed:
+            for shard in list(self._shards):
+                self._finish_shard(shard)
+        self.closed = True
+
+    close.__doc__ = KaldiWriter.close.__doc__
@@ -0,0 +1,470 @@
+# Copyright 2018 Sean Robertson
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''PyTorch datasets, samplers, and collate functions over Kaldi tables
+
+This module requires the optional ``pytorch`` dependency. Its datasets
+read straight from Kaldi tables, so the samples of a
+``torch.utils.data.DataLoader`` need not be converted to individual
+``.pt`` files first:
+
+>>> dataset = KaldiDataset('scp:feats.scp', ('scp:ali.scp', 'iv'))
+>>> loader = torch.utils.data.DataLoader(
+...     dataset, num_workers=4,
+...     batch_sampler=BucketBatchSampler(dataset.lengths(), batch_size=32),
+...     collate_fn=KaldiCollator())
+>>> for feats, ali in loader:
+>>>     pass  # do something
+
+Table arguments are specified as in ``pydrobert.kaldi.io.corpus.Data``,
+as are `add_key` and `axis_lengths`. Numeric values are served as
+tensors sharing memory with the arrays Kaldi read into. Other values
+(e.g. tokens) are served as-is.
+
+Readers cannot be shared between processes. Each dataset opens its own
+readers in whatever (worker) process it is first read from.
+'''
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import torch
+
+from torch.utils.data import Dataset
+from torch.utils.data import IterableDataset
+from torch.utils.data import Sampler
+from torch.utils.data import get_worker_info
+
+from pydrobert.kaldi.io import open as io_open
+from pydrobert.kaldi.io.corpus import _axis_length_pairs
+from pydrobert.kaldi.io.corpus import _bucket_batch_sizes
+from pydrobert.kaldi.io.corpus import _bucketed_batches
+from pydrobert.kaldi.io.corpus import _handle_sub_batch
+from pydrobert.kaldi.io.corpus import _key_shapes
+from pydrobert.kaldi.io.corpus import _length_buckets
+from pydrobert.kaldi.io.corpus import _num_bucketed_batches
+from pydrobert.kaldi.io.corpus import _table_specifiers
+
+__author__ = "Sean Robertson"
+__email__ = "sdrobert@cs.toronto.edu"
+__license__ = "Apache 2.0"
+__copyright__ = "Copyright 2018 Sean Robertson"
+
+__all__ = [
+    'BucketBatchSampler',
+    'KaldiCollator',
+    'KaldiDataset',
+    'KaldiIterableDataset',
+]
+
+
+def _to_tensor(value):
+    if not isinstance(value, np.ndarray) or value.dtype.hasobject or \
+            value.dtype.kind in 'SU':
+        return value
+    if not value.flags.writeable:
+        # e.g. views of memory-mapped archives. Torch wants to own them
+        value = value.copy()
+    return torch.from_numpy(value)
+
+
+class _KaldiDatasetMixin(object):
+
+    def _init_tables(self, tables, kwargs):
+        self.table_specifiers = _table_specifiers(tables)
+        self.add_key = bool(kwargs.pop('add_key', False))
+        self.axis_lengths = _axis_length_pairs(
+            kwargs.pop('axis_lengths', None))
+        if kwargs:
+            raise TypeError('Invalid argument {}'.format(kwargs.popitem()[0]))
+
+    def _sample(self, key, values):
+        sample = [_to_tensor(value) for value in values]
+        for sub_batch_idx, axis_idx in self.axis_lengths:
+            sample.append(np.shape(values[sub_batch_idx])[axis_idx])
+        if self.add_key:
+            sample.insert(0, key)
+        if len(sample) == 1:
+            return sample[0]
+        return tuple(sample)
+
+
+class KaldiDataset(_KaldiDatasetMixin, Dataset):
+    '''A map-style dataset over Kaldi tables
+
+    Index ``i`` refers to the ``i``-th key of `key_list`. Tables are read
+    with random access readers. Scripts are much more efficient than
+    archives here.
+
+    Parameters
+    ----------
+    table
+        The first table specifier
+    additional_tables : Arguments, optional
+        Table specifiers past the first. If not empty, samples are tuples
+    add_key : bool, optional
+        If ``True``, the key of a sample is inserted at the start of the
+        sample tuple
+    axis_lengths : int or sequence, optional
+        If set, the lengths of these axes of samples are appended to the
+        sample tuple
+    key_list : sequence, optional
+        The keys of the dataset, in order. If unset, they are the keys
+        of the first table, which is read once (for metadata alone, if
+        possible) to find them
+
+    Attributes
+    ----------
+    table_specifiers : tuple
+    add_key : bool
+    axis_lengths : tuple
+    key_list : tuple
+    '''
+
+    def __init__(self, table, *additional_tables, **kwargs):
+        key_list = kwargs.pop('key_list', None)
+        self._init_tables((table,) + additional_tables, kwargs)
+        if key_list is None:
+            key_list = (
+                key for key, _ in _key_shapes(self.table_specifiers[0]))
+        self.key_list = tuple(key_list)
+        self._table_handles = None
+        self._pid = None
+
+    @property
+    def table_handles(self):
+        '''tuple : Random access readers of the tables
+
+        Opened on first use in each process
+        '''
+        # forked worker processes inherit the handles of the parent. They
+        # are not safe to share, so each process opens its own
+        if self._table_handles is None or self._pid != os.getpid():
+            self._table_handles = tuple(
+                io_open(rspecifier, kaldi_dtype, mode='r+', **open_kwargs)
+                for rspecifier, kaldi_dtype, open_kwargs
+                in self.table_specifiers
+            )
+            self._pid = os.getpid()
+        return self._table_handles
+
+    def __getstate__(self):
+        # readers cannot be pickled. They are reopened on first use
+        state = self.__dict__.copy()
+        state['_table_handles'] = None
+        state['_pid'] = None
+        return state
+
+    def __len__(self):
+        return len(self.key_list)
+
+    def __getitem__(self, idx):
+        key = self.key_list[idx]
+        values = []
+        for spec, handle in zip(self.table_specifiers, self.table_handles):
+            try:
+                values.append(handle[key])
+            except KeyError:
+                raise IOError('Table {} missing key {}'.format(spec[0], key))
+        return self._sample(key, values)
+
+    def __getitems__(self, indices):
+        # data loaders fetch whole batches through here when they can,
+        # which lets the readers retrieve their values together
+        keys = [self.key_list[idx] for idx in indices]
+        key_values = []
+        for spec, handle in zip(self.table_specifiers, self.table_handles):
+            values = handle.get_many(keys, ignore_missing=True)
+            for key, value in zip(keys, values):
+                if value is None:
+                    raise IOError(
+                        'Table {} missing key {}'.format(spec[0], key))
+            key_values.append(values)
+        return [
+            self._sample(key, values)
+            for key, values in zip(keys, zip(*key_values))
+        ]
+
+    def lengths(self, table_idx=0, axis=0):
+        '''The length of an axis of each sample, in index order
+
+        Values are only read for metadata when possible
+
+        Parameters
+        ----------
+        table_idx : int, optional
+            Which table's values to measure
+        axis : int, optional
+
+        Returns
+        -------
+        list
+        '''
+        shapes = dict(_key_shapes(self.table_specifiers[table_idx]))
+        try:
+            return [shapes[key][axis] for key in self.key_list]
+        except KeyError as error:
+            raise IOError(
+                'Table {} missing key {}'.format(
+                    self.table_specifiers[table_idx][0], error.args[0]))
+
+
+class KaldiIterableDataset(_KaldiDatasetMixin, IterableDataset):
+    '''An iterable dataset over Kaldi tables
+
+    Tables are read sequentially, in lock-step, so they must hold the same
+    keys and be sorted alike. Tables need not support random access, so
+    data may be read from pipes or huge archives at sequential read
+    speeds.
+
+    Every iterator opens new readers. When iterated over by the workers
+    of a ``DataLoader``, each worker serves every ``num_workers``-th
+    sample, skipping past the values of the others without reading them
+    whenever the table allows it (e.g. scripts).
+
+    Parameters
+    ----------
+    table
+        The first table specifier
+    additional_tables : Arguments, optional
+        Table specifiers past the first. If not empty, samples are tuples
+    add_key : bool, optional
+        If ``True``, the key of a sample is inserted at the start of the
+        sample tuple
+    axis_lengths : int or sequence, optional
+        If set, the lengths of these axes of samples are appended to the
+        sample tuple
+
+    Attributes
+    ----------
+    table_specifiers : tuple
+    add_key : bool
+    axis_lengths : tuple
+    '''
+
+    def __init__(self, table, *additional_tables, **kwargs):
+        self._init_tables((table,) + additional_tables, kwargs)
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        if worker_info is None:
+            worker_id, num_workers = 0, 1
+        else:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+        readers = [
+            io_open(rspecifier, kaldi_dtype, **open_kwargs)
+            for rspecifier, kaldi_dtype, open_kwargs in self.table_specifiers
+        ]
+        try:
+            samp_idx = 0
+            while not readers[0].done():
+                key = readers[0].key()
+                for spec, reader in zip(
+                        self.table_specifiers[1:], readers[1:]):
+                    if reader.done() or reader.key() != key:
+                        raise IOError(
+                            'Table {} missing key {} (or tables are sorted '
+                            'differently)'.format(spec[0], key))
+                if samp_idx % num_workers == worker_id:
+                    yield self._sample(
+                        key, [reader.value() for reader in readers])
+                for reader in readers:
+                    reader.move()
+                samp_idx += 1
+            for spec, reader in zip(self.table_specifiers[1:], readers[1:]):
+                if not reader.done():
+                    raise IOError(
+                        'Table {} missing key {}'.format(
+                            self.table_specifiers[0][0], reader.key()))
+        finally:
+            for reader in readers:
+                reader.close()
+
+
+class _TensorBuffers(object):
+    '''Allocates batches as tensors, for _handle_sub_batch to fill'''
+
+    def __init__(self, pin_memory):
+        self.pin_memory = pin_memory
+        self.tensor = self.array = None
+
+    def empty(self, shape, dtype):
+        torch_dtype = torch.from_numpy(np.empty(0, dtype=dtype)).dtype
+        if get_worker_info() is not None:
+            # batches are passed from workers through shared memory.
+            # Allocating them there saves torch a copy
+            tensor = torch.empty(shape, dtype=torch_dtype).share_memory_()
+        else:
+            tensor = torch.empty(
+                shape, dtype=torch_dtype, pin_memory=self.pin_memory)
+        self.tensor, self.array = tensor, tensor.numpy()
+        return self.array
+
+
+class KaldiCollator(object):
+    '''Collates the samples of Kaldi datasets into batches of tensors
+
+    Samples are padded and stacked along a new first axis. Batches are
+    written directly into tensors: in shared memory when collating in a
+    ``DataLoader`` worker, so they cross back to the main process without
+    being copied, and in pinned memory in the main process when
+    `pin_memory` is set, so they can be moved to the GPU asynchronously.
+
+    Numeric sub-samples that are not arrays (e.g. axis lengths) are
+    collated into 1D tensors. Keys and other non-numeric sub-samples are
+    collated into lists.
+
+    Parameters
+    ----------
+    pad_mode : str, optional
+        The ``numpy.pad`` strategy used to pad samples of different
+        lengths. Defaults to ``'constant'``
+    pin_memory : bool, optional
+        Whether to allocate batches collated in the main process in pinned
+        memory. Defaults to whether CUDA is available
+    pad_kwargs : Keyword arguments, optional
+        Additional keyword arguments to pass to ``numpy.pad``, e.g.
+        ``constant_values``
+
+    Attributes
+    ----------
+    pad_mode : str
+    pin_memory : bool
+    pad_kwargs : dict
+    '''
+
+    def __init__(self, pad_mode='constant', pin_memory=None, **pad_kwargs):
+        if pin_memory is None:
+            pin_memory = torch.cuda.is_available()
+        self.pad_mode = pad_mode
+        self.pin_memory = pin_memory
+        self.pad_kwargs = pad_kwargs
+
+    def _collate_sub_batch(self, sub_batch):
+        if all(
+                isinstance(sample, (int, float, np.number))
+                and not isinstance(sample, bool)
+                for sample in sub_batch):
+            return torch.from_numpy(np.array(sub_batch))
+        sub_batch = [
+            sample.numpy() if isinstance(sample, torch.Tensor) else sample
+            for sample in sub_batch
+        ]
+        buffers = _TensorBuffers(self.pin_memory)
+        batch = _handle_sub_batch(
+            sub_batch, 0, self.pad_mode, self.pad_kwargs, buffers)
+        if buffers.array is not None and batch is buffers.array:
+            return buffers.tensor
+        elif isinstance(batch, np.ndarray):
+            return _to_tensor(batch)
+        return list(batch)
+
+    def __call__(self, samples):
+        if isinstance(samples[0], tuple):
+            return tuple(
+                self._collate_sub_batch(list(sub_batch))
+                for sub_batch in zip(*samples)
+            )
+        return self._collate_sub_batch(list(samples))
+
+
+class BucketBatchSampler(Sampler):
+    '''Samples batches of indices of similar length
+
+    As in ``pydrobert.kaldi.io.corpus.BucketedData``, indices are sorted
+    by length and split into buckets. Every epoch, the indices within each
+    bucket are shuffled and grouped into batches drawn from a single
+    bucket, then the order of the batches is shuffled. Meant to be passed
+    as the `batch_sampler` of a ``DataLoader``.
+
+    The size of a bucket's batches is limited by `batch_size`, by
+    `max_frames`, or both. `max_frames` bounds the number of frames in a
+    batch after padding.
+
+    Parameters
+    ----------
+    lengths : sequence
+        The length of each index of the dataset, e.g. from
+        ``KaldiDataset.lengths()``
+    batch_size : int, optional
+        The maximum number of samples per batch
+    max_frames : int, optional
+        The maximum number of (padded) frames in a batch. At least one of
+        `batch_size` and `max_frames` must be set
+    num_buckets : int, optional
+        The number of buckets to split indices into. Buckets are chosen to
+        contain (nearly) the same number of indices. Defaults to ``10``
+    bucket_boundaries : sequence, optional
+        If set, overrides `num_buckets`. An increasing sequence of lengths
+        such that an index of length ``l`` is put in bucket ``i`` when
+        ``bucket_boundaries[i - 1] <= l < bucket_boundaries[i]``
+    rng : int or numpy.random.RandomState, optional
+        Either a ``RandomState`` object or a seed to create a
+        ``RandomState`` object. It will be used to shuffle indices and
+        batches
+    rank : int, optional
+        If `world_size` is greater than one, which shard of the batches
+        to sample, between ``0`` and ``world_size - 1``
+    world_size : int, optional
+        The number of shards to split the indices of every bucket into,
+        e.g. one per process in distributed training. Each shard has the
+        same number of batches
+
+    Attributes
+    ----------
+    buckets : tuple
+        A tuple of tuples of indices, one per nonempty bucket, in order of
+        increasing length
+    bucket_batch_sizes : tuple
+        The number of samples in full batches of the respective bucket
+    rng : numpy.random.RandomState
+    rank : int
+    world_size : int
+    '''
+
+    def __init__(
+            self, lengths, batch_size=None, max_frames=None, num_buckets=10,
+            bucket_boundaries=None, rng=None, rank=0, world_size=1):
+        if not batch_size and not max_frames:
+            raise ValueError(
+                'At least one of batch_size or max_frames must be set')
+        if world_size < 1 or not (0 <= rank < world_size):
+            raise ValueError(
+                'Expected 0 <= rank < world_size, got rank={} and '
+                'world_size={}'.format(rank, world_size))
+        lengths = tuple(lengths)
+        self.buckets = _length_buckets(
+            range(len(lengths)), lengths, num_buckets, bucket_boundaries)
+        self.bucket_batch_sizes = _bucket_batch_sizes(
+            self.buckets, lengths, batch_size, max_frames)
+        if isinstance(rng, np.random.RandomState):
+            self.rng = rng
+        else:
+            self.rng = np.random.RandomState(rng)
+        self.rank = rank
+        self.world_size = world_size
+
+    def __len__(self):
+        return _num_bucketed_batches(
+            self.buckets, self.bucket_batch_sizes, self.world_size)
+
+    def __iter__(self):
+        for batch in _bucketed_batches(
+                self.buckets, self.bucket_batch_sizes, self.rng, self.rank,
+                self.world_size):
+            yield [int(idx) for idx in batch]
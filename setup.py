@@ -539,7 +539,8 @@ setup(
             'write-table-to-torch-dir = pydrobert.kaldi.command_line:'
             'write_table_to_torch_dir [pytorch]',
             'write-torch-dir-to-table = pydrobert.kaldi.command_line:'
-            'write_torch_dir_to_table [pytorch]'
+            'write_torch_dir_to_table [pytorch]',
+            'build-ark-index = pydrobert.kaldi.command_line:build_ark_index',
         ]
     },
     extras_require={
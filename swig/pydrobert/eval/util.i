@@ -0,0 +1,247 @@
+/* -*- C++ -*-
+
+ Copyright 2017 Sean Robertson
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+*/
+
+// native kernels for pydrobert.kaldi.eval.util
+
+%{
+#include <algorithm>
+#include <stdexcept>
+#include <thread>
+#include <vector>
+
+namespace kaldi {
+  // what happened to each ref token during alignment
+  enum RefEditOp { kRefCorrect = 0, kRefDeleted = 1, kRefSubstituted = 2 };
+
+  // Levenshtein distance between sequences of token ids. If ref_ops and
+  // hyp_ops are not NULL, the alignment is backtracked into them: ref_ops
+  // gets a RefEditOp per ref token and hyp_ops a 1 per inserted hyp token
+  // (0 otherwise). Ties are broken in favour of insertions, then deletions,
+  // then substitutions, exactly as the python implementation does
+  long long EditDistanceIds(const int32 *ref, int32 ref_len,
+                            const int32 *hyp, int32 hyp_len,
+                            long long ins_cost, long long del_cost,
+                            long long sub_cost,
+                            signed char *ref_ops, signed char *hyp_ops) {
+    const std::size_t num_cols = static_cast<std::size_t>(hyp_len) + 1;
+    if (!ref_ops) {
+      // only the previous row of the table is needed
+      std::vector<long long> prev(num_cols), cur(num_cols);
+      for (std::size_t h = 0; h < num_cols; ++h) prev[h] = ins_cost * h;
+      for (int32 r = 1; r <= ref_len; ++r) {
+        cur[0] = del_cost * r;
+        const int32 ref_token = ref[r - 1];
+        for (int32 h = 1; h <= hyp_len; ++h) {
+          cur[h] = std::min(std::min(prev[h] + del_cost, cur[h - 1] + ins_cost),
+                            prev[h - 1] +
+                              (hyp[h - 1] == ref_token ? 0 : sub_cost));
+        }
+        prev.swap(cur);
+      }
+      return prev[hyp_len];
+    }
+    std::vector<long long> table(
+      (static_cast<std::size_t>(ref_len) + 1) * num_cols);
+    long long *row = table.data();
+    for (std::size_t h = 0; h < num_cols; ++h) row[h] = ins_cost * h;
+    for (int32 r = 1; r <= ref_len; ++r) {
+      long long *last_row = row;
+      row += num_cols;
+      row[0] = del_cost * r;
+      const int32 ref_token = ref[r - 1];
+      for (int32 h = 1; h <= hyp_len; ++h) {
+        row[h] = std::min(std::min(last_row[h] + del_cost,
+                                   row[h - 1] + ins_cost),
+                          last_row[h - 1] +
+                            (hyp[h - 1] == ref_token ? 0 : sub_cost));
+      }
+    }
+#define KALDI_EDIT_DISTANCE(r, h) table[(r) * num_cols + (h)]
+    std::size_t r = ref_len, h = hyp_len;
+    while (r || h) {
+      if (!r) {
+        hyp_ops[--h] = 1;
+      } else if (!h) {
+        ref_ops[--r] = kRefDeleted;
+      } else if (ref[r - 1] == hyp[h - 1]) {
+        ref_ops[--r] = kRefCorrect;
+        hyp_ops[--h] = 0;
+      } else if (KALDI_EDIT_DISTANCE(r, h - 1) <=
+                   KALDI_EDIT_DISTANCE(r - 1, h) &&
+                 KALDI_EDIT_DISTANCE(r, h - 1) <=
+                   KALDI_EDIT_DISTANCE(r - 1, h - 1)) {
+        hyp_ops[--h] = 1;
+      } else if (KALDI_EDIT_DISTANCE(r - 1, h) <=
+                   KALDI_EDIT_DISTANCE(r - 1, h - 1)) {
+        ref_ops[--r] = kRefDeleted;
+      } else {
+        ref_ops[--r] = kRefSubstituted;
+        hyp_ops[--h] = 0;
+      }
+    }
+#undef KALDI_EDIT_DISTANCE
+    return table.back();
+  }
+
+  // returns the edit distance or, if return_ops, a tuple of the edit
+  // distance, the ref ops, and the hyp ops (see EditDistanceIds)
+  PyObject* EditDistance(const MatrixIndexT *ref_in,
+                         const MatrixIndexT ref_len,
+                         const MatrixIndexT *hyp_in,
+                         const MatrixIndexT hyp_len,
+                         long long ins_cost, long long del_cost,
+                         long long sub_cost, bool return_ops) {
+    long long dist;
+    if (!return_ops) {
+      {
+        PythonThreadsAllowed allow;
+        dist = EditDistanceIds(ref_in, ref_len, hyp_in, hyp_len, ins_cost,
+                               del_cost, sub_cost, NULL, NULL);
+      }
+      return PyLong_FromLongLong(dist);
+    }
+    npy_intp ref_dims[1] = {ref_len}, hyp_dims[1] = {hyp_len};
+    PyObject *ref_ops = PyArray_ZEROS(1, ref_dims, NPY_INT8, 0);
+    PyObject *hyp_ops = PyArray_ZEROS(1, hyp_dims, NPY_INT8, 0);
+    if (!ref_ops || !hyp_ops) {
+      Py_XDECREF(ref_ops);
+      Py_XDECREF(hyp_ops);
+      return NULL;
+    }
+    {
+      PythonThreadsAllowed allow;
+      dist = EditDistanceIds(
+        ref_in, ref_len, hyp_in, hyp_len, ins_cost, del_cost, sub_cost,
+        static_cast<signed char*>(PyArray_DATA((PyArrayObject*) ref_ops)),
+        static_cast<signed char*>(PyArray_DATA((PyArrayObject*) hyp_ops)));
+    }
+    return Py_BuildValue("(LNN)", dist, ref_ops, hyp_ops);
+  }
+
+  void CheckOffsets(const MatrixIndexT *offsets, MatrixIndexT num_offsets,
+                    MatrixIndexT num_ids) {
+    if (!num_offsets || offsets[0] || offsets[num_offsets - 1] != num_ids) {
+      throw std::invalid_argument("Offsets do not span ids");
+    }
+    for (MatrixIndexT idx = 1; idx < num_offsets; ++idx) {
+      if (offsets[idx] < offsets[idx - 1]) {
+        throw std::invalid_argument("Offsets must be non-decreasing");
+      }
+    }
+  }
+
+  // Edit distances between many pairs of id sequences. The sequences are
+  // flattened into ref_in and hyp_in, with pair i's ref spanning
+  // ref_in[ref_offsets_in[i]:ref_offsets_in[i + 1]] (hyps likewise). Returns
+  // an array of distances or, if return_ops, a tuple of the distances and
+  // the flattened ref and hyp ops (see EditDistanceIds). Pairs are
+  // divided between num_threads threads, all without the GIL
+  PyObject* EditDistanceBatch(const MatrixIndexT *ref_in,
+                              const MatrixIndexT ref_len,
+                              const MatrixIndexT *ref_offsets_in,
+                              const MatrixIndexT num_ref_offsets,
+                              const MatrixIndexT *hyp_in,
+                              const MatrixIndexT hyp_len,
+                              const MatrixIndexT *hyp_offsets_in,
+                              const MatrixIndexT num_hyp_offsets,
+                              long long ins_cost, long long del_cost,
+                              long long sub_cost, bool return_ops,
+                              int num_threads) {
+    CheckOffsets(ref_offsets_in, num_ref_offsets, ref_len);
+    CheckOffsets(hyp_offsets_in, num_hyp_offsets, hyp_len);
+    if (num_ref_offsets != num_hyp_offsets) {
+      throw std::invalid_argument("Expected as many refs as hyps");
+    }
+    const MatrixIndexT num_pairs = num_ref_offsets - 1;
+    npy_intp dist_dims[1] = {num_pairs};
+    npy_intp ref_dims[1] = {return_ops ? ref_len : 0};
+    npy_intp hyp_dims[1] = {return_ops ? hyp_len : 0};
+    PyObject *dists = PyArray_ZEROS(1, dist_dims, NPY_INT64, 0);
+    PyObject *ref_ops = PyArray_ZEROS(1, ref_dims, NPY_INT8, 0);
+    PyObject *hyp_ops = PyArray_ZEROS(1, hyp_dims, NPY_INT8, 0);
+    if (!dists || !ref_ops || !hyp_ops) {
+      Py_XDECREF(dists);
+      Py_XDECREF(ref_ops);
+      Py_XDECREF(hyp_ops);
+      return NULL;
+    }
+    npy_int64 *dists_data = static_cast<npy_int64*>(
+      PyArray_DATA((PyArrayObject*) dists));
+    signed char *ref_ops_data = static_cast<signed char*>(
+      PyArray_DATA((PyArrayObject*) ref_ops));
+    signed char *hyp_ops_data = static_cast<signed char*>(
+      PyArray_DATA((PyArrayObject*) hyp_ops));
+    num_threads = std::max(1, std::min(num_threads, num_pairs));
+    {
+      PythonThreadsAllowed allow;
+      auto worker = [&](int thread_idx) {
+        for (MatrixIndexT pair = thread_idx; pair < num_pairs;
+             pair += num_threads) {
+          const MatrixIndexT ref_start = ref_offsets_in[pair];
+          const MatrixIndexT hyp_start = hyp_offsets_in[pair];
+          dists_data[pair] = EditDistanceIds(
+            ref_in + ref_start, ref_offsets_in[pair + 1] - ref_start,
+            hyp_in + hyp_start, hyp_offsets_in[pair + 1] - hyp_start,
+            ins_cost, del_cost, sub_cost,
+            return_ops ? ref_ops_data + ref_start : NULL,
+            return_ops ? hyp_ops_data + hyp_start : NULL);
+        }
+      };
+      std::vector<std::thread> threads;
+      for (int thread_idx = 1; thread_idx < num_threads; ++thread_idx) {
+        threads.push_back(std::thread(worker, thread_idx));
+      }
+      worker(0);
+      for (std::size_t idx = 0; idx < threads.size(); ++idx) {
+        threads[idx].join();
+      }
+    }
+    if (!return_ops) {
+      Py_DECREF(ref_ops);
+      Py_DECREF(hyp_ops);
+      return dists;
+    }
+    return Py_BuildValue("(NNN)", dists, ref_ops, hyp_ops);
+  }
+}
+%}
+
+%apply(kaldi::MatrixIndexT* IN_ARRAY1, kaldi::MatrixIndexT DIM1) {(const kaldi::MatrixIndexT *ref_in, const kaldi::MatrixIndexT ref_len)}
+%apply(kaldi::MatrixIndexT* IN_ARRAY1, kaldi::MatrixIndexT DIM1) {(const kaldi::MatrixIndexT *hyp_in, const kaldi::MatrixIndexT hyp_len)}
+%apply(kaldi::MatrixIndexT* IN_ARRAY1, kaldi::MatrixIndexT DIM1) {(const kaldi::MatrixIndexT *ref_offsets_in, const kaldi::MatrixIndexT num_ref_offsets)}
+%apply(kaldi::MatrixIndexT* IN_ARRAY1, kaldi::MatrixIndexT DIM1) {(const kaldi::MatrixIndexT *hyp_offsets_in, const kaldi::MatrixIndexT num_hyp_offsets)}
+
+namespace kaldi {
+  PyObject* EditDistance(const kaldi::MatrixIndexT *ref_in,
+                         const kaldi::MatrixIndexT ref_len,
+                         const kaldi::MatrixIndexT *hyp_in,
+                         const kaldi::MatrixIndexT hyp_len,
+                         long long ins_cost, long long del_cost,
+                         long long sub_cost, bool return_ops);
+  PyObject* EditDistanceBatch(const kaldi::MatrixIndexT *ref_in,
+                              const kaldi::MatrixIndexT ref_len,
+                              const kaldi::MatrixIndexT *ref_offsets_in,
+                              const kaldi::MatrixIndexT num_ref_offsets,
+                              const kaldi::MatrixIndexT *hyp_in,
+                              const kaldi::MatrixIndexT hyp_len,
+                              const kaldi::MatrixIndexT *hyp_offsets_in,
+                              const kaldi::MatrixIndexT num_hyp_offsets,
+                              long long ins_cost, long long del_cost,
+                              long long sub_cost, bool return_ops,
+                              int num_threads);
+}
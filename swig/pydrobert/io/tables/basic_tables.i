@@ -32,16 +32,19 @@ TEMPLATE_WITH_NAME_AND_HOLDER_TYPE(Name, HolderName);
 
 %extend kaldi::SequentialTableReader<HolderName > {
   const ValType & Value() {
+    kaldi::PythonThreadsAllowed allow;
     return $self->Value();
   };
 }
 %extend kaldi::RandomAccessTableReaderMapped<HolderName > {
   const ValType & Value(const std::string& key) {
+    kaldi::PythonThreadsAllowed allow;
     return $self->Value(key);
   };
 }
 %extend kaldi::TableWriter<HolderName > {
   void Write(const std::string& key, const ValType & val) {
+    kaldi::PythonThreadsAllowed allow;
     $self->Write(key, val);
   };
 }
@@ -19,6 +19,173 @@
 %{
   #include "matrix/kaldi-matrix.h"
   #include "matrix/kaldi-vector.h"
+  #include <algorithm>
+  #include <stdexcept>
+
+namespace kaldi {
+  template <class KaldiObject>
+  void DeleteKaldiObjectCapsule(PyObject *capsule) {
+    delete static_cast<KaldiObject*>(PyCapsule_GetPointer(capsule, NULL));
+  }
+
+  // wraps a numpy array around the data of a heap-allocated kaldi object. The
+  // array takes ownership of the object via a capsule, which deletes the
+  // object when the array is garbage collected.
+  template <class KaldiObject>
+  PyObject* WrapKaldiObjectAsArray(KaldiObject *obj, void *data, int nd,
+                                   npy_intp *dims, npy_intp *strides,
+                                   int typenum) {
+    npy_intp size = 1;
+    for (int i = 0; i < nd; ++i) size *= dims[i];
+    if (!size || !data) {
+      // kaldi leaves the data of empty objects null
+      delete obj;
+      return PyArray_ZEROS(nd, dims, typenum, 0);
+    }
+    PyObject *array = PyArray_New(&PyArray_Type, nd, dims, typenum, strides,
+                                  data, 0,
+                                  NPY_ARRAY_ALIGNED | NPY_ARRAY_WRITEABLE,
+                                  NULL);
+    if (!array) {
+      delete obj;
+      return NULL;
+    }
+    PyObject *capsule = PyCapsule_New(
+      static_cast<void*>(obj), NULL, DeleteKaldiObjectCapsule<KaldiObject>);
+    if (!capsule) {
+      delete obj;
+      Py_DECREF(array);
+      return NULL;
+    }
+    if (PyArray_SetBaseObject((PyArrayObject*) array, capsule)) {
+      Py_DECREF(array);  // steals the capsule, which frees obj
+      return NULL;
+    }
+    return array;
+  }
+
+  template <typename Real>
+  PyObject* WrapKaldiObjectAsArray(Vector<Real> *vec, int typenum) {
+    npy_intp dims[1] = {vec->Dim()};
+    return WrapKaldiObjectAsArray(vec, vec->Data(), 1, dims, NULL, typenum);
+  }
+
+  // rows are contiguous, but kaldi may pad them, so the array need not be
+  // C-contiguous
+  template <typename Real>
+  PyObject* WrapKaldiObjectAsArray(Matrix<Real> *matr, int typenum) {
+    npy_intp dims[2] = {matr->NumRows(), matr->NumCols()};
+    npy_intp strides[2] = {
+      static_cast<npy_intp>(matr->Stride() * sizeof(Real)),
+      static_cast<npy_intp>(sizeof(Real))
+    };
+    return WrapKaldiObjectAsArray(matr, matr->Data(), 2, dims, strides,
+                                  typenum);
+  }
+
+  // a matrix viewing a row-major buffer it does not own, such as that of a
+  // numpy array. Table writers only serialize their values, so they can be
+  // handed these instead of copying the buffer into a new Matrix
+  template <typename Real>
+  class BorrowedMatrix : public Matrix<Real> {
+   public:
+    BorrowedMatrix(const Real *data, MatrixIndexT num_rows,
+                   MatrixIndexT num_cols) {
+      // numpy can pass matrices with only one zero-dimension axis, but
+      // kaldi can't handle that
+      const bool empty = !(num_rows && num_cols);
+      this->data_ = empty ? NULL : const_cast<Real*>(data);
+      this->num_rows_ = empty ? 0 : num_rows;
+      this->num_cols_ = this->stride_ = empty ? 0 : num_cols;
+    }
+    // keeps Matrix from freeing the buffer
+    ~BorrowedMatrix() { this->data_ = NULL; }
+  };
+
+  template <typename Real>
+  class BorrowedVector : public Vector<Real> {
+   public:
+    BorrowedVector(const Real *data, MatrixIndexT dim) {
+      this->data_ = dim ? const_cast<Real*>(data) : NULL;
+      this->dim_ = dim;
+    }
+    ~BorrowedVector() { this->data_ = NULL; }
+  };
+
+  inline void CheckPaddedLengths(std::size_t num_keys,
+                                 MatrixIndexT batch_size,
+                                 MatrixIndexT max_len,
+                                 const MatrixIndexT *lens_in,
+                                 MatrixIndexT num_lens) {
+    if (num_keys != static_cast<std::size_t>(batch_size) ||
+        num_lens != batch_size) {
+      throw std::invalid_argument(
+        "Expected as many keys and lengths as batch elements");
+    }
+    for (MatrixIndexT idx = 0; idx < num_lens; ++idx) {
+      if (lens_in[idx] < 0 || lens_in[idx] > max_len) {
+        throw std::out_of_range("Length out of range of batch");
+      }
+    }
+  }
+
+  struct KeyIndexLess {
+    explicit KeyIndexLess(const std::vector<std::string> &keys) :
+      keys_(keys) {}
+    bool operator()(std::size_t a, std::size_t b) const {
+      return keys_[a] < keys_[b];
+    }
+    const std::vector<std::string> &keys_;
+  };
+
+  // reads the values of keys into a list of numpy arrays, with None for any
+  // missing keys. The keys are visited in sorted order so that sorted
+  // archives and scripts are read front-to-back, with the GIL released for
+  // the whole pass
+  template <class KaldiObject>
+  PyObject* ValueManyAsArrays(
+      RandomAccessTableReaderMapped<KaldiObjectHolder<KaldiObject> > *reader,
+      const std::vector<std::string> &keys, int typenum) {
+    const std::size_t num_keys = keys.size();
+    std::vector<KaldiObject*> objs(num_keys, NULL);
+    try {
+      PythonThreadsAllowed allow;
+      std::vector<std::size_t> order(num_keys);
+      for (std::size_t idx = 0; idx < num_keys; ++idx) order[idx] = idx;
+      std::sort(order.begin(), order.end(), KeyIndexLess(keys));
+      for (std::size_t idx = 0; idx < num_keys; ++idx) {
+        const std::string &key = keys[order[idx]];
+        if (reader->HasKey(key)) {
+          objs[order[idx]] = new KaldiObject(reader->Value(key));
+        }
+      }
+    } catch (...) {
+      for (std::size_t idx = 0; idx < num_keys; ++idx) delete objs[idx];
+      throw;
+    }
+    PyObject *list = PyList_New(num_keys);
+    for (std::size_t idx = 0; idx < num_keys; ++idx) {
+      PyObject *item;
+      if (!list) {
+        item = NULL;
+        delete objs[idx];
+      } else if (objs[idx]) {
+        item = WrapKaldiObjectAsArray(objs[idx], typenum);
+      } else {
+        Py_INCREF(Py_None);
+        item = Py_None;
+      }
+      objs[idx] = NULL;
+      if (item) {
+        PyList_SET_ITEM(list, idx, item);
+      } else if (list) {
+        Py_DECREF(list);
+        list = NULL;
+      }
+    }
+    return list;
+  }
+}
 %}
 
 namespace kaldi {
@@ -26,12 +193,15 @@ namespace kaldi {
   template <typename Real> class Matrix {};
 }
 
-%define EXTEND_MV_WITH_REAL(Real, RealName)
+%define EXTEND_MV_WITH_REAL(Real, RealName, NpyType)
 
 // stores matrix/vector read-only in first argument, dim in second. C-contiguous
 // Kaldi always keeps rows contiguous, but not necessarily columns
 %apply(Real* IN_ARRAY1, kaldi::MatrixIndexT DIM1) {(const Real *vec_in, const kaldi::MatrixIndexT len)}
 %apply(Real* IN_ARRAY2, kaldi::MatrixIndexT DIM1, kaldi::MatrixIndexT DIM2) {(const Real* matrix_in, const kaldi::MatrixIndexT dim_row, const kaldi::MatrixIndexT dim_col)}
+// padded batches of vectors/matrices, C-contiguous
+%apply(Real* IN_ARRAY2, kaldi::MatrixIndexT DIM1, kaldi::MatrixIndexT DIM2) {(const Real *vec_batch_in, const kaldi::MatrixIndexT batch_size, const kaldi::MatrixIndexT max_len)}
+%apply(Real* IN_ARRAY3, kaldi::MatrixIndexT DIM1, kaldi::MatrixIndexT DIM2, kaldi::MatrixIndexT DIM3) {(const Real *matrix_batch_in, const kaldi::MatrixIndexT batch_size, const kaldi::MatrixIndexT max_len, const kaldi::MatrixIndexT dim_col)}
 // will allocate into first, storing dimensions into later
 %apply(Real** ARGOUTVIEWM_ARRAY1, kaldi::MatrixIndexT* DIM1) {(Real** vec_out, kaldi::MatrixIndexT* len)}
 %apply(Real** ARGOUTVIEWM_ARRAY2, kaldi::MatrixIndexT* DIM1, kaldi::MatrixIndexT* DIM2) {(Real** matrix_out, kaldi::MatrixIndexT* dim_row, kaldi::MatrixIndexT* dim_col)}
@@ -39,9 +209,26 @@ namespace kaldi {
 %extend kaldi::TableWriter<kaldi::KaldiObjectHolder<kaldi::Vector<Real > > > {
   void Write(const std::string &key,
              const Real *vec_in, const kaldi::MatrixIndexT len) const {
-    kaldi::Vector<Real> vector(len, kaldi::kUndefined);
-    if (len) std::memcpy(vector.Data(), vec_in, len * sizeof(Real));
-    $self->Write(key, vector);
+    kaldi::PythonThreadsAllowed allow;
+    $self->Write(key, kaldi::BorrowedVector<Real >(vec_in, len));
+  };
+
+  // writes vec_batch_in[i, :lens_in[i]] to keys[i] for each i
+  void WritePadded(const std::vector<std::string> &keys,
+                   const Real *vec_batch_in,
+                   const kaldi::MatrixIndexT batch_size,
+                   const kaldi::MatrixIndexT max_len,
+                   const kaldi::MatrixIndexT *lens_in,
+                   const kaldi::MatrixIndexT num_lens) const {
+    kaldi::CheckPaddedLengths(keys.size(), batch_size, max_len, lens_in,
+                              num_lens);
+    kaldi::PythonThreadsAllowed allow;
+    for (kaldi::MatrixIndexT idx = 0; idx < batch_size; ++idx) {
+      $self->Write(
+        keys[idx],
+        kaldi::BorrowedVector<Real >(vec_batch_in + idx * max_len,
+                                     lens_in[idx]));
+    }
   };
 }
 %extend kaldi::TableWriter<kaldi::KaldiObjectHolder<kaldi::Matrix<Real> > > {
@@ -49,35 +236,59 @@ namespace kaldi {
                  const Real *matrix_in,
                  const kaldi::MatrixIndexT dim_row,
                  const kaldi::MatrixIndexT dim_col) const {
-    kaldi::MatrixIndexT effective_dim_row = dim_row;
-    kaldi::MatrixIndexT effective_dim_col = dim_col;
-    if (!(dim_row && dim_col)) {
-      // numpy can pass matrices with only one zero-dimension axis, but
-      // kaldi can't handle that
-      effective_dim_col = 0;
-      effective_dim_row = 0;
-    }
-    kaldi::Matrix<Real> matrix(effective_dim_row, effective_dim_col,
-                               kaldi::kUndefined, kaldi::kStrideEqualNumCols);
-    if (effective_dim_row) {
-      std::memcpy(matrix.Data(), matrix_in, dim_row * dim_col * sizeof(Real));
+    kaldi::PythonThreadsAllowed allow;
+    $self->Write(key, kaldi::BorrowedMatrix<Real >(matrix_in, dim_row,
+                                                   dim_col));
+  };
+
+  // writes matrix_batch_in[i, :lens_in[i]] to keys[i] for each i
+  void WritePadded(const std::vector<std::string> &keys,
+                   const Real *matrix_batch_in,
+                   const kaldi::MatrixIndexT batch_size,
+                   const kaldi::MatrixIndexT max_len,
+                   const kaldi::MatrixIndexT dim_col,
+                   const kaldi::MatrixIndexT *lens_in,
+                   const kaldi::MatrixIndexT num_lens) const {
+    kaldi::CheckPaddedLengths(keys.size(), batch_size, max_len, lens_in,
+                              num_lens);
+    kaldi::PythonThreadsAllowed allow;
+    for (kaldi::MatrixIndexT idx = 0; idx < batch_size; ++idx) {
+      $self->Write(
+        keys[idx],
+        kaldi::BorrowedMatrix<Real >(
+          matrix_batch_in + static_cast<std::size_t>(idx) * max_len * dim_col,
+          lens_in[idx], dim_col));
     }
-    $self->Write(key, matrix);
   };
 }
 %extend kaldi::SequentialTableReader<kaldi::KaldiObjectHolder<kaldi::Vector<Real > > > {
   void Value(Real **vec_out, kaldi::MatrixIndexT *len) {
+    kaldi::PythonThreadsAllowed allow;
     const kaldi::Vector<Real > &vec = $self->Value();
     const kaldi::MatrixIndexT dim = vec.Dim();
     *vec_out = (Real*) std::malloc(dim * sizeof(Real));
     std::memcpy(*vec_out, vec.Data(), dim * sizeof(Real));
     *len = dim;
   };
+
+  // swaps the current vector out of the holder and hands it over to numpy
+  // without copying. Value() and TakeValue() are invalid until Next()
+  PyObject* TakeValue() {
+    kaldi::Vector<Real > *vec;
+    {
+      kaldi::PythonThreadsAllowed allow;
+      kaldi::Vector<Real > &value = $self->Value();
+      vec = new kaldi::Vector<Real >();
+      vec->Swap(&value);
+    }
+    return kaldi::WrapKaldiObjectAsArray(vec, NpyType);
+  };
 }
 %extend kaldi::SequentialTableReader<kaldi::KaldiObjectHolder<kaldi::Matrix<Real > > > {
   void Value(Real **matrix_out,
              kaldi::MatrixIndexT *dim_row,
              kaldi::MatrixIndexT *dim_col) {
+    kaldi::PythonThreadsAllowed allow;
     const kaldi::Matrix<Real > &matr = $self->Value();
     const kaldi::MatrixIndexT num_rows = matr.NumRows();
     const kaldi::MatrixIndexT num_cols = matr.NumCols();
@@ -96,20 +307,39 @@ namespace kaldi {
     *dim_row = num_rows;
     *dim_col = num_cols;
   };
+
+  // swaps the current matrix out of the holder and hands it over to numpy
+  // without copying. Value() and TakeValue() are invalid until Next()
+  PyObject* TakeValue() {
+    kaldi::Matrix<Real > *matr;
+    {
+      kaldi::PythonThreadsAllowed allow;
+      kaldi::Matrix<Real > &value = $self->Value();
+      matr = new kaldi::Matrix<Real >();
+      matr->Swap(&value);
+    }
+    return kaldi::WrapKaldiObjectAsArray(matr, NpyType);
+  };
 }
 %extend kaldi::RandomAccessTableReaderMapped<kaldi::KaldiObjectHolder<kaldi::Vector<Real > > > {
   void Value(const std::string &key, Real **vec_out, kaldi::MatrixIndexT *len) {
+    kaldi::PythonThreadsAllowed allow;
     const kaldi::Vector<Real > &vec = $self->Value(key);
     const kaldi::MatrixIndexT dim = vec.Dim();
     *vec_out = (Real*) std::malloc(dim * sizeof(Real));
     std::memcpy(*vec_out, vec.Data(), dim * sizeof(Real));
     *len = dim;
   };
+
+  PyObject* ValueMany(const std::vector<std::string> &keys) {
+    return kaldi::ValueManyAsArrays($self, keys, NpyType);
+  };
 }
 %extend kaldi::RandomAccessTableReaderMapped<kaldi::KaldiObjectHolder<kaldi::Matrix<Real > > > {
   void Value(const std::string &key, Real **matrix_out,
              kaldi::MatrixIndexT *dim_row,
              kaldi::MatrixIndexT *dim_col) {
+    kaldi::PythonThreadsAllowed allow;
     const kaldi::Matrix<Real > &matr = $self->Value(key);
     const kaldi::MatrixIndexT num_rows = matr.NumRows();
     const kaldi::MatrixIndexT num_cols = matr.NumCols();
@@ -126,6 +356,10 @@ namespace kaldi {
     *dim_row = num_rows;
     *dim_col = num_cols;
   };
+
+  PyObject* ValueMany(const std::vector<std::string> &keys) {
+    return kaldi::ValueManyAsArrays($self, keys, NpyType);
+  };
 }
 
 // %clear (const Real *vec_in, const kaldi::MatrixIndexT len);
@@ -137,6 +371,6 @@ TEMPLATE_WITH_KOBJECT_NAME_AND_TYPE(RealName ## Vector, kaldi::Vector<Real>)
 TEMPLATE_WITH_KOBJECT_NAME_AND_TYPE(RealName ## Matrix, kaldi::Matrix<Real>)
 
 %enddef
-EXTEND_MV_WITH_REAL(double, Double)
-EXTEND_MV_WITH_REAL(float, Float)
+EXTEND_MV_WITH_REAL(double, Double, NPY_DOUBLE)
+EXTEND_MV_WITH_REAL(float, Float, NPY_FLOAT)
 
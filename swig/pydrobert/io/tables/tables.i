@@ -17,8 +17,122 @@
 */
 
 %{
+  #include <vector>
+  #include "feat/wave-reader.h"
+  #include "matrix/kaldi-matrix.h"
+  #include "matrix/kaldi-vector.h"
   #include "util/kaldi-holder.h"
+  #include "util/kaldi-io.h"
   #include "util/kaldi-table.h"
+
+namespace kaldi {
+  // Releases the GIL for the lifetime of the object. Kaldi may throw while
+  // reading or writing, so the GIL is reacquired during stack unwinding.
+  // Python threads can then read from or write to different tables
+  // concurrently. Nothing in this scope may touch the python API
+  class PythonThreadsAllowed {
+    public:
+      PythonThreadsAllowed() : save_(PyEval_SaveThread()) {}
+      ~PythonThreadsAllowed() { PyEval_RestoreThread(save_); }
+    private:
+      PyThreadState *save_;
+  };
+
+  // the shape a value would have as a numpy array. Scalars and tokens have
+  // none
+  template <class T>
+  void ValueShape(const T &value, std::vector<int64> *shape) {
+    shape->clear();
+  }
+  template <class T>
+  void ValueShape(const std::vector<T> &value, std::vector<int64> *shape) {
+    shape->assign(1, value.size());
+  }
+  template <typename Real>
+  void ValueShape(const Vector<Real> &value, std::vector<int64> *shape) {
+    shape->assign(1, value.Dim());
+  }
+  template <typename Real>
+  void ValueShape(const Matrix<Real> &value, std::vector<int64> *shape) {
+    shape->clear();
+    shape->push_back(value.NumRows());
+    shape->push_back(value.NumCols());
+  }
+  inline void ValueShape(const WaveData &value, std::vector<int64> *shape) {
+    ValueShape(value.Data(), shape);
+  }
+
+  // scans an archive in the same way as a sequential archive reader,
+  // recording where each object starts and how many bytes it spans.
+  // Returns a list of (key, offset, size, shape) tuples. Offsets point just
+  // past the key, as in the script files Kaldi writes with "ark,scp:"
+  template <class Holder>
+  PyObject* IndexArchive(const std::string &rxfilename) {
+    std::vector<std::string> keys;
+    std::vector<int64> offsets, sizes;
+    std::vector<std::vector<int64> > shapes;
+    {
+      PythonThreadsAllowed allow;
+      Input input;
+      if (!input.Open(rxfilename)) {
+        KALDI_ERR << "Unable to open archive "
+                  << PrintableRxfilename(rxfilename);
+      }
+      std::istream &is = input.Stream();
+      std::string key;
+      while (is >> key) {
+        int c = is.peek();
+        if (c != ' ' && c != '\t' && c != '\n') {
+          KALDI_ERR << "Invalid archive file format: expected space after "
+                    << "key " << key << ", reading "
+                    << PrintableRxfilename(rxfilename);
+        }
+        if (c != '\n') is.get();
+        const std::streampos start = is.tellg();
+        Holder holder;
+        if (!holder.Read(is)) {
+          KALDI_ERR << "Object read failed for key " << key << ", reading "
+                    << PrintableRxfilename(rxfilename);
+        }
+        const std::streampos end = is.tellg();
+        if (start < 0 || end < 0) {
+          KALDI_ERR << "Cannot determine offsets in "
+                    << PrintableRxfilename(rxfilename);
+        }
+        keys.push_back(key);
+        offsets.push_back(start);
+        sizes.push_back(end - start);
+        shapes.push_back(std::vector<int64>());
+        ValueShape(holder.Value(), &shapes.back());
+      }
+      if (!is.eof()) {
+        KALDI_ERR << "Error reading archive "
+                  << PrintableRxfilename(rxfilename);
+      }
+    }
+    PyObject *list = PyList_New(keys.size());
+    if (!list) return NULL;
+    for (std::size_t idx = 0; idx < keys.size(); ++idx) {
+      PyObject *shape = PyTuple_New(shapes[idx].size());
+      if (!shape) {
+        Py_DECREF(list);
+        return NULL;
+      }
+      for (std::size_t dim = 0; dim < shapes[idx].size(); ++dim) {
+        PyTuple_SET_ITEM(shape, dim, PyLong_FromLongLong(shapes[idx][dim]));
+      }
+      PyObject *entry = Py_BuildValue(
+        "(sLLN)", keys[idx].c_str(), static_cast<long long>(offsets[idx]),
+        static_cast<long long>(sizes[idx]), shape);
+      if (!entry) {
+        Py_DECREF(list);
+        return NULL;
+      }
+      PyList_SET_ITEM(list, idx, entry);
+    }
+    return list;
+  }
+}
 %}
 
 // general table types
@@ -34,53 +148,70 @@ namespace kaldi {
       bool Done();
       std::string Key();
       bool IsOpen() const;
-      bool Close();
-      bool Open(const std::string &rspecifier);
-      void Next();
       // const T &Value();
       %extend {
+        bool Open(const std::string &rspecifier) {
+          kaldi::PythonThreadsAllowed allow;
+          return $self->Open(rspecifier);
+        };
+
         bool OpenThreaded(const std::string &rspecifier) {
           // If we're trying to open a "background" sequential table reader, we
           // have to initialize python threads. We do this lazily since there's
           // a performance penalty.
           PyEval_InitThreads();
-          bool ret;
-          Py_BEGIN_ALLOW_THREADS;
-          ret = $self->Open(rspecifier);
-          Py_END_ALLOW_THREADS;
-          return ret;
+          kaldi::PythonThreadsAllowed allow;
+          return $self->Open(rspecifier);
         };
 
-        void NextThreaded() {
-          Py_BEGIN_ALLOW_THREADS;
+        void Next() {
+          kaldi::PythonThreadsAllowed allow;
           $self->Next();
-          Py_END_ALLOW_THREADS;
         };
 
-        bool CloseThreaded() {
-          bool ret;
-          Py_BEGIN_ALLOW_THREADS;
-          ret = $self->Close();
-          Py_END_ALLOW_THREADS;
-          return ret;
-        }
+        bool Close() {
+          kaldi::PythonThreadsAllowed allow;
+          return $self->Close();
+        };
       }
   };
   template <class Holder> class RandomAccessTableReaderMapped {
     public:
       typedef typename Holder::T T;
-      bool Open(const std::string &table_rxfilename,
-                const std::string &utt2spk_rxfilename);
       bool IsOpen() const;
-      bool Close();
-      bool HasKey(const std::string &key);
+      %extend {
+        bool Open(const std::string &table_rxfilename,
+                  const std::string &utt2spk_rxfilename) {
+          kaldi::PythonThreadsAllowed allow;
+          return $self->Open(table_rxfilename, utt2spk_rxfilename);
+        };
+
+        bool Close() {
+          kaldi::PythonThreadsAllowed allow;
+          return $self->Close();
+        };
+
+        bool HasKey(const std::string &key) {
+          kaldi::PythonThreadsAllowed allow;
+          return $self->HasKey(key);
+        };
+      }
   };
   template <class Holder> class TableWriter {
     public:
       typedef typename Holder::T T;
-      bool Open(const std::string &wspecifier);
       bool IsOpen() const;
-      bool Close();
+      %extend {
+        bool Open(const std::string &wspecifier) {
+          kaldi::PythonThreadsAllowed allow;
+          return $self->Open(wspecifier);
+        };
+
+        bool Close() {
+          kaldi::PythonThreadsAllowed allow;
+          return $self->Close();
+        };
+      }
   };
 }
 
@@ -99,6 +230,11 @@ namespace kaldi {
 EXTEND_RW_WITH_IS_BINARY(kaldi::SequentialTableReader, HolderName);
 EXTEND_RW_WITH_IS_BINARY(kaldi::RandomAccessTableReaderMapped, HolderName);
 EXTEND_RW_WITH_IS_BINARY(kaldi::TableWriter, HolderName);
+%extend kaldi::SequentialTableReader<HolderName > {
+  static PyObject* IndexArchive(const std::string &rxfilename) {
+    return kaldi::IndexArchive<HolderName >(rxfilename);
+  };
+}
 %enddef
 
 %define TEMPLATE_WITH_KOBJECT_NAME_AND_TYPE(Name, Type)
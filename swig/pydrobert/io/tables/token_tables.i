@@ -39,18 +39,21 @@ namespace kaldi {
       PyErr_SetString(PyExc_ValueError, "Value is not a token");
       return;
     }
+    kaldi::PythonThreadsAllowed allow;
     $self->Write(key, token);
   };
 }
 
 %extend kaldi::SequentialTableReader<kaldi::TokenHolder > {
   const std::string& Value() {
+    kaldi::PythonThreadsAllowed allow;
     return $self->Value();
   };
 }
 
 %extend kaldi::RandomAccessTableReaderMapped<kaldi::TokenHolder > {
   const std::string& Value(const std::string& key) {
+    kaldi::PythonThreadsAllowed allow;
     return $self->Value(key);
   };
 }
@@ -64,18 +67,21 @@ namespace kaldi {
         return;
       }
     }
+    kaldi::PythonThreadsAllowed allow;
     $self->Write(key, token_vec);
   };
 }
 
 %extend kaldi::SequentialTableReader<kaldi::TokenVectorHolder > {
   const std::vector<std::string >& Value() {
+    kaldi::PythonThreadsAllowed allow;
     return $self->Value();
   };
 }
 
 %extend kaldi::RandomAccessTableReaderMapped<kaldi::TokenVectorHolder > {
   const std::vector<std::string >& Value(const std::string& key) {
+    kaldi::PythonThreadsAllowed allow;
     return $self->Value(key);
   };
 }
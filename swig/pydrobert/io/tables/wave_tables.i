@@ -44,6 +44,7 @@ namespace kaldi {
   void Value(kaldi::BaseFloat **matrix_out,
              kaldi::MatrixIndexT *dim_row,
              kaldi::MatrixIndexT *dim_col) {
+    kaldi::PythonThreadsAllowed allow;
     const kaldi::Matrix<kaldi::BaseFloat > &matr = $self->Value().Data();
     const kaldi::MatrixIndexT num_rows = matr.NumRows();
     const kaldi::MatrixIndexT num_cols = matr.NumCols();
@@ -63,14 +64,21 @@ namespace kaldi {
     *dim_col = num_cols;
   };
 
-  kaldi::BaseFloat SampFreq() { return $self->Value().SampFreq(); };
-  kaldi::BaseFloat Duration() { return $self->Value().Duration(); };
+  kaldi::BaseFloat SampFreq() {
+    kaldi::PythonThreadsAllowed allow;
+    return $self->Value().SampFreq();
+  };
+  kaldi::BaseFloat Duration() {
+    kaldi::PythonThreadsAllowed allow;
+    return $self->Value().Duration();
+  };
 }
 
 %extend kaldi::RandomAccessTableReaderMapped<kaldi::WaveHolder > {
   void Value(const std::string &key, kaldi::BaseFloat **matrix_out,
              kaldi::MatrixIndexT *dim_row,
              kaldi::MatrixIndexT *dim_col) {
+    kaldi::PythonThreadsAllowed allow;
     const kaldi::Matrix<kaldi::BaseFloat > &matr = $self->Value(key).Data();
     const kaldi::MatrixIndexT num_rows = matr.NumRows();
     const kaldi::MatrixIndexT num_cols = matr.NumCols();
@@ -91,9 +99,11 @@ namespace kaldi {
   };
 
   kaldi::BaseFloat SampFreq(const std::string &key) {
+    kaldi::PythonThreadsAllowed allow;
     return $self->Value(key).SampFreq();
   };
   kaldi::BaseFloat Duration(const std::string &key) {
+    kaldi::PythonThreadsAllowed allow;
     return $self->Value(key).Duration();
   };
 }
@@ -107,6 +117,7 @@ namespace kaldi {
       PyErr_SetString(PyExc_ValueError, "Cannot write an empty wave file");
       return;
     }
+    kaldi::PythonThreadsAllowed allow;
     kaldi::Matrix<kaldi::BaseFloat> matrix(dim_row, dim_col,
                                kaldi::kUndefined, kaldi::kStrideEqualNumCols);
     std::memcpy(matrix.Data(), matrix_in,
@@ -118,15 +129,23 @@ namespace kaldi {
 }
 
 %extend kaldi::SequentialTableReader<kaldi::WaveInfoHolder > {
-  kaldi::BaseFloat SampFreq() { return $self->Value().SampFreq(); };
-  kaldi::BaseFloat Duration() { return $self->Value().Duration(); };
+  kaldi::BaseFloat SampFreq() {
+    kaldi::PythonThreadsAllowed allow;
+    return $self->Value().SampFreq();
+  };
+  kaldi::BaseFloat Duration() {
+    kaldi::PythonThreadsAllowed allow;
+    return $self->Value().Duration();
+  };
 }
 
 %extend kaldi::RandomAccessTableReaderMapped<kaldi::WaveInfoHolder > {
   kaldi::BaseFloat SampFreq(const std::string &key) {
+    kaldi::PythonThreadsAllowed allow;
     return $self->Value(key).SampFreq();
   };
   kaldi::BaseFloat Duration(const std::string &key) {
+    kaldi::PythonThreadsAllowed allow;
     return $self->Value(key).Duration();
   };
 }
@@ -86,8 +86,11 @@ namespace kaldi {
 
 %numpy_typemaps(double, NPY_DOUBLE, kaldi::MatrixIndexT);
 %numpy_typemaps(float, NPY_FLOAT, kaldi::MatrixIndexT);
+%numpy_typemaps(kaldi::MatrixIndexT, NPY_INT, kaldi::MatrixIndexT);
+%apply(kaldi::MatrixIndexT* IN_ARRAY1, kaldi::MatrixIndexT DIM1) {(const kaldi::MatrixIndexT *lens_in, const kaldi::MatrixIndexT num_lens)}
 
 %include "pydrobert/error.i"
 %include "pydrobert/io/util.i"
 %include "pydrobert/io/tables/tables.i"
 %include "pydrobert/io/duck.i"
+%include "pydrobert/eval/util.i"
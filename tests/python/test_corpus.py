@@ -18,6 +18,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import signal
+
 from itertools import product
 from itertools import repeat
 
@@ -256,6 +259,62 @@ def test_padding():
     assert no_cast_batches[0] == samples
 
 
+@pytest.mark.parametrize('pad_kwargs', [
+    {'pad_mode': 'constant'},
+    {'pad_mode': 'constant', 'constant_values': -3},
+    {'pad_mode': 'edge'},
+    {'pad_mode': 'reflect'},
+])
+@pytest.mark.parametrize('axis', [0, 1, -1])
+@pytest.mark.parametrize('num_buffers', [0, 2])
+def test_padding_matches_numpy(pad_kwargs, axis, num_buffers):
+    pad_kwargs = dict(pad_kwargs)
+    rng = np.random.RandomState(5)
+    samples = [
+        rng.random_sample((rng.randint(1, 6), rng.randint(2, 4), 3))
+        for _ in range(10)
+    ]
+    batches = tuple(
+        batch.copy() for batch in corpus.batch_data(
+            samples, subsamples=False, batch_size=4, axis=axis,
+            num_buffers=num_buffers, **pad_kwargs))
+    assert len(batches) == 3
+    pad_mode = pad_kwargs.pop('pad_mode')
+    for batch_idx, act_batch in enumerate(batches):
+        batch = samples[batch_idx * 4:(batch_idx + 1) * 4]
+        max_shape = tuple(max(dims) for dims in zip(*(x.shape for x in batch)))
+        ex_batch = np.stack(
+            [
+                np.pad(
+                    x, tuple((0, y - z) for z, y in zip(x.shape, max_shape)),
+                    mode=pad_mode, **pad_kwargs)
+                for x in batch
+            ],
+            axis=axis)
+        assert ex_batch.shape == act_batch.shape
+        assert np.allclose(ex_batch, act_batch)
+
+
+def test_batch_buffers_are_reused():
+    samples = [np.full((idx % 3 + 1, 2), idx) for idx in range(12)]
+    batches = list(corpus.batch_data(
+        samples, subsamples=False, batch_size=3, pad_mode='constant',
+        num_buffers=2))
+    assert len(batches) == 4
+    # the ring wraps around: batches two apart share memory, so the
+    # first two batches have been overwritten by the last two
+    assert np.shares_memory(batches[0], batches[2])
+    assert not np.shares_memory(batches[0], batches[1])
+    assert np.all(batches[0][:, 0, 0] == [6, 7, 8])
+    assert np.all(batches[1][:, 0, 0] == [9, 10, 11])
+    assert np.all(batches[3][:, 2] == [[0, 0], [0, 0], [11, 11]])
+    tup_batches = list(corpus.batch_data(
+        zip(samples, samples), batch_size=6, pad_mode='constant',
+        num_buffers=1))
+    assert not np.shares_memory(*tup_batches[0])
+    assert np.shares_memory(tup_batches[0][0], tup_batches[1][0])
+
+
 class NonRandomState(np.random.RandomState):
     '''Replace the shuffle method with returning a reverse-sorted copy
 
@@ -388,6 +447,296 @@ def test_shuffled_ignore_missing(temp_file_1_name, temp_file_2_name):
     assert all(not act for act in act_bool_samples)
 
 
+@pytest.mark.parametrize('world_size', [1, 2])
+def test_shuffled_ignore_missing_utt2spk(temp_dir, world_size):
+    feats = 'ark:' + os.path.join(temp_dir, 'feats.ark')
+    cmvn = 'ark:' + os.path.join(temp_dir, 'cmvn.ark')
+    utt2spk = os.path.join(temp_dir, 'utt2spk')
+    with io_open(feats, 'fm', mode='w') as feats_f:
+        for key in ('u1', 'u2', 'u3', 'u4'):
+            feats_f.write(key, np.ones((2, 3), dtype=np.float32))
+    with io_open(cmvn, 'fm', mode='w') as cmvn_f:
+        for key in ('s1', 's2'):
+            cmvn_f.write(key, np.zeros((2, 4), dtype=np.float32))
+    with open(utt2spk, 'w') as utt2spk_f:
+        utt2spk_f.write('u1 s1\nu2 s1\nu3 s2\nu4 s2\n')
+    # the cmvn table is keyed by speaker, but accessed by utterance
+    data = corpus.ShuffledData(
+        (feats, 'fm'), (cmvn, 'fm', {'utt2spk': 'ark:' + utt2spk}),
+        ignore_missing=True, batch_size=1, world_size=world_size)
+    assert data.num_samples == 4 // world_size
+    assert len(list(data)) == 4 // world_size
+
+
+@pytest.mark.parametrize('given_lengths', [True, False])
+def test_bucketed_data(temp_file_1_name, given_lengths):
+    lengths = [1, 2, 2, 3, 5, 8, 13, 21, 34, 55]
+    keys = tuple('{:02d}'.format(idx) for idx in range(len(lengths)))
+    with io_open('ark:' + temp_file_1_name, 'fv', mode='w') as f:
+        for key, length in zip(keys, lengths):
+            f.write(key, np.full(length, length, dtype=np.float32))
+    kwargs = dict(
+        batch_pad_mode='constant', add_key=True, axis_lengths=0, rng=1234)
+    if given_lengths:
+        kwargs['key_lengths'] = dict(zip(keys, lengths))
+    with pytest.raises(ValueError):
+        corpus.BucketedData(('ark:' + temp_file_1_name, 'fv'), **kwargs)
+    data = corpus.BucketedData(
+        ('ark:' + temp_file_1_name, 'fv'), num_buckets=3, batch_size=3,
+        **kwargs)
+    assert keys == tuple(data.key_list)
+    assert data.buckets == (keys[:4], keys[4:7], keys[7:])
+    assert data.bucket_batch_sizes == (3, 3, 3)
+    assert len(data) == 4
+    for _ in range(2):
+        seen = set()
+        num_batches = 0
+        for key_batch, value_batch, length_batch in data:
+            num_batches += 1
+            assert len(set(key_batch) & seen) == 0
+            seen |= set(key_batch)
+            assert any(set(key_batch) <= set(b) for b in data.buckets)
+            assert value_batch.shape == (len(key_batch), max(length_batch))
+            for key, value, length in zip(
+                    key_batch, value_batch, length_batch):
+                assert length == lengths[keys.index(key)]
+                assert np.all(value[:length] == length)
+                assert np.all(value[length:] == 0)
+        assert seen == set(keys)
+        assert num_batches == len(data)
+    data = corpus.BucketedData(
+        ('ark:' + temp_file_1_name, 'fv'), bucket_boundaries=(4, 30),
+        max_frames=20, **kwargs)
+    assert data.buckets == (keys[:4], keys[4:8], keys[8:])
+    assert data.bucket_batch_sizes == (4, 1, 1)
+    batch_sizes = sorted(len(b[0]) for b in data)
+    assert batch_sizes == [1] * 6 + [4]
+    # with max_frames, no batch exceeds the budget unless it's of a
+    # single sample
+    assert all(
+        len(batch) == 1 or len(batch) * max(
+            lengths[keys.index(key)] for key in batch) <= 20
+        for batch in data.batch_keys_for_epoch()
+    )
+
+
+@pytest.mark.parametrize('num_workers', [0, 1, 3])
+def test_parallel_data(temp_file_1_name, temp_file_2_name, num_workers):
+    keys = tuple('{:02d}'.format(idx) for idx in range(20))
+    with io_open('ark:' + temp_file_1_name, 'fv', mode='w') as feat_f, \
+            io_open('ark:' + temp_file_2_name, 't', mode='w') as tok_f:
+        for idx, key in enumerate(keys):
+            feat_f.write(key, np.arange(idx % 7, dtype=np.float32))
+            tok_f.write(key, 'tok' + key)
+    tables = (
+        ('ark:' + temp_file_1_name, 'fv'), ('ark:' + temp_file_2_name, 't'))
+    kwargs = dict(batch_size=3, batch_pad_mode='constant', axis_lengths=0)
+    ex_data = corpus.ShuffledData(*tables, rng=4, **kwargs)
+    act_data = corpus.ParallelData(
+        corpus.ShuffledData(*tables, rng=4, **kwargs),
+        num_workers=num_workers, prefetch=1)
+    assert len(act_data) == len(ex_data) == 7
+    with act_data:
+        for epoch in range(2):
+            ex_batches = list(ex_data)
+            act_batches = list(act_data)
+            assert len(act_batches) == 7
+            for ex_batch, act_batch in zip(ex_batches, act_batches):
+                ex_feats, ex_toks, ex_lens = ex_batch
+                act_feats, act_toks, act_lens = act_batch
+                assert np.allclose(ex_feats, act_feats)
+                assert ex_feats.dtype == act_feats.dtype
+                assert list(ex_toks) == list(act_toks)
+                assert np.all(ex_lens == act_lens)
+            act_feats[...] = 0  # batches are writable
+        # an epoch cut short doesn't leak into the next
+        for _ in zip(range(2), act_data):
+            pass
+        next(iter(ex_data))
+        for ex_batch, act_batch in zip(ex_data, act_data):
+            assert np.allclose(ex_batch[0], act_batch[0])
+    ex_data = corpus.BucketedData(*tables, num_buckets=2, rng=1, **kwargs)
+    act_data = corpus.ParallelData(
+        corpus.BucketedData(*tables, num_buckets=2, rng=1, **kwargs),
+        num_workers=num_workers)
+    for ex_batch, act_batch in zip(ex_data, act_data):
+        assert np.allclose(ex_batch[0], act_batch[0])
+    act_data.close()
+    data = corpus.ParallelData(
+        corpus.ShuffledData(
+            *tables, key_list=keys + ('missing',), rng=1, **kwargs),
+        num_workers=num_workers)
+    with pytest.raises(IOError):
+        list(data)
+    data.close()
+    with pytest.raises(TypeError):
+        corpus.ParallelData(corpus.SequentialData(*tables))
+
+
+def test_parallel_data_worker_failure(temp_dir):
+    keys = tuple('{:02d}'.format(idx) for idx in range(20))
+    path = os.path.join(temp_dir, 'feats.ark')
+    with io_open('ark:' + path, 'fv', mode='w') as feat_f:
+        for key in keys:
+            feat_f.write(key, np.zeros(3, dtype=np.float32))
+    table = ('ark:' + path, 'fv')
+    data = corpus.ParallelData(
+        corpus.ShuffledData(table, batch_size=1, rng=1), num_workers=1,
+        prefetch=1)
+    # a worker killed mid-epoch
+    batches = data.batch_generator()
+    next(batches)
+    os.kill(data._workers[0].pid, signal.SIGKILL)
+    with pytest.raises(IOError):
+        list(batches)
+    # restarted after failure
+    assert len(list(data)) == len(keys)
+    data.close()
+    # workers can't reopen a table that's gone
+    data = corpus.ParallelData(
+        corpus.ShuffledData(table, batch_size=1, rng=1), num_workers=2)
+    os.remove(path)
+    with pytest.raises(IOError):
+        list(data)
+    data.close()
+
+
+@pytest.mark.parametrize('data_type', [
+    'shuffled', 'shuffled_missing', 'bucketed', 'sequential'])
+@pytest.mark.parametrize('world_size', [1, 3])
+def test_sharding(temp_file_1_name, data_type, world_size):
+    keys = tuple('{:02d}'.format(idx) for idx in range(23))
+    with io_open('ark:' + temp_file_1_name, 'fv', mode='w') as f:
+        for idx, key in enumerate(keys):
+            f.write(key, np.arange(idx % 5 + 1, dtype=np.float32))
+    table = ('ark,s:' + temp_file_1_name, 'fv')
+    kwargs = dict(batch_size=2, batch_pad_mode='constant', add_key=True)
+    if data_type == 'sequential':
+        cls = corpus.SequentialData
+    elif data_type == 'bucketed':
+        cls = corpus.BucketedData
+        kwargs.update(num_buckets=2, rng=10)
+    else:
+        cls = corpus.ShuffledData
+        kwargs['rng'] = 10
+        if data_type == 'shuffled_missing':
+            kwargs.update(key_list=keys + ('nope',), ignore_missing=True)
+    shards = [
+        cls(table, rank=rank, world_size=world_size, **kwargs)
+        for rank in range(world_size)
+    ]
+    num_samples = shards[0].num_samples
+    num_batches = len(shards[0])
+    if data_type == 'bucketed':
+        assert num_samples == sum(
+            len(b) // world_size for b in shards[0].buckets)
+    else:
+        assert num_samples == len(keys) // world_size
+    for _ in range(2):
+        epoch_keys = []
+        for shard in shards:
+            assert shard.num_samples == num_samples
+            assert len(shard) == num_batches
+            shard_keys = [
+                key for key_batch, _ in shard for key in key_batch]
+            assert len(shard_keys) == num_samples
+            epoch_keys.extend(shard_keys)
+        assert len(set(epoch_keys)) == len(epoch_keys)
+        assert set(epoch_keys) <= set(keys)
+    with pytest.raises(ValueError):
+        cls(table, rank=world_size, world_size=world_size, **kwargs)
+
+
+@pytest.mark.parametrize('data_type', [
+    'sequential', 'sequential_ark', 'sequential_prefetch',
+    'sequential_sharded', 'shuffled', 'shuffled_missing', 'bucketed',
+    'buffered', 'parallel',
+])
+def test_resume(temp_dir, data_type):
+    keys = tuple('{:02d}'.format(idx) for idx in range(17))
+    ark = os.path.join(temp_dir, 'feats.ark')
+    scp = os.path.join(temp_dir, 'feats.scp')
+    with io_open('ark,scp:{},{}'.format(ark, scp), 'fv', mode='w') as f:
+        for idx, key in enumerate(keys):
+            f.write(key, np.arange(idx % 5 + 1, dtype=np.float32))
+    table = ('scp,s:' + scp, 'fv')
+    kwargs = dict(batch_size=3, batch_pad_mode='constant', add_key=True)
+    cls = corpus.SequentialData
+    if data_type == 'sequential':
+        pass
+    elif data_type == 'sequential_ark':
+        table = ('ark,s:' + ark, 'fv')
+    elif data_type == 'sequential_prefetch':
+        kwargs['prefetch'] = 2
+    elif data_type == 'sequential_sharded':
+        kwargs.update(rank=1, world_size=2)
+    elif data_type == 'bucketed':
+        cls = corpus.BucketedData
+        kwargs.update(rng=3, num_buckets=3, key_lengths=dict(
+            (key, idx % 5 + 1) for idx, key in enumerate(keys)))
+    elif data_type == 'buffered':
+        cls = corpus.BufferedShuffleData
+        kwargs.update(rng=3, buffer_size=4)
+    elif data_type == 'shuffled_missing':
+        cls = corpus.ShuffledData
+        kwargs.update(
+            rng=3, key_list=keys[:5] + ('nope',) + keys[5:],
+            ignore_missing=True)
+    else:
+        cls = corpus.ShuffledData
+        kwargs.update(rng=3, key_list=keys)
+
+    def make_data(table):
+        data = cls(table, **kwargs)
+        if data_type == 'parallel':
+            data = corpus.ParallelData(data, num_workers=2)
+        return data
+
+    def epoch_keys(data):
+        return [list(batch[0]) for batch in data]
+
+    data = make_data(table)
+    ex_epochs = [epoch_keys(data), epoch_keys(data)]
+    assert data.state_dict()['position'] is None
+    if data_type == 'parallel':
+        data.close()
+    data = make_data(table)
+    batches = iter(data)
+    served_epoch = [list(next(batches)[0]) for _ in range(2)]
+    state = data.state_dict()
+    assert state['position'] is not None
+    del batches
+    if data_type == 'parallel':
+        data.close()
+    data = make_data(table)
+    data.load_state_dict(state)
+    assert served_epoch + epoch_keys(data) == ex_epochs[0]
+    assert epoch_keys(data) == ex_epochs[1]
+    if data_type == 'parallel':
+        data.close()
+    if data_type in ('buffered', 'sequential_ark', 'sequential_sharded'):
+        # buffers are refilled from the start of the epoch, and shards
+        # are sized by counting all samples up front
+        return
+    # served samples are skipped without being read, so it doesn't matter
+    # if they've gone missing in the meantime
+    served = set(key for batch in served_epoch for key in batch)
+    if data_type.startswith('sequential'):
+        served = set(key for key in keys if key <= max(served))
+    holes_scp = os.path.join(temp_dir, 'holes.scp')
+    with open(scp) as scp_file, open(holes_scp, 'w') as holes_file:
+        for line in scp_file:
+            key = line.split()[0]
+            if key in served:
+                line = '{} {}\n'.format(key, os.path.join(temp_dir, 'nope'))
+            holes_file.write(line)
+    data = make_data(('scp,s:' + holes_scp, 'fv'))
+    data.load_state_dict(state)
+    assert served_epoch + epoch_keys(data) == ex_epochs[0]
+    if data_type == 'parallel':
+        data.close()
+
+
 def test_sequential_basic(temp_file_1_name):
     samples = np.arange(1000).reshape((10, 100)).astype(np.int32)
     with io_open('ark:' + temp_file_1_name, 'iv', mode='w') as f:
@@ -429,6 +778,71 @@ def test_sequential_data_tups(temp_file_1_name, temp_file_2_name):
     assert len(data) == batch_start
 
 
+@pytest.mark.parametrize('prefetch', [1, 3])
+def test_sequential_prefetch(temp_file_1_name, temp_file_2_name, prefetch):
+    with io_open('ark:' + temp_file_1_name, 'dv', mode='w') as feat_f, \
+            io_open('ark:' + temp_file_2_name, 'i', mode='w') as int_f:
+        for idx in range(10):
+            feat_f.write(str(idx), np.arange(idx, dtype=np.float64))
+            if idx != 7:
+                int_f.write(str(idx), idx)
+    tables = (('ark,s:' + temp_file_1_name, 'dv'),)
+    kwargs = dict(batch_size=3, batch_pad_mode='constant', add_key=True)
+    ex_data = corpus.SequentialData(*tables, **kwargs)
+    act_data = corpus.SequentialData(*tables, prefetch=prefetch, **kwargs)
+    assert act_data.prefetch == prefetch
+    assert 'prefetch' not in act_data.batch_kwargs
+    for _ in range(2):
+        ex_batches = list(ex_data)
+        act_batches = list(act_data)
+        assert len(ex_batches) == len(act_batches) == 4
+        for ex_batch, act_batch in zip(ex_batches, act_batches):
+            assert tuple(ex_batch[0]) == tuple(act_batch[0])
+            assert np.allclose(ex_batch[1], act_batch[1])
+    # stopping early doesn't hang
+    for _ in zip(range(1), act_data):
+        pass
+    repeated = act_data.batch_generator(repeat=True)
+    assert len([batch for _, batch in zip(range(9), repeated)]) == 9
+    repeated.close()
+    # errors in the background thread are raised in the caller's
+    tables += (('ark,s:' + temp_file_2_name, 'i'),)
+    act_data = corpus.SequentialData(*tables, prefetch=prefetch, **kwargs)
+    with pytest.raises(IOError):
+        list(act_data)
+
+
+@pytest.mark.parametrize('buffer_kwargs', [
+    {'buffer_size': 1},
+    {'buffer_size': 4},
+    {'buffer_bytes': 4 * 3 * 4},
+    {'buffer_size': 100},
+])
+def test_buffered_shuffle_data(temp_file_1_name, buffer_kwargs):
+    samples = np.arange(60, dtype=np.float32).reshape(20, 3)
+    with io_open('ark:' + temp_file_1_name, 'fv', mode='w') as f:
+        for idx, sample in enumerate(samples):
+            f.write('{:02d}'.format(idx), sample)
+    data = corpus.BufferedShuffleData(
+        ('ark:cat {}|'.format(temp_file_1_name), 'fv'), batch_size=3,
+        rng=1, **buffer_kwargs)
+    assert len(data) == 7
+    epochs = [np.concatenate(list(data)) for _ in range(2)]
+    for epoch in epochs:
+        assert epoch.shape == samples.shape
+        # every sample once
+        assert np.all(np.sort(epoch[:, 0]) == samples[:, 0])
+        # a sample can't be yielded before it's been read
+        buffer_size = buffer_kwargs.get('buffer_size', 4)
+        for out_idx, sample in enumerate(epoch[:-buffer_size]):
+            assert sample[0] // 3 <= out_idx + buffer_size
+    assert not np.all(epochs[0] == epochs[1])
+    data_2 = corpus.BufferedShuffleData(
+        ('ark:cat {}|'.format(temp_file_1_name), 'fv'), batch_size=3,
+        rng=1, **buffer_kwargs)
+    assert np.all(epochs[0] == np.concatenate(list(data_2)))
+
+
 def test_sequential_ignore_missing(temp_file_1_name, temp_file_2_name):
     with io_open('ark:' + temp_file_1_name, 'ipv', mode='w') as pair_f:
         pair_f.write('10', [(10, 9), (8, 7), (6, 5)])
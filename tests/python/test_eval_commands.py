@@ -16,6 +16,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import logging
+import os
+
+import numpy as np
+import pytest
+
+from six import StringIO
+
 import pydrobert.kaldi.io as kaldi_io
 
 from pydrobert.kaldi.eval import command_line
@@ -55,3 +63,171 @@ def test_compute_error_rate(
     with open(temp_file_3_name) as out_file_reader:
         out_text = out_file_reader.read()
     assert 'Accuracy: {:.2f}%'.format((1 - 5 / 8) * 100) in out_text
+
+
+@pytest.mark.parametrize('chunk_size', [1, 1000])
+def test_compute_error_rate_tables(
+        temp_file_1_name, temp_file_2_name, temp_file_3_name, chunk_size,
+        monkeypatch):
+    monkeypatch.setattr(command_line, '_ERROR_RATE_CHUNK_SIZE', chunk_size)
+    with kaldi_io.open('ark:' + temp_file_1_name, 'tv', 'w') as ref_writer:
+        ref_writer.write('A', ('a', 'b', 'c'))
+        ref_writer.write('B', ('b', 'c'))
+        ref_writer.write('C', ('a', 'a'))
+    with kaldi_io.open('ark:' + temp_file_2_name, 'tv', 'w') as hyp_writer:
+        hyp_writer.write('A', ('a', 'c', 'c'))
+        hyp_writer.write('B', ('b', 'c'))
+        hyp_writer.write('C', ('a', 'a', 'b'))
+    ret_code = command_line.compute_error_rate([
+        'ark:' + temp_file_1_name,
+        'ark:' + temp_file_2_name,
+        temp_file_3_name,
+        '--print-tables=true',
+    ])
+    assert ret_code == 0
+    with open(temp_file_3_name) as out_file_reader:
+        out_text = out_file_reader.read()
+    assert 'Processed 3/3.' in out_text
+    assert 'Error rate: {:.2f}%'.format(2 / 7 * 100) in out_text
+    assert 'Total insertions: 1, deletions: 0, substitutions: 1' in out_text
+
+
+def test_compute_error_rate_num_jobs(temp_dir, monkeypatch):
+    monkeypatch.setattr(command_line, '_ERROR_RATE_CHUNK_SIZE', 3)
+    ref = os.path.join(temp_dir, 'ref')
+    hyps = [os.path.join(temp_dir, 'hyp{}'.format(idx)) for idx in range(2)]
+    rng = np.random.RandomState(5)
+    with kaldi_io.open('ark,scp:{0}.ark,{0}.scp'.format(ref), 'tv', 'w') as \
+            ref_writer:
+        for utt_idx in range(20):
+            ref_writer.write('{:02d}'.format(utt_idx), tuple(
+                rng.choice(list('abcd'), rng.randint(1, 8))))
+    for hyp_idx, hyp in enumerate(hyps):
+        with kaldi_io.open(
+                'ark,scp:{0}.ark,{0}.scp'.format(hyp), 'tv', 'w') as \
+                hyp_writer:
+            for utt_idx in range(20):
+                if utt_idx != 7 + hyp_idx:
+                    hyp_writer.write('{:02d}'.format(utt_idx), tuple(
+                        rng.choice(list('abcd'), rng.randint(0, 8))))
+    hyp_rspecifiers = ['scp:{}.scp'.format(hyp) for hyp in hyps]
+    for num_hyps in (1, 2):
+        out_texts = []
+        for num_jobs in (1, 3):
+            out_path = os.path.join(temp_dir, 'out{}'.format(num_jobs))
+            assert not command_line.compute_error_rate(
+                ['scp:{}.scp'.format(ref)] + hyp_rspecifiers[:num_hyps] + [
+                    '--out-path=' + out_path, '--print-tables=true',
+                    '--include-inserts-in-cost=false',
+                    '--num-jobs={}'.format(num_jobs),
+                ])
+            with open(out_path) as out_file_reader:
+                out_texts.append(out_file_reader.read())
+        assert out_texts[0] == out_texts[1]
+    assert command_line.compute_error_rate([
+        'ark:{}.ark'.format(ref), hyp_rspecifiers[0],
+        os.path.join(temp_dir, 'out'), '--num-jobs=2'])
+    # a worker failing to read a value fails the command
+    bad_scp = os.path.join(temp_dir, 'bad.scp')
+    with open('{}.scp'.format(ref)) as scp_file:
+        lines = scp_file.readlines()
+    lines[5] = lines[5].split()[0] + ' ' + os.path.join(
+        temp_dir, 'missing.ark:5') + '\n'
+    with open(bad_scp, 'w') as scp_file:
+        scp_file.writelines(lines)
+    with pytest.raises(RuntimeError):
+        command_line.compute_error_rate([
+            'scp:{}.scp'.format(ref), 'scp:' + bad_scp,
+            os.path.join(temp_dir, 'out'), '--num-jobs=2'])
+
+
+def test_compute_error_rate_many_hyps(temp_dir, monkeypatch):
+    monkeypatch.setattr(command_line, '_ERROR_RATE_CHUNK_SIZE', 4)
+    rng = np.random.RandomState(7)
+    ref = 'ark:' + os.path.join(temp_dir, 'ref.ark')
+    hyps = [
+        'ark:' + os.path.join(temp_dir, 'hyp{}.ark'.format(hyp_idx))
+        for hyp_idx in range(3)]
+    with kaldi_io.open(ref, 'tv', 'w') as ref_writer:
+        for utt_idx in range(10):
+            ref_writer.write('{:02d}'.format(utt_idx), tuple(
+                rng.choice(list('abcd'), rng.randint(1, 8))))
+    for hyp_idx, hyp in enumerate(hyps):
+        with kaldi_io.open(hyp, 'tv', 'w') as hyp_writer:
+            for utt_idx in range(10):
+                if utt_idx != hyp_idx + 3:
+                    hyp_writer.write('{:02d}'.format(utt_idx), tuple(
+                        rng.choice(list('abcd'), rng.randint(0, 8))))
+    args = ['--print-tables=true', '--include-inserts-in-cost=false']
+    exp = []
+    for hyp in hyps:
+        out_path = os.path.join(temp_dir, 'out')
+        assert not command_line.compute_error_rate(
+            [ref, hyp, out_path] + args)
+        with open(out_path) as out_file_reader:
+            exp.append("'{}': ".format(hyp) + out_file_reader.read())
+    out_path = os.path.join(temp_dir, 'out_all')
+    assert not command_line.compute_error_rate(
+        [ref] + hyps + ['--out-path', out_path] + args)
+    with open(out_path) as out_file_reader:
+        assert out_file_reader.read() == ''.join(exp)
+
+
+@pytest.mark.parametrize('include_inserts', [True, False])
+def test_compute_error_rate_bootstrap(temp_dir, include_inserts):
+    ref = 'ark:' + os.path.join(temp_dir, 'ref.ark')
+    hyp_a = 'ark:' + os.path.join(temp_dir, 'hyp_a.ark')
+    hyp_b = 'ark:' + os.path.join(temp_dir, 'hyp_b.ark')
+    with kaldi_io.open(ref, 'tv', 'w') as ref_writer, \
+            kaldi_io.open(hyp_a, 'tv', 'w') as hyp_a_writer, \
+            kaldi_io.open(hyp_b, 'tv', 'w') as hyp_b_writer:
+        ref_writer.write('a', ('a', 'b', 'c'))
+        hyp_a_writer.write('a', ('a', 'b', 'c', 'd'))
+        hyp_b_writer.write('a', ('a', 'b', 'c'))
+        ref_writer.write('b', ('a', 'b'))
+        hyp_a_writer.write('b', ('c', 'b'))
+        hyp_b_writer.write('b', ('c', 'b'))
+        ref_writer.write('c', ('d',))
+        hyp_b_writer.write('c', ())
+    out_path = os.path.join(temp_dir, 'out')
+    assert not command_line.compute_error_rate([
+        ref, hyp_a, hyp_b, '--out-path', out_path,
+        '--confidence-interval=true',
+        '--paired-test=true', '--bootstrap-samples=2000',
+        '--include-inserts-in-cost={}'.format(
+            'true' if include_inserts else 'false')])
+    with open(out_path) as out_file_reader:
+        lines = out_file_reader.read().splitlines()
+    assert len(lines) == 5
+    assert lines[1].startswith("'{}': 95.0% confidence interval: [".format(
+        hyp_a))
+    # hyp_a is scored on utterances 'a' and 'b' only
+    lower, upper = (
+        float(bound.strip('%')) for bound in
+        lines[1].split('[')[1].rstrip(']').split(', '))
+    assert lower <= (40 if include_inserts else 20) <= upper
+    assert 0 <= lower <= upper <= 50
+    assert lines[4].startswith(
+        "'{}' vs. '{}': Compared 2. Error rate difference: {}%".format(
+            hyp_a, hyp_b, '+20.00' if include_inserts else '+0.00'))
+    with pytest.raises(SystemExit):
+        command_line.compute_error_rate([ref, hyp_a, '--paired-test=true'])
+    # only "ref hyp out_path" takes a path as the last positional
+    with pytest.raises(SystemExit):
+        command_line.compute_error_rate([ref, hyp_a, hyp_b, out_path])
+    with pytest.raises(SystemExit):
+        command_line.compute_error_rate(
+            [ref, hyp_a, out_path, '--out-path', out_path])
+    # no utterances in common, so no test
+    stats_a = command_line._new_error_rate_stats()
+    stats_b = command_line._new_error_rate_stats()
+    stats_a['keys'], stats_b['keys'] = ['a'], ['b']
+    for stats in (stats_a, stats_b):
+        stats['errors'].append(np.array([1]))
+        stats['ref_lens'].append(np.array([2], dtype=np.int32))
+    options = command_line._compute_error_rate_parse_args(
+        [ref, hyp_a, hyp_b, '--paired-test=true'], logging.getLogger())
+    out_file = StringIO()
+    command_line._print_paired_test(
+        stats_a, stats_b, options, out_file, logging.getLogger())
+    assert not out_file.getvalue()
@@ -18,6 +18,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import numpy as np
+import pytest
+
 import pydrobert.kaldi.eval as kaldi_eval
 
 
@@ -39,3 +42,135 @@ def test_edit_distance():
     assert deletes == {'k': 1, 'e': 1}
     assert subs == dict()
     assert totals == {'k': 1, 'i': 1, 't': 2, 'e': 1, 'n': 1}
+
+
+@pytest.mark.parametrize('costs', [(1, 1, 1), (0, 1, 2), (2, 3, 1)])
+def test_edit_distance_native_matches_python(costs):
+    rng = np.random.RandomState(len(costs) * sum(costs))
+    for _ in range(50):
+        ref = tuple(rng.choice(list('abcde'), rng.randint(0, 10)))
+        hyp = tuple(rng.choice(list('abcdef'), rng.randint(0, 10)))
+        exp = kaldi_eval.util._edit_distance_python(
+            ref, hyp, costs[0], costs[1], costs[2], True)
+        act = kaldi_eval.util.edit_distance(
+            ref, hyp, *costs, return_tables=True)
+        assert act == exp
+        assert type(act[0]) is type(exp[0])
+        assert kaldi_eval.util.edit_distance(ref, hyp, *costs) == exp[0]
+
+
+def test_edit_distance_unhashable_tokens():
+    ref = [['a'], ['b'], ['c']]
+    hyp = [['a'], ['c']]
+    assert kaldi_eval.util.edit_distance(ref, hyp) == 1
+    assert kaldi_eval.util.edit_distance(
+        'abc', 'ac', deletion_cost=.5) == \
+        kaldi_eval.util._edit_distance_python('abc', 'ac', 1, .5, 1, False)
+
+
+@pytest.mark.parametrize('num_threads', [1, 3])
+def test_edit_distance_batch(num_threads):
+    rng = np.random.RandomState(num_threads)
+    refs = [
+        tuple(rng.choice(list('abcde'), rng.randint(0, 10)))
+        for _ in range(20)]
+    hyps = [
+        tuple(rng.choice(list('abcdef'), rng.randint(0, 10)))
+        for _ in range(20)]
+    exp = [
+        kaldi_eval.util.edit_distance(ref, hyp, 2, 1, 1, True)
+        for ref, hyp in zip(refs, hyps)]
+    exp_tables = (dict(), dict(), dict(), dict())
+    for ret in exp:
+        for table, utt_table in zip(exp_tables, ret[1:]):
+            for token, count in utt_table.items():
+                table[token] = table.get(token, 0) + count
+    vocab = dict()
+    act = kaldi_eval.util.edit_distance_batch(
+        refs, hyps, 2, 1, 1, return_tables=True, vocab=vocab,
+        num_threads=num_threads)
+    assert act[0].tolist() == [ret[0] for ret in exp]
+    assert act[1:] == exp_tables
+    assert sorted(vocab.values()) == list(range(len(vocab)))
+    act = kaldi_eval.util.edit_distance_batch(
+        refs, hyps, 2, 1, 1, vocab=vocab, num_threads=num_threads)
+    assert act.tolist() == [ret[0] for ret in exp]
+    # falls back on unhashable tokens
+    act = kaldi_eval.util.edit_distance_batch(
+        [[list(token) for token in ref] for ref in refs],
+        [[list(token) for token in hyp] for hyp in hyps], 2, 1, 1)
+    assert act.tolist() == [ret[0] for ret in exp]
+    assert kaldi_eval.util.edit_distance_batch([], []).tolist() == []
+    with pytest.raises(ValueError):
+        kaldi_eval.util.edit_distance_batch(refs, hyps[1:])
+
+
+def test_edit_distance_many():
+    refs = [('a', 'b', 'c'), ('b', 'b'), ()]
+    hyps_list = [
+        [('a', 'c'), ('b', 'b', 'd'), ('e',)],
+        [('a', 'b', 'c'), (), ()],
+    ]
+    vocab = dict()
+    act = kaldi_eval.util.edit_distance_many(
+        refs, hyps_list, return_tables=True, vocab=vocab)
+    assert len(act) == len(hyps_list)
+    for hyps, act_ret in zip(hyps_list, act):
+        exp_ret = kaldi_eval.util.edit_distance_batch(
+            refs, hyps, return_tables=True)
+        assert act_ret[0].tolist() == exp_ret[0].tolist()
+        assert act_ret[1:] == exp_ret[1:]
+    assert set(vocab) == set('abcde')
+    with pytest.raises(ValueError):
+        kaldi_eval.util.edit_distance_many(refs, [hyps_list[0][:2]])
+
+
+def test_bootstrap():
+    rng = np.random.RandomState(3)
+    ref_lens = rng.randint(1, 20, 50)
+    errors = rng.binomial(ref_lens, .2)
+    rates = kaldi_eval.util.bootstrap_error_rates(
+        errors, ref_lens, num_samples=10, rng=4)
+    assert rates.shape == (10,)
+    draws = np.random.RandomState(4).randint(50, size=(10, 50))
+    assert np.allclose(
+        rates, errors[draws].sum(1) / ref_lens[draws].sum(1))
+    both = kaldi_eval.util.bootstrap_error_rates(
+        np.stack([errors, errors // 2]), ref_lens, num_samples=10, rng=4)
+    assert both.shape == (10, 2)
+    assert np.allclose(both[:, 0], rates)
+    lower, upper = kaldi_eval.util.bootstrap_confidence_interval(
+        errors, ref_lens, num_samples=500, rng=5)
+    assert lower < errors.sum() / ref_lens.sum() < upper
+    difference, p_value = kaldi_eval.util.paired_bootstrap_test(
+        errors, errors, ref_lens, rng=6)
+    assert difference == 0 and p_value == 1
+    difference, p_value = kaldi_eval.util.paired_bootstrap_test(
+        errors, errors // 2, ref_lens, rng=6)
+    assert difference > 0 and p_value < .01
+    with pytest.raises(ValueError):
+        kaldi_eval.util.bootstrap_error_rates(errors, ref_lens[1:])
+    with pytest.raises(ValueError):
+        kaldi_eval.util.bootstrap_confidence_interval(
+            errors, ref_lens, confidence=1)
+
+
+def test_bootstrap_empty_refs():
+    # with few utterances, many resamples only draw the empty references
+    errors = np.array([2, 0, 1])
+    ref_lens = np.array([0, 0, 4])
+    with np.errstate(all='raise'):
+        rates = kaldi_eval.util.bootstrap_error_rates(
+            errors, ref_lens, num_samples=200, rng=1)
+        assert np.isnan(rates).any() and not np.isinf(rates).any()
+        lower, upper = kaldi_eval.util.bootstrap_confidence_interval(
+            errors, ref_lens, num_samples=200, rng=1)
+        assert np.isfinite(lower) and np.isfinite(upper)
+        assert lower <= upper
+        difference, p_value = kaldi_eval.util.paired_bootstrap_test(
+            errors, errors, ref_lens, num_samples=200, rng=1)
+        assert difference == 0 and p_value == 1
+    with pytest.raises(ValueError):
+        kaldi_eval.util.bootstrap_confidence_interval(errors, [0, 0, 0])
+    with pytest.raises(ValueError):
+        kaldi_eval.util.paired_bootstrap_test(errors, errors, [0, 0, 0])
@@ -131,6 +131,36 @@ def test_write_table_to_torch_dir(temp_dir):
     assert torch.allclose(a, torch.load(os.path.join(out_dir, 'a.pt')))
 
 
+@pytest.mark.pytorch
+def test_write_table_to_torch_dir_parallel(temp_dir):
+    import torch
+    out_dir = os.path.join(temp_dir, 'test_write_table_to_torch_dir')
+    os.makedirs(out_dir)
+    rwspecifier = 'ark,scp:{0}.ark,{0}.scp'.format(
+        os.path.join(temp_dir, 'table'))
+    values = [torch.rand(idx + 1, 4) for idx in range(10)]
+    keys = ['{:02d}'.format(idx) for idx in range(10)]
+    with kaldi_open(rwspecifier, 'fm', mode='w') as table:
+        for key, value in zip(keys, values):
+            table.write(key, value.numpy())
+    rspecifier = 'scp:' + os.path.join(temp_dir, 'table.scp')
+    assert not command_line.write_table_to_torch_dir(
+        [rspecifier, out_dir, '--num-workers', '3'])
+    assert sorted(os.listdir(out_dir)) == [key + '.pt' for key in keys]
+    for key, value in zip(keys, values):
+        assert torch.allclose(
+            value, torch.load(os.path.join(out_dir, key + '.pt')))
+    # existing files are kept as they are
+    torch.save(torch.zeros(1), os.path.join(out_dir, '03.pt'))
+    os.remove(os.path.join(out_dir, '05.pt'))
+    assert not command_line.write_table_to_torch_dir(
+        [rspecifier, out_dir, '--skip-existing', '--num-workers', '2'])
+    assert torch.equal(
+        torch.zeros(1), torch.load(os.path.join(out_dir, '03.pt')))
+    assert torch.allclose(
+        values[5], torch.load(os.path.join(out_dir, '05.pt')))
+
+
 @pytest.mark.pytorch
 def test_write_torch_dir_to_table(temp_dir):
     import torch
@@ -152,3 +182,53 @@ def test_write_torch_dir_to_table(temp_dir):
     assert len(vals) == 3
     for dval, tval in zip((a, b, c), vals):
         assert torch.allclose(dval, torch.from_numpy(tval))
+
+
+@pytest.mark.pytorch
+def test_write_torch_dir_to_table_parallel(temp_dir):
+    import torch
+    in_dir = os.path.join(temp_dir, 'test_write_torch_dir_to_table')
+    os.makedirs(in_dir)
+    values = [torch.rand(idx + 1, 3) for idx in range(20)]
+    keys = ['{:02d}'.format(idx) for idx in range(20)]
+    for key, value in zip(keys, values):
+        torch.save(value, os.path.join(in_dir, key + '.pt'))
+    ark = os.path.join(temp_dir, 'table.ark')
+    scp = os.path.join(temp_dir, 'table.scp')
+    assert not command_line.write_torch_dir_to_table(
+        [in_dir, 'ark:' + ark, '--num-workers', '3', '--scp', scp])
+    with kaldi_open('ark:' + ark, 'bm') as table:
+        assert list(table.keys()) == keys
+    with kaldi_open('scp:' + scp, 'bm', mode='r+') as table:
+        for key, value in zip(keys, values):
+            assert torch.allclose(value, torch.from_numpy(table[key]))
+    assert command_line.write_torch_dir_to_table(
+        [in_dir, 'scp:' + scp, '--scp', scp])
+
+
+def test_build_ark_index(temp_dir):
+    from pydrobert.kaldi.io.ark_index import ark_index_path
+    from pydrobert.kaldi.io.ark_index import load_ark_index
+    ark_path = os.path.join(temp_dir, 'feats.ark')
+    values = {
+        'utt{}'.format(idx): np.random.random((idx + 1, 5)).astype(np.float32)
+        for idx in range(10)
+    }
+    with kaldi_open('ark:' + ark_path, 'fm', mode='w') as writer:
+        for key in sorted(values):
+            writer.write(key, values[key])
+    assert not command_line.build_ark_index(['ark:' + ark_path, '-i', 'fm'])
+    index = load_ark_index(ark_path)
+    assert sorted(index) == sorted(values)
+    for key, entry in index.items():
+        assert entry.shape == values[key].shape
+    other_path = os.path.join(temp_dir, 'other.idx')
+    assert not command_line.build_ark_index(
+        ['ark:' + ark_path, other_path, '-i', 'fm'])
+    assert load_ark_index(ark_path, other_path) == index
+    with kaldi_open('ark:' + ark_path, 'fm', mode='r+') as reader:
+        for key, value in values.items():
+            assert np.allclose(reader[key], value)
+    os.remove(ark_index_path(ark_path))
+    assert command_line.build_ark_index(
+        ['scp:' + ark_path, '-i', 'fm'])
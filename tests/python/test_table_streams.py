@@ -18,6 +18,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
 import platform
 
 import numpy as np
@@ -143,6 +144,364 @@ def test_cache(temp_file_1_name):
         assert r['b']
 
 
+@pytest.mark.parametrize('cache_policy', ['lru', 'lfu'])
+def test_cache_budget(temp_file_1_name, cache_policy):
+    values = [np.full(10, key, dtype=np.float64) for key in range(4)]
+    with io_open('ark:' + temp_file_1_name, 'dv', mode='w') as writer:
+        for key, value in enumerate(values):
+            writer.write(str(key), value)
+    with io_open(
+            'ark:' + temp_file_1_name, 'dv', mode='r+', cache=True,
+            cache_size=2 * values[0].nbytes,
+            cache_policy=cache_policy) as r:
+        assert np.allclose(r['0'], values[0])
+        assert np.allclose(r['0'], values[0])
+        assert np.allclose(r['1'], values[1])
+        assert (r.cache_hits, r.cache_misses, r.cache_evictions) == (1, 2, 0)
+        assert r.cache_nbytes == 2 * values[0].nbytes
+        assert np.allclose(r['1'], values[1])
+        assert np.allclose(r['1'], values[1])
+        assert np.allclose(r['2'], values[2])
+        assert r.cache_evictions == 1
+        assert r.cache_nbytes == 2 * values[0].nbytes
+        # LRU evicts '0', which was used least recently. LFU evicts '0' too
+        # ('1' has been used more). Now '2' was used most recently, but
+        # '1' most frequently
+        assert set(r.cache_dict) == {'1', '2'}
+        assert np.allclose(r['3'], values[3])
+        if cache_policy == 'lru':
+            assert set(r.cache_dict) == {'2', '3'}
+        else:
+            assert set(r.cache_dict) == {'1', '3'}
+        act_values = r.get_many(['3', '0', '3'])
+        for act_value, key in zip(act_values, (3, 0, 3)):
+            assert np.allclose(act_value, values[key])
+        assert r.cache_nbytes <= 2 * values[0].nbytes
+    with io_open(
+            'ark:' + temp_file_1_name, 'dv', mode='r+', cache=True,
+            cache_size=values[0].nbytes - 1) as r:
+        assert np.allclose(r['0'], values[0])
+        assert not r.cache_dict
+        assert r.cache_nbytes == 0
+    # a budget implies caching
+    with io_open(
+            'ark:' + temp_file_1_name, 'dv', mode='r+',
+            cache_size=values[0].nbytes) as r:
+        assert np.allclose(r['0'], values[0])
+        assert set(r.cache_dict) == {'0'}
+    with pytest.raises(ValueError):
+        io_open(
+            'ark:' + temp_file_1_name, 'dv', mode='r+', cache=True,
+            cache_policy='fifo')
+    with pytest.raises(ValueError):
+        io_open(
+            'ark:' + temp_file_1_name, 'dv', mode='r+', cache_policy='lfu')
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_shared_cache(temp_dir, temp_file_1_name, cache, monkeypatch):
+    from pydrobert.kaldi.io.shared_cache import SharedValueCache
+    values = [np.random.random((3, 4)), np.random.random((0, 0))]
+    with io_open('ark:' + temp_file_1_name, 'dm', mode='w') as writer:
+        for key, value in enumerate(values):
+            writer.write(str(key), value)
+    shared_cache = SharedValueCache('foo', root=temp_dir)
+    with io_open(
+            'ark:' + temp_file_1_name, 'dm', mode='r+', cache=cache,
+            shared_cache=shared_cache) as r:
+        assert r.shared_cache is shared_cache
+        assert np.allclose(r['0'], values[0])
+        assert r.get_many(['1', '0'])[0].shape == (0, 0)
+        assert 'a' not in r
+        with pytest.raises(KeyError):
+            r['a']
+    assert shared_cache.hits == (0 if cache else 1)
+    # another process attaching to the cache would behave the same
+    attached = SharedValueCache('foo', root=temp_dir)
+    with io_open(
+            'ark:' + temp_file_1_name, 'dm', mode='r+',
+            shared_cache=attached) as r:
+        for key, value in enumerate(values):
+            act_value = r[str(key)]
+            assert not act_value.flags.writeable
+            assert np.allclose(act_value, value)
+        table_id = r._shared_table
+    assert attached.hits == 2
+    assert attached.misses == 0
+    # the same table through a relative path shares entries
+    monkeypatch.chdir(os.path.dirname(temp_file_1_name))
+    with io_open(
+            'ark:' + os.path.basename(temp_file_1_name), 'dm', mode='r+',
+            shared_cache=attached) as r:
+        assert r._shared_table == table_id
+        assert np.allclose(r['0'], values[0])
+    assert attached.hits == 3
+    # entries are keyed by table as well as key
+    assert (table_id, '0') in attached
+    with io_open(
+            'ark:' + temp_file_1_name, 'fm', mode='r+',
+            shared_cache=attached) as r:
+        assert r._shared_table != table_id
+    # a rewritten archive gets new entries
+    with io_open('ark:' + temp_file_1_name, 'dm', mode='w') as writer:
+        writer.write('0', values[0] + 1)
+    os.utime(temp_file_1_name, (0, 0))
+    with io_open(
+            'ark:' + temp_file_1_name, 'dm', mode='r+',
+            shared_cache=attached) as r:
+        assert r._shared_table != table_id
+        assert np.allclose(r['0'], values[0] + 1)
+    attached.unlink()
+    with pytest.raises(KeyError):
+        shared_cache.get(table_id, '0')
+
+
+@pytest.mark.parametrize('dtype', ['bm', 'dm', 'fm', 'bv', 'dv', 'fv'])
+@pytest.mark.parametrize('bg', [True, False])
+def test_zero_copy(temp_file_1_name, dtype, bg):
+    np_dtype = np.float64 if KaldiDataType(dtype).is_double else np.float32
+    if dtype.endswith('m'):
+        values = [np.random.random((10, 13)), np.random.random((0, 0))]
+    else:
+        values = [np.random.random(13), np.random.random(0)]
+    values.append(values[0] * 2)
+    values = [value.astype(np_dtype) for value in values]
+    with io_open('ark:' + temp_file_1_name, dtype, mode='w') as writer:
+        for key, value in enumerate(values):
+            writer.write(str(key), value)
+    specifier = ('ark,bg:' if bg else 'ark:') + temp_file_1_name
+    act_values = []
+    with io_open(specifier, dtype, zero_copy=True) as reader:
+        while not reader.done():
+            act_value = reader.value()
+            # a second call should not lose the swapped-out value
+            assert act_value is reader.value()
+            act_values.append(act_value)
+            reader.move()
+    assert len(act_values) == len(values)
+    for value, act_value in zip(values, act_values):
+        assert value.shape == act_value.shape
+        assert np.allclose(value, act_value)
+    with io_open(specifier, dtype, zero_copy=True) as reader:
+        act_values = list(reader)
+    for value, act_value in zip(values, act_values):
+        assert np.allclose(value, act_value)
+
+
+@pytest.mark.parametrize('dtype', ['bm', 'dv', 'fm', 'iv', 't'])
+@pytest.mark.parametrize('cache', [True, False])
+def test_get_many(temp_file_1_name, dtype, cache):
+    if dtype == 't':
+        values = ['foo', 'bar']
+    elif dtype == 'iv':
+        values = [(1, 2, 3), (4, 5)]
+    else:
+        np_dtype = np.float64 if KaldiDataType(dtype).is_double else np.float32
+        if dtype.endswith('m'):
+            values = [np.random.random((3, 4)), np.random.random((5, 2))]
+        else:
+            values = [np.random.random(3), np.random.random(5)]
+        values = [value.astype(np_dtype) for value in values]
+    keys = ['b', 'a']
+    with io_open('ark:' + temp_file_1_name, dtype, mode='w') as writer:
+        for key, value in zip(('a', 'b'), values):
+            writer.write(key, value)
+    with io_open(
+            'ark:' + temp_file_1_name, dtype, mode='r+', cache=cache) as r:
+        act_values = r.get_many(keys)
+        assert len(act_values) == 2
+        assert np.all(act_values[0] == values[1])
+        assert np.all(act_values[1] == values[0])
+        with pytest.raises(KeyError):
+            r.get_many(['a', 'c'])
+        act_values = r.get_many(['c', 'a', 'b', 'a'], ignore_missing=True)
+        assert act_values[0] is None
+        assert np.all(act_values[1] == values[0])
+        assert np.all(act_values[2] == values[1])
+        assert np.all(act_values[3] == values[0])
+        assert np.all(r['b'] == values[1])
+        with pytest.raises(KeyError):
+            r['c']
+        if dtype in {'t', 'iv'}:
+            with pytest.raises(ValueError):
+                r.get_many(keys, stack=True)
+            return
+        batch = r.get_many(keys, stack=True, fill_value=-1)
+        assert batch.shape == (2,) + tuple(
+            max(dims) for dims in zip(values[0].shape, values[1].shape))
+        for act_value, value in zip(batch, values[::-1]):
+            slices = tuple(slice(0, dim) for dim in value.shape)
+            assert np.all(act_value[slices] == value)
+            act_value[slices] = -1
+            assert np.all(act_value == -1)
+    r = io_open('ark:' + temp_file_1_name, dtype, mode='r+')
+    r.close()
+    with pytest.raises(IOError):
+        r.get_many(keys)
+
+
+@pytest.mark.parametrize('dtype,values', [
+    ('fm', [
+        np.ones((3, 4), dtype=np.float32),
+        np.zeros((0, 0), dtype=np.float32),
+        np.arange(6, dtype=np.float32).reshape(2, 3),
+    ]),
+    ('dv', [np.arange(5), np.zeros(0), np.ones(2)]),
+    ('t', ['foo', 'bar', 'baz']),
+    ('iv', [(1, 2), tuple(), (3,)]),
+    ('B', [True, False, True]),
+])
+@pytest.mark.parametrize('is_text', [True, False])
+def test_ark_index(temp_dir, dtype, values, is_text):
+    from pydrobert.kaldi.io import ark_index
+    ark_path = os.path.join(temp_dir, 'foo.ark')
+    specifier = ('ark,t:' if is_text else 'ark:') + ark_path
+    keys = ['c', 'a', 'b']
+    with io_open(specifier, dtype, mode='w') as writer:
+        for key, value in zip(keys, values):
+            writer.write(key, value)
+    index = ark_index.build_ark_index('ark:' + ark_path, dtype)
+    assert os.path.isfile(ark_index.ark_index_path(ark_path))
+    assert list(index) == keys
+    for value, entry in zip(values, index.values()):
+        assert entry.file == ark_path
+        assert entry.shape == np.array(value).shape
+    assert ark_index.load_ark_index(ark_path) == index
+    with io_open('ark:' + ark_path, dtype, mode='r+') as reader:
+        assert isinstance(
+            reader, table_streams._KaldiIndexedRandomAccessReader)
+        assert 'd' not in reader
+        for key, value in zip(keys, values):
+            assert key in reader
+            act_value = reader[key]
+            if dtype == 'fm':
+                assert act_value.dtype == np.float32
+            assert np.all(act_value == value)
+        act_values = reader.get_many(['b', 'd', 'c'], ignore_missing=True)
+        assert np.all(act_values[0] == values[2])
+        assert act_values[1] is None
+        assert np.all(act_values[2] == values[0])
+    with io_open('ark:' + ark_path, 'bm' if dtype != 'bm' else 'fm',
+                 mode='r+') as reader:
+        # index was built for a different type
+        assert not isinstance(
+            reader, table_streams._KaldiIndexedRandomAccessReader)
+    with io_open(specifier, dtype, mode='w') as writer:
+        writer.write('d', values[0])
+    with pytest.warns(UserWarning):
+        reader = io_open('ark:' + ark_path, dtype, mode='r+')
+    assert not isinstance(
+        reader, table_streams._KaldiIndexedRandomAccessReader)
+    assert 'd' in reader
+    reader.close()
+    # an empty index still belongs to its data type
+    with io_open(specifier, dtype, mode='w'):
+        pass
+    ark_index.build_ark_index('ark:' + ark_path, dtype)
+    assert ark_index.find_ark_index('ark:' + ark_path, dtype) == {}
+    assert ark_index.find_ark_index(
+        'ark:' + ark_path, 'bm' if dtype != 'bm' else 'fm') is None
+
+
+@pytest.mark.parametrize('dtype', ['bm', 'dm', 'fm'])
+def test_memory_map(temp_file_1_name, dtype):
+    import struct
+    np_dtype = np.float64 if KaldiDataType(dtype).is_double else np.float32
+    other_dtype = 'fm' if KaldiDataType(dtype).is_double else 'dm'
+    value = np.random.random((10, 3)).astype(np_dtype)
+    buf = b''
+    for specifier, key, kaldi_dtype, value_ in (
+            ('ark:', '0', dtype, value),
+            ('ark:', '1', dtype, np.zeros((0, 0), dtype=np_dtype)),
+            ('ark:', '2', other_dtype, value.astype(
+                np.float32 if np_dtype == np.float64 else np.float64)),
+            ('ark,t:', '3', dtype, value)):
+        with io_open(specifier + temp_file_1_name, kaldi_dtype, 'w') as w:
+            w.write(key, value_)
+        with open(temp_file_1_name, 'rb') as file_obj:
+            buf += file_obj.read()
+    # a two-byte compressed matrix of all zeros, and a one-byte one of all
+    # ones
+    buf += b'4 \0BCM2 ' + struct.pack('<ffii', 0., 1., 2, 3) + b'\0' * 12
+    buf += b'5 \0BCM3 ' + struct.pack('<ffii', 1., 0., 3, 2) + b'\0' * 6
+    with open(temp_file_1_name, 'wb') as file_obj:
+        file_obj.write(buf)
+    with io_open('ark:' + temp_file_1_name, dtype) as reader:
+        exp_items = list(reader.items())
+    assert len(exp_items) == 6
+    with io_open(
+            'ark:' + temp_file_1_name, dtype, memory_map=True) as reader:
+        assert isinstance(
+            reader, table_streams._KaldiSequentialMemoryMappedReader)
+        act_items = list(reader.items())
+    assert [key for key, _ in act_items] == [key for key, _ in exp_items]
+    for (_, exp_value), (key, act_value) in zip(exp_items, act_items):
+        assert act_value.dtype == np_dtype
+        assert exp_value.shape == act_value.shape
+        assert np.allclose(exp_value, act_value)
+        # only binary matrices of the same precision are views into the
+        # (read-only) mapping
+        assert act_value.flags.writeable == (key not in {'0', '1'})
+    with io_open(
+            'ark:' + temp_file_1_name, dtype, mode='r+',
+            memory_map=True) as reader:
+        assert isinstance(
+            reader, table_streams._KaldiRandomAccessMemoryMappedReader)
+        assert '6' not in reader
+        for key, exp_value in exp_items[::-1]:
+            assert np.allclose(reader[key], exp_value)
+        act_values = reader.get_many(['5', '0'])
+    assert np.allclose(act_values[0], exp_items[5][1])
+    assert np.allclose(act_values[1], exp_items[0][1])
+
+
+@pytest.mark.parametrize('dtype', ['bm', 'dm', 'fm', 'bv', 'dv', 'fv'])
+@pytest.mark.parametrize('is_text', [True, False])
+def test_metadata_only(temp_file_1_name, temp_file_2_name, dtype, is_text):
+    import struct
+    kaldi_dtype = KaldiDataType(dtype)
+    np_dtype = np.float64 if kaldi_dtype.is_double else np.float32
+    if kaldi_dtype.is_matrix:
+        shapes = [(10, 3), (0, 0), (1, 4)]
+    else:
+        shapes = [(10,), (0,), (4,)]
+    values = [np.random.random(shape).astype(np_dtype) for shape in shapes]
+    wspecifier = 'ark{},scp:{},{}'.format(
+        ',t' if is_text else '', temp_file_1_name, temp_file_2_name)
+    with io_open(wspecifier, dtype, mode='w') as writer:
+        for key, value in enumerate(values):
+            writer.write(str(key), value)
+    for rspecifier in (
+            'ark:' + temp_file_1_name,
+            'scp:' + temp_file_2_name,
+            'ark:cat {}|'.format(temp_file_1_name)):
+        with io_open(rspecifier, dtype, metadata_only=True) as reader:
+            assert isinstance(
+                reader, table_streams._KaldiSequentialMetadataReader)
+            act_items = list(reader.items())
+        assert [key for key, _ in act_items] == ['0', '1', '2']
+        for (_, metadata), value in zip(act_items, values):
+            assert metadata.shape == value.shape
+            if rspecifier.endswith('|'):
+                assert metadata.compressed is None
+            else:
+                assert metadata.compressed is False
+                assert metadata.dtype == np_dtype
+    if kaldi_dtype.is_matrix and not is_text:
+        with open(temp_file_1_name, 'ab') as file_obj:
+            file_obj.write(
+                b'3 \0BCM2 ' + struct.pack('<ffii', 0., 1., 2, 3) +
+                b'\0' * 12)
+        with io_open(
+                'ark:' + temp_file_1_name, dtype,
+                metadata_only=True) as reader:
+            act_metadata = list(reader)
+        assert len(act_metadata) == 4
+        assert act_metadata[-1] == ((2, 3), np.float32, True)
+    with pytest.raises(ValueError):
+        io_open('ark:' + temp_file_1_name, 't', metadata_only=True)
+
+
 def test_invalid_tv_does_not_segfault(temp_file_1_name):
     # weird bug I found
     tv = 'foo bar'
@@ -313,6 +672,37 @@ def test_read_random(temp_file_1_name):
     assert np.allclose(reader['was'], [2])
 
 
+def test_read_tables_concurrently(temp_dir):
+    from multiprocessing.pool import ThreadPool
+    num_tables, num_keys = 4, 20
+    rspecifiers = []
+    for table_idx in range(num_tables):
+        path = os.path.join(temp_dir, '{}.ark'.format(table_idx))
+        with io_open('ark:' + path, 'dm', mode='w') as writer:
+            for key in range(num_keys):
+                writer.write(str(key), np.full((5, 3), table_idx + key))
+        rspecifiers.append('ark:' + path)
+
+    def _sum_table(rspecifier):
+        with io_open(rspecifier, 'dm') as seq_reader, \
+                io_open(rspecifier, 'dm', mode='r+') as ra_reader:
+            total = 0.
+            for key, value in seq_reader.items():
+                assert key in ra_reader
+                assert np.allclose(value, ra_reader[key])
+                total += value.sum()
+        return total
+    pool = ThreadPool(num_tables)
+    try:
+        totals = pool.map(_sum_table, rspecifiers)
+    finally:
+        pool.close()
+        pool.join()
+    for table_idx, total in enumerate(totals):
+        assert np.isclose(
+            total, 15 * sum(table_idx + key for key in range(num_keys)))
+
+
 def test_write_script_and_archive(temp_file_1_name, temp_file_2_name):
     values = {
         'foo': np.ones((21, 32), dtype=np.float64),
@@ -335,6 +725,121 @@ def test_write_script_and_archive(temp_file_1_name, temp_file_2_name):
     assert np.allclose(reader['bar'], values['bar']), "Failed doublecheck"
 
 
+@pytest.mark.parametrize('dtype', ['fm', 'dv', 'bm', 'iv'])
+def test_write_many_and_padded(temp_file_1_name, dtype):
+    kaldi_dtype = KaldiDataType(dtype)
+    ndim = 3 if kaldi_dtype.is_matrix else 2
+    if kaldi_dtype.is_floating_point:
+        np_dtype = np.float64 if kaldi_dtype.is_double else np.float32
+    else:
+        np_dtype = np.int32
+    shape = (4, 5, 3)[:ndim]
+    batch = np.arange(np.prod(shape), dtype=np_dtype).reshape(shape)
+    lengths = np.array([5, 0, 2, 3], dtype=np.int64)
+    keys = ['a', 'b', 'c', 'd']
+    exp = [value[:length] for value, length in zip(batch, lengths)]
+    if kaldi_dtype.is_matrix:
+        # kaldi can't store matrices with one empty dimension
+        exp[1] = np.empty((0, 0), dtype=np_dtype)
+    with io_open('ark:' + temp_file_1_name, dtype, mode='w') as writer:
+        writer.write_padded(keys, batch, lengths)
+        writer.write_many(['e', 'f'], exp[:2])
+        with pytest.raises(ValueError):
+            writer.write_many(['g'], exp[:2])
+        with pytest.raises(ValueError):
+            writer.write_padded(keys, batch, lengths[:3])
+        with pytest.raises(ValueError):
+            writer.write_padded(keys, batch, lengths + 1)
+    with pytest.raises(IOError):
+        writer.write_many(keys[:1], exp[:1])
+    with io_open('ark:' + temp_file_1_name, dtype) as reader:
+        act = [(key, value) for key, value in reader.items()]
+    assert [key for key, _ in act] == keys + ['e', 'f']
+    for exp_value, (_, act_value) in zip(exp + exp[:2], act):
+        assert np.array_equal(exp_value, act_value)
+
+
+@pytest.mark.parametrize('limit', ['entries', 'bytes'])
+def test_sharded_writer_rollover(temp_dir, limit):
+    archive = os.path.join(temp_dir, 'feats.ark')
+    script = os.path.join(temp_dir, 'feats.scp')
+    kwargs = {'max_entries': 10} if limit == 'entries' else {
+        'max_bytes': 10 * 4 * 3 * 8}
+    keys = tuple('{:02d}'.format(idx) for idx in range(25))
+    with table_streams.ShardedKaldiWriter(
+            'ark,scp:{},{}'.format(archive, script), 'dm', **kwargs) as writer:
+        for idx, key in enumerate(keys):
+            writer.write(key, np.full((4, 3), idx, dtype=np.float64))
+    assert writer.shard_paths == [
+        os.path.join(temp_dir, 'feats.{}.ark'.format(idx))
+        for idx in range(3)]
+    assert sorted(os.listdir(temp_dir)) == [
+        'feats.0.ark', 'feats.1.ark', 'feats.2.ark', 'feats.scp']
+    with io_open('scp:' + script, 'dm') as reader:
+        assert tuple(reader.keys()) == keys
+    with io_open('ark:' + writer.shard_paths[-1], 'dm') as reader:
+        assert tuple(reader.keys()) == keys[20:]
+    with io_open('scp:' + script, 'dm', mode='r+') as reader:
+        for idx, key in enumerate(keys):
+            assert np.all(reader[key] == idx)
+
+
+def test_sharded_writer_threads_and_ranks(temp_dir):
+    import threading
+    archive = os.path.join(temp_dir, 'toks{}.ark')
+    script = os.path.join(temp_dir, 'toks.scp')
+    num_threads, num_keys = 4, 30
+    writers = [
+        table_streams.ShardedKaldiWriter(
+            'ark,scp:{},{}'.format(archive, script), 'tv', max_entries=4,
+            rank=rank, world_size=2)
+        for rank in range(2)
+    ]
+
+    def _write(thread_idx):
+        writer = writers[thread_idx % 2]
+        for key_idx in range(num_keys):
+            writer.write(
+                '{}_{:02d}'.format(thread_idx, key_idx),
+                ['tok', str(thread_idx)])
+    threads = [
+        threading.Thread(target=_write, args=(thread_idx,))
+        for thread_idx in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for writer in writers:
+        writer.close()
+    shard_paths = writers[0].shard_paths + writers[1].shard_paths
+    assert len(set(shard_paths)) == len(shard_paths)
+    for rank, writer in enumerate(writers):
+        assert all(
+            path == archive.format(idx * 2 + rank)
+            for idx, path in enumerate(writer.shard_paths))
+    for path in shard_paths:
+        with io_open('ark:' + path, 'tv') as reader:
+            # each shard is written to by one thread
+            assert len(set(value for value in reader)) == 1
+    with io_open('scp:' + script, 'tv') as reader:
+        act = {key: value for key, value in reader.items()}
+    assert len(act) == num_threads * num_keys
+    for key, value in act.items():
+        assert value == ('tok', key.split('_')[0])
+
+
+def test_sharded_writer_invalid(temp_file_1_name, temp_file_2_name):
+    with pytest.raises(ValueError):
+        table_streams.ShardedKaldiWriter('ark:' + temp_file_1_name, 'dm')
+    with pytest.raises(ValueError):
+        table_streams.ShardedKaldiWriter(
+            'ark,scp:-,{}'.format(temp_file_2_name), 'dm')
+    with pytest.raises(ValueError):
+        table_streams.ShardedKaldiWriter(
+            'ark,scp:{},{}'.format(temp_file_1_name, temp_file_2_name), 'dm',
+            rank=2, world_size=2)
+
+
 @pytest.mark.skipif(platform.system() == 'Windows', reason='Not posix')
 def test_read_write_pipe_posix(temp_file_1_name):
     value = np.ones((1000, 10000), dtype=np.float32)
@@ -0,0 +1,137 @@
+# Copyright 2018 Sean Robertson
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pytests for `pydrobert.kaldi.io.torch`"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from pydrobert.kaldi.io import open as io_open
+
+torch = pytest.importorskip('torch')
+kaldi_torch = pytest.importorskip('pydrobert.kaldi.io.torch')
+
+pytestmark = pytest.mark.pytorch
+
+
+@pytest.fixture
+def tables(temp_dir):
+    keys = tuple('{:02d}'.format(idx) for idx in range(13))
+    feats = os.path.join(temp_dir, 'feats')
+    toks = os.path.join(temp_dir, 'toks')
+    with io_open('ark,scp:{0}.ark,{0}.scp'.format(feats), 'fm', 'w') as f, \
+            io_open('ark,scp:{0}.ark,{0}.scp'.format(toks), 't', 'w') as t:
+        for idx, key in enumerate(keys):
+            f.write(key, np.full((idx % 4 + 1, 3), idx, dtype=np.float32))
+            t.write(key, 'tok' + key)
+    return keys, ('scp,s:' + feats + '.scp', 'fm'), (
+        'scp,s:' + toks + '.scp', 't')
+
+
+def test_kaldi_dataset(tables):
+    keys, feats, toks = tables
+    dataset = kaldi_torch.KaldiDataset(
+        feats, toks, add_key=True, axis_lengths=0)
+    assert dataset.key_list == keys
+    assert len(dataset) == len(keys)
+    assert dataset.lengths() == [idx % 4 + 1 for idx in range(len(keys))]
+    key, feat, tok, length = dataset[5]
+    assert key == keys[5]
+    assert isinstance(feat, torch.Tensor)
+    assert feat.shape == (2, 3)
+    assert torch.all(feat == 5)
+    assert tok == 'tok' + keys[5]
+    assert length == 2
+    samples = dataset.__getitems__([5, 0])
+    assert [sample[0] for sample in samples] == [keys[5], keys[0]]
+    assert torch.equal(samples[0][1], feat)
+    # handles are reopened after pickling
+    dataset = pickle.loads(pickle.dumps(dataset))
+    assert torch.equal(dataset[5][1], feat)
+    dataset = kaldi_torch.KaldiDataset(feats, key_list=('nope',))
+    with pytest.raises(IOError):
+        dataset[0]
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_iterable_dataset(tables, num_workers):
+    keys, feats, toks = tables
+    dataset = kaldi_torch.KaldiIterableDataset(feats, toks, add_key=True)
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=3, num_workers=num_workers,
+        collate_fn=kaldi_torch.KaldiCollator(pin_memory=False))
+    act_keys = []
+    for batch_keys, batch_feats, batch_toks in loader:
+        assert batch_feats.shape[0] == len(batch_keys)
+        assert batch_toks == ['tok' + key for key in batch_keys]
+        act_keys.extend(batch_keys)
+    assert sorted(act_keys) == list(keys)
+
+
+def test_collator():
+    collator = kaldi_torch.KaldiCollator(
+        pin_memory=False, constant_values=-1)
+    samples = [
+        ('a', torch.ones(2, 3), 2),
+        ('b', torch.ones(4, 1), 4),
+    ]
+    keys, batch, lengths = collator(samples)
+    assert keys == ['a', 'b']
+    assert batch.shape == (2, 4, 3)
+    assert torch.all(batch[0, :2] == 1) and torch.all(batch[0, 2:] == -1)
+    assert torch.all(batch[1, :, :1] == 1)
+    assert torch.all(batch[1, :, 1:] == -1)
+    assert lengths.tolist() == [2, 4]
+    batch = collator([torch.arange(3), torch.arange(3)])
+    assert batch.tolist() == [[0, 1, 2]] * 2
+
+
+@pytest.mark.parametrize('world_size', [1, 2])
+def test_bucket_batch_sampler(tables, world_size):
+    keys, feats, toks = tables
+    dataset = kaldi_torch.KaldiDataset(feats, toks)
+    lengths = dataset.lengths()
+    samplers = [
+        kaldi_torch.BucketBatchSampler(
+            lengths, max_frames=6, num_buckets=2, rng=1, rank=rank,
+            world_size=world_size)
+        for rank in range(world_size)
+    ]
+    for _ in range(2):
+        epoch = []
+        for sampler in samplers:
+            batches = list(sampler)
+            assert len(batches) == len(sampler)
+            for batch in batches:
+                assert len(batch) == 1 or \
+                    len(batch) * max(lengths[idx] for idx in batch) <= 6
+            epoch.extend(idx for batch in batches for idx in batch)
+        assert len(set(epoch)) == len(epoch)
+        if world_size == 1:
+            assert sorted(epoch) == list(range(len(keys)))
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_sampler=samplers[0], num_workers=2,
+        collate_fn=kaldi_torch.KaldiCollator(pin_memory=False))
+    for batch_feats, batch_toks in loader:
+        assert batch_feats.shape[0] == len(batch_toks)
+        assert batch_feats.shape[1] <= 6
+    with pytest.raises(ValueError):
+        kaldi_torch.BucketBatchSampler(lengths)